@@ -1,6 +1,45 @@
 from django.contrib import admin
-from .models import Player, SinglesGame
+from django.db import transaction
+
+from . import corrections
+from .models import DoublesGame, Player, SinglesGame
+
+
+class GameAdmin(admin.ModelAdmin):
+    # Every later game's ratings follow from a game, so games are saved and
+    # deleted through corrections, which replays whatever they affect.
+    actions = ['void_selected']
+    list_display = ('__str__', 'date')
+    list_filter = ('date',)
+
+    def get_readonly_fields(self, request, obj=None):
+        # Worked out by the correction, not typed in
+        return [field.name for field in self.model._meta.fields
+                if field.name.endswith('_rating')]
+
+    def get_actions(self, request):
+        actions = super(GameAdmin, self).get_actions(request)
+        # A bulk delete would leave every later rating wrong
+        actions.pop('delete_selected', None)
+        return actions
+
+    def save_model(self, request, obj, form, change):
+        corrections.save_game(obj)
+
+    def delete_model(self, request, obj):
+        corrections.void_game(obj)
+
+    def void_selected(self, request, queryset):
+        games = list(queryset.order_by('-date', '-id'))
+        # Latest first, so every correction has the least history to replay.
+        # All or none of them are voided.
+        with transaction.atomic():
+            for game in games:
+                corrections.void_game(game)
+        self.message_user(request, 'Voided %d games.' % len(games))
+    void_selected.short_description = 'Void selected games'
 
 
 admin.site.register(Player)
-admin.site.register(SinglesGame)
+admin.site.register(SinglesGame, GameAdmin)
+admin.site.register(DoublesGame, GameAdmin)
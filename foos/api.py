@@ -0,0 +1,185 @@
+"""
+Read-only JSON API for dashboards and bots.
+
+Everything here only changes when a game is recorded or history is
+rewritten, so every response carries an ETag made from the latest game
+ids and the game rows version. A client that sends it back in
+If-None-Match gets an empty 304 without any of the ranking queries being
+run.
+"""
+import hashlib
+
+from django.contrib.auth.decorators import login_required
+from django.db.models import Max, Q
+from django.http import JsonResponse
+from django.shortcuts import get_object_or_404
+from django.views.decorators.http import etag, require_GET
+
+from .leaderboard_cache import game_rows_version
+from .matchmaking import GAMES, MAX_GAMES, find_games, player_ids
+from .models import DoublesGame, Player, SinglesGame, Team
+
+RECENT_GAMES = 10
+MAX_RECENT_GAMES = 100
+
+
+def games_etag(request, *args, **kwargs):
+    # Two primary key lookups, far cheaper than any ranking query
+    singles = SinglesGame.objects.aggregate(latest=Max('id'))['latest'] or 0
+    doubles = DoublesGame.objects.aggregate(latest=Max('id'))['latest'] or 0
+    # Corrected games and renamed players don't change the latest ids
+    return 'games-%d-%d-%d' % (singles, doubles, game_rows_version())
+
+
+def matchmaking_etag(request):
+    # The same games make different matches for different players present
+    query = hashlib.md5(request.META.get('QUERY_STRING', '').encode('utf-8')).hexdigest()
+    return '%s-%s' % (games_etag(request), query[:12])
+
+
+@login_required
+@require_GET
+@etag(games_etag)
+def singles_rankings(request):
+    players = Player.objects\
+        .filter(singles_games_played__gte=4)\
+        .order_by('-rating', 'id')\
+        .values_list('id', 'name', 'rating', 'singles_wins', 'singles_losses',
+                     'singles_draws', 'singles_games_played')
+    return JsonResponse({'rankings': [{
+        'rank': rank,
+        'id': player_id,
+        'name': name,
+        'rating': rating,
+        'wins': wins,
+        'losses': losses,
+        'draws': draws,
+        'games_played': games_played,
+    } for rank, (player_id, name, rating, wins, losses, draws, games_played)
+        in enumerate(players, 1)]})
+
+
+@login_required
+@require_GET
+@etag(games_etag)
+def doubles_rankings(request):
+    teams = Team.objects\
+        .order_by('-rating', 'id')\
+        .values_list('id', 'player1', 'player1__name', 'player2', 'player2__name',
+                     'rating', 'wins', 'losses', 'draws', 'games_played')
+    return JsonResponse({'rankings': [{
+        'rank': rank,
+        'id': team_id,
+        'players': [
+            {'id': player1_id, 'name': player1_name},
+            {'id': player2_id, 'name': player2_name},
+        ],
+        'rating': rating,
+        'wins': wins,
+        'losses': losses,
+        'draws': draws,
+        'games_played': games_played,
+    } for rank, (team_id, player1_id, player1_name, player2_id, player2_name,
+                 rating, wins, losses, draws, games_played) in enumerate(teams, 1)]})
+
+
+@login_required
+@require_GET
+@etag(games_etag)
+def recent_games(request):
+    try:
+        limit = int(request.GET.get('limit', RECENT_GAMES))
+    except ValueError:
+        limit = RECENT_GAMES
+    limit = max(1, min(limit, MAX_RECENT_GAMES))
+
+    singles = SinglesGame.objects\
+        .order_by('-date', '-id')\
+        .values_list('id', 'date', 'player1', 'player1__name', 'player2', 'player2__name',
+                     'player1_score', 'player2_score',
+                     'player1_start_rating', 'player1_end_rating',
+                     'player2_start_rating', 'player2_end_rating')[:limit]
+    doubles = DoublesGame.objects\
+        .order_by('-date', '-id')\
+        .values_list('id', 'date', 'team1', 'team2',
+                     'team1_score', 'team2_score',
+                     'team1_start_rating', 'team1_end_rating',
+                     'team2_start_rating', 'team2_end_rating')[:limit]
+    return JsonResponse({
+        'singles': [game_json(game_id, date,
+                              {'id': p1_id, 'name': p1_name}, {'id': p2_id, 'name': p2_name},
+                              scores_and_ratings)
+                    for game_id, date, p1_id, p1_name, p2_id, p2_name, *scores_and_ratings
+                    in singles],
+        'doubles': [game_json(game_id, date, {'id': team1_id}, {'id': team2_id},
+                              scores_and_ratings)
+                    for game_id, date, team1_id, team2_id, *scores_and_ratings
+                    in doubles],
+    })
+
+
+@login_required
+@require_GET
+@etag(games_etag)
+def player_summary(request, player_id):
+    player = get_object_or_404(Player, pk=player_id)
+    rank = None
+    if player.singles_games_played >= 4:
+        # Same order as the singles rankings, ties going to the lower id
+        rank = Player.objects\
+            .filter(singles_games_played__gte=4)\
+            .filter(Q(rating__gt=player.rating) | Q(rating=player.rating, id__lt=player.id))\
+            .count() + 1
+    return JsonResponse({
+        'id': player.id,
+        'name': player.name,
+        'rating': player.rating,
+        'singles_rank': rank,
+        'singles': {
+            'wins': player.singles_wins,
+            'losses': player.singles_losses,
+            'draws': player.singles_draws,
+            'games_played': player.singles_games_played,
+        },
+        'doubles': {
+            'wins': player.doubles_wins,
+            'losses': player.doubles_losses,
+            'draws': player.doubles_draws,
+            'games_played': player.doubles_games_played,
+        },
+    })
+
+
+@login_required
+@require_GET
+@etag(matchmaking_etag)
+def matchmaking(request):
+    game_type = request.GET.get('game_type', 'doubles')
+    if game_type not in ('singles', 'doubles'):
+        return JsonResponse({'error': 'game_type must be singles or doubles'}, status=400)
+    try:
+        limit = int(request.GET.get('limit', GAMES))
+    except ValueError:
+        limit = GAMES
+    limit = max(1, min(limit, MAX_GAMES))
+    present = player_ids(request.GET.getlist('players'))
+    return JsonResponse({
+        'game_type': game_type,
+        'games': find_games(game_type, present, limit),
+    })
+
+
+def game_json(game_id, date, side1, side2, scores_and_ratings):
+    """
+    A game as the API and live updates send it. `side1` and `side2` are
+    dicts describing each side, which get its score and ratings added.
+    `scores_and_ratings` is (score1, score2, start1, end1, start2, end2).
+    """
+    score1, score2, start1, end1, start2, end2 = scores_and_ratings
+    side1.update(score=score1, start_rating=start1, end_rating=end1)
+    side2.update(score=score2, start_rating=start2, end_rating=end2)
+    return {
+        'id': game_id,
+        'date': date,
+        'sides': [side1, side2],
+    }
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class FoosConfig(AppConfig):
     name = 'foos'
+
+    def ready(self):
+        # Connects the signal receivers
+        from . import signals
@@ -0,0 +1,203 @@
+"""
+An ASGI front for tabletracker.
+
+This Django version has neither async views nor an async ORM, so every
+page is still answered by the regular WSGI application, run on a bounded
+pool of threads. What the event loop takes over is everything around it:
+
+* Request bodies are read and responses sent on the loop, so a slow
+  client holds a thread only while its view runs, not while its bytes
+  trickle across the network.
+* Live updates are served on the loop itself. A connected wall display
+  is a suspended coroutine instead of a blocked thread, so one process
+  can keep thousands of them open.
+
+The pool size is FOOS_ASGI_THREADS (default 8).
+"""
+import asyncio
+import io
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from importlib import import_module
+
+from django.conf import settings
+from django.contrib.auth import get_user
+from django.db import close_old_connections
+from django.http import HttpRequest
+from django.http.cookie import parse_cookie
+from django.urls import reverse
+
+from . import live
+
+
+class ASGIHandler(object):
+
+    def __init__(self, wsgi_application):
+        self.wsgi_application = wsgi_application
+        self.executor = ThreadPoolExecutor(getattr(settings, 'FOOS_ASGI_THREADS', 8))
+        self.live_path = reverse('foos:live_updates')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] != 'http':
+            raise ValueError('Unsupported ASGI scope type %r' % scope['type'])
+        elif scope['path'] == self.live_path and scope['method'] == 'GET':
+            await self.live_updates(scope, receive, send)
+        else:
+            await self.wsgi(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def wsgi(self, scope, receive, send):
+        loop = asyncio.get_event_loop()
+        body = []
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            body.append(message.get('body', b''))
+            more_body = message.get('more_body', False)
+
+        started = []
+
+        def start_response(status, headers, exc_info=None):
+            started[:] = [status, headers]
+
+        environ = _environ(scope, b''.join(body))
+        result = await loop.run_in_executor(
+            self.executor, self.wsgi_application, environ, start_response)
+        try:
+            status, headers = started
+            await send({
+                'type': 'http.response.start',
+                'status': int(status.split(' ', 1)[0]),
+                # Cookies come out of the handler with a leading space,
+                # which HTTP servers stricter than WSGI ones refuse
+                'headers': [(name.lower().encode('latin1'), value.strip().encode('latin1'))
+                            for name, value in headers],
+            })
+            # Streaming responses are read a chunk at a time, so they keep
+            # their place in the pool only while producing the next chunk
+            chunks = iter(result)
+            while True:
+                chunk = await loop.run_in_executor(self.executor, next, chunks, None)
+                if chunk is None:
+                    break
+                if chunk:
+                    await send({'type': 'http.response.body', 'body': chunk,
+                                'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            # Closing the response ends the request, and releases its
+            # database connection, on a pool thread
+            if hasattr(result, 'close'):
+                await loop.run_in_executor(self.executor, result.close)
+
+    async def live_updates(self, scope, receive, send):
+        loop = asyncio.get_event_loop()
+        authenticated = await loop.run_in_executor(
+            self.executor, _is_authenticated, scope)
+        if not authenticated:
+            await send({'type': 'http.response.start', 'status': 403, 'headers': []})
+            await send({'type': 'http.response.body', 'body': b''})
+            return
+
+        broker = live.get_broker()
+        subscription = broker.subscribe(live.AsyncSubscription(broker, loop))
+        disconnected = asyncio.ensure_future(_disconnected(receive))
+        try:
+            await send({
+                'type': 'http.response.start',
+                'status': 200,
+                'headers': [
+                    (b'content-type', b'text/event-stream'),
+                    (b'cache-control', b'no-cache'),
+                    (b'x-accel-buffering', b'no'),
+                ],
+            })
+            await send({'type': 'http.response.body', 'more_body': True,
+                        'body': live.STREAM_START.encode('utf-8')})
+            while True:
+                message = asyncio.ensure_future(subscription.get(live.KEEPALIVE_SECONDS))
+                await asyncio.wait([message, disconnected],
+                                   return_when=asyncio.FIRST_COMPLETED)
+                if disconnected.done():
+                    message.cancel()
+                    return
+                await send({'type': 'http.response.body', 'more_body': True,
+                            'body': live.format_event(message.result()).encode('utf-8')})
+        finally:
+            subscription.close()
+            disconnected.cancel()
+
+
+async def _disconnected(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+def _is_authenticated(scope):
+    # The same check login_required makes, without the rest of the
+    # request handling. Connections are tidied up as a request would.
+    close_old_connections()
+    try:
+        request = HttpRequest()
+        request.COOKIES = parse_cookie(_header(scope, b'cookie'))
+        engine = import_module(settings.SESSION_ENGINE)
+        request.session = engine.SessionStore(
+            request.COOKIES.get(settings.SESSION_COOKIE_NAME))
+        return get_user(request).is_authenticated
+    finally:
+        close_old_connections()
+
+
+def _header(scope, name):
+    values = [value.decode('latin1') for header, value in scope['headers'] if header == name]
+    return _join(name.decode('latin1'), values)
+
+
+def _join(name, values):
+    # Repeated cookie headers are each a list of cookies. Any other header
+    # repeated is one comma separated list.
+    return ('; ' if name.lower() in ('cookie', 'http_cookie') else ',').join(values)
+
+
+def _environ(scope, body):
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin1'),
+        'QUERY_STRING': scope['query_string'].decode('latin1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/%s' % scope.get('http_version', '1.1'),
+        'REMOTE_ADDR': client[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin1').upper().replace('-', '_')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = 'HTTP_' + name
+        value = value.decode('latin1')
+        if name in environ:
+            value = _join(name, [environ[name], value])
+        environ[name] = value
+    return environ
@@ -0,0 +1,63 @@
+from django.db import connections, router
+
+
+def bulk_update_rows(model, fields, rows, batch_size=1000):
+    """
+    Writes `fields` for many rows of `model` with one prepared UPDATE,
+    sent to the database `batch_size` rows at a time. Each row is the new
+    field values, in order, followed by the primary key.
+    """
+    connection = connections[router.db_for_write(model)]
+    qn = connection.ops.quote_name
+    opts = model._meta
+    fields = [opts.get_field(field) for field in fields]
+    sql = 'UPDATE %s SET %s WHERE %s = %%s' % (
+        qn(opts.db_table),
+        ', '.join('%s = %%s' % qn(field.column) for field in fields),
+        qn(opts.pk.column),
+    )
+    return _execute_batches(connection, sql, fields, rows, batch_size)
+
+
+def bulk_insert_rows(model, fields, rows, batch_size=1000):
+    """
+    Inserts many rows of `model` with one prepared INSERT, sent to the
+    database `batch_size` rows at a time. Each row is the values of
+    `fields`, in order. Unlike bulk_create no model instances are built,
+    which matters when importing hundreds of thousands of rows.
+    """
+    connection = connections[router.db_for_write(model)]
+    qn = connection.ops.quote_name
+    opts = model._meta
+    fields = [opts.get_field(field) for field in fields]
+    sql = 'INSERT INTO %s (%s) VALUES (%s)' % (
+        qn(opts.db_table),
+        ', '.join(qn(field.column) for field in fields),
+        ', '.join(['%s'] * len(fields)),
+    )
+    return _execute_batches(connection, sql, fields, rows, batch_size)
+
+
+def _execute_batches(connection, sql, fields, rows, batch_size):
+    # Integers go to the database as they are; anything else (dates, say)
+    # needs the field's conversion first.
+    converted = [(i, field) for i, field in enumerate(fields)
+                 if field.get_internal_type() not in ('IntegerField', 'ForeignKey')]
+
+    count = 0
+    batch = []
+    with connection.cursor() as cursor:
+        for row in rows:
+            if converted:
+                row = list(row)
+                for i, field in converted:
+                    row[i] = field.get_db_prep_save(row[i], connection)
+            batch.append(row)
+            if len(batch) >= batch_size:
+                cursor.executemany(sql, batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            cursor.executemany(sql, batch)
+            count += len(batch)
+    return count
@@ -0,0 +1,289 @@
+"""
+Correcting recorded games.
+
+Every game's start and end ratings, and everyone's current rating, follow
+from the games before it. Voiding a game, moving it to another date or
+changing its score changes every later game of its players, of their
+later opponents, of those opponents' opponents and so on.
+
+Rather than replaying the whole history, a correction starts from the
+earliest place the game was or now is, with just that game's participants,
+and walks the later games in order. Only games with a participant whose
+rating has changed are replayed, and everyone else in them starts from the
+rating stored with the game. A participant drops out again once their
+replayed rating is back to the stored one. Under Elo, a mistake from last
+week means replaying a few dozen games, written back in one transaction
+with only the participants whose ratings change locked.
+
+Engines that keep more than a rating (glicko2 and gaussian) can't pick up
+from the ratings stored with the games, so corrections under them replay
+the whole history, as replay_ratings does.
+"""
+import io
+
+from django.core.management import call_command
+from django.db import transaction
+from django.db.models import Case, Count, F, IntegerField, Max, Q, Sum, Value, When
+
+from . import rating_history, ratings
+from .bulk import bulk_update_rows
+from .games import lock_participants
+from .leaderboard_cache import bump_game_rows_version, bump_ratings_version
+from .models import DoublesGame, Player, PlayerMatchup, SinglesGame, Team
+
+
+def void_game(game):
+    """Deletes a game and corrects every rating, count and record it affected."""
+    with transaction.atomic():
+        table = _Table.of(game)
+        old = table.row(game.pk)
+        table.lock(old[2:4])
+        game.delete()
+        table.correct(old, None)
+
+
+def save_game(game):
+    """
+    Saves a new or changed game, whatever its date, and corrects every
+    rating, count and record it affects, including its own ratings.
+    """
+    with transaction.atomic():
+        table = _Table.of(game)
+        old = table.row(game.pk) if game.pk else None
+        table.lock(set(table.sides(game)) | set(old[2:4] if old else ()))
+        game.save()
+        table.correct(old, table.row(game.pk))
+        # The ratings the correction worked out for the game itself
+        game.refresh_from_db()
+
+
+class _Table(object):
+    """One game table and the participants it rates and counts."""
+
+    def __init__(self, model, prefix, participants, counter_prefix):
+        self.model = model
+        self.prefix = prefix
+        self.participants = participants
+        self.counter_prefix = counter_prefix
+        self.game_fields = [
+            '%s1_start_rating' % prefix,
+            '%s2_start_rating' % prefix,
+            '%s1_end_rating' % prefix,
+            '%s2_end_rating' % prefix,
+        ]
+        self.columns = ['id', 'date', '%s1_id' % prefix, '%s2_id' % prefix,
+                        '%s1_score' % prefix, '%s2_score' % prefix] + self.game_fields
+        engine = ratings.get_engine()
+        # Engines that keep more than a rating replay the whole history
+        self.replays_everything = engine.keeps_state or engine.team_skills
+        self.locked = set()
+
+    @classmethod
+    def of(cls, game):
+        if isinstance(game, SinglesGame):
+            return cls(SinglesGame, 'player', Player, 'singles_')
+        return cls(DoublesGame, 'team', Team, '')
+
+    def sides(self, game):
+        return (getattr(game, '%s1_id' % self.prefix), getattr(game, '%s2_id' % self.prefix))
+
+    def lock(self, participants):
+        """
+        Locks `participants` in id order, as submissions do: the players,
+        then for doubles the teams. A correction that replays the whole
+        history rates everyone, so it locks everyone instead.
+        """
+        if self.replays_everything:
+            lock_participants(Player, Player.objects.values('id'))
+            lock_participants(Team, Team.objects.values('id'))
+            return
+        participants = set(participants) - self.locked
+        if not participants:
+            return
+        self.locked |= participants
+        if self.participants is Team:
+            members = Team.objects.filter(id__in=participants).values_list('player1', 'player2')
+            lock_participants(Player, set(player for team in members for player in team))
+        lock_participants(self.participants, participants)
+
+    def row(self, pk):
+        """The game's (id, date, side1, side2, score1, score2, ratings...) as stored."""
+        return self.model.objects.filter(id=pk).values_list(*self.columns).get()
+
+    def correct(self, old, new):
+        """Corrects everything that follows from the game going from `old` to `new`."""
+        self._count(old, new)
+        if self.model is SinglesGame:
+            _rebuild_matchups(set(tuple(sorted(row[2:4])) for row in (old, new) if row))
+
+        if self.replays_everything:
+            call_command('replay_ratings', stdout=io.StringIO())
+            changed = []
+        else:
+            changed = self._replay(ratings.get_engine(), old, new)
+        if self.model is SinglesGame:
+            # The game's own points move with its date even if no rating changed
+            rating_history.refresh(set(changed) | set([new[0]] if new else []))
+        transaction.on_commit(bump_ratings_version)
+        transaction.on_commit(bump_game_rows_version)
+
+    def _replay(self, engine, old, new):
+        """Replays the games after the correction that it affects. Returns their ids."""
+        changed, states = self._walk(engine, old, new)
+        # Only the participants whose ratings change need locking. A game
+        # recorded before they were locked can make the correction reach
+        # further, in which case it is worked out again.
+        while not self.locked.issuperset(states):
+            self.lock(states)
+            changed, states = self._walk(engine, old, new)
+
+        bulk_update_rows(self.model, self.game_fields, changed)
+        bulk_update_rows(self.participants, ['rating'],
+                         [(engine.rating(state), participant)
+                          for participant, state in states.items()])
+        return [row[-1] for row in changed]
+
+    def _walk(self, engine, old, new):
+        """
+        Rates the games from the correction on, without writing anything.
+        Returns the changed game rows and the participants' new ratings.
+        """
+        rows = [row for row in (old, new) if row]
+        start = min((row[1], row[0]) for row in rows)
+        states = {participant: self._state_before(engine, participant, start)
+                  for participant in set(side for row in rows for side in row[2:4])}
+        # The corrected game's stored ratings are stale, so its participants
+        # are kept until it has been replayed
+        new_id = new[0] if new else None
+        pending = set(new[2:4]) if new else set()
+
+        date, pk = start
+        games = self.model.objects\
+            .filter(Q(date__gt=date) | Q(date=date, id__gte=pk))\
+            .order_by('date', 'id')\
+            .values_list(*self.columns)
+        changed = []
+        for game in games:
+            game_id, _, side1, side2, score1, score2 = game[:6]
+            if side1 not in states and side2 not in states:
+                continue
+            start1 = states.get(side1) or engine.state_from_rating(game[6])
+            start2 = states.get(side2) or engine.state_from_rating(game[7])
+            (end1,), (end2,) = engine.rate([start1], [start2], score1, score2)
+            replayed = (engine.rating(start1), engine.rating(start2),
+                        engine.rating(end1), engine.rating(end2))
+            if replayed != game[6:10]:
+                changed.append(replayed + (game_id,))
+            for participant, end, stored in ((side1, end1, game[8]), (side2, end2, game[9])):
+                if engine.rating(end) == stored and participant not in pending:
+                    # Back on the stored ratings from here on
+                    states.pop(participant, None)
+                else:
+                    states[participant] = end
+            if game_id == new_id:
+                pending = set()
+        return changed, states
+
+    def _state_before(self, engine, participant, start):
+        # The end rating of the participant's last game before `start`
+        date, pk = start
+        latest = None
+        for slot in ('1', '2'):
+            game = self.model.objects\
+                .filter(Q(date__lt=date) | Q(date=date, id__lt=pk))\
+                .filter(**{'%s%s' % (self.prefix, slot): participant})\
+                .order_by('-date', '-id')\
+                .values_list('date', 'id', '%s%s_end_rating' % (self.prefix, slot))\
+                .first()
+            if game and (latest is None or game[:2] > latest[:2]):
+                latest = game
+        if latest is None:
+            return engine.initial_state()
+        return engine.state_from_rating(latest[2])
+
+    def _count(self, old, new):
+        # Takes the old game out of the win, loss and draw counts and puts
+        # the new one in
+        counts = {}
+        for row, change in ((old, -1), (new, 1)):
+            if row:
+                for participant, score, opponent_score in ((row[2], row[4], row[5]),
+                                                           (row[3], row[5], row[4])):
+                    fields = counts.setdefault(participant, {})
+                    for field in (_result(score, opponent_score), 'games_played'):
+                        fields[field] = fields.get(field, 0) + change
+        _add_counts(self.participants, {
+            participant: {self.counter_prefix + field: count for field, count in fields.items()}
+            for participant, fields in counts.items()})
+
+        if self.model is DoublesGame:
+            members = {}
+            teams = Team.objects.in_bulk(list(counts))
+            for team_id, fields in counts.items():
+                for player_id in (teams[team_id].player1_id, teams[team_id].player2_id):
+                    player_fields = members.setdefault(player_id, {})
+                    for field, count in fields.items():
+                        field = 'doubles_' + field
+                        player_fields[field] = player_fields.get(field, 0) + count
+            _add_counts(Player, members)
+
+
+def _result(score, opponent_score):
+    return {1: 'wins', 0: 'losses', 0.5: 'draws'}[ratings.result(score, opponent_score)]
+
+
+def _add_counts(model, counts):
+    """Adds to counters of several `model` rows in one UPDATE. `counts` maps ids to {field: change}."""
+    by_field = {}
+    for pk, fields in counts.items():
+        for field, count in fields.items():
+            if count:
+                by_field.setdefault(field, {})[pk] = count
+    if not by_field:
+        return
+    model.objects.filter(id__in=list(counts)).update(**{
+        field: F(field) + Case(
+            *[When(id=pk, then=Value(count)) for pk, count in by_id.items()],
+            default=Value(0),
+            output_field=IntegerField())
+        for field, by_id in by_field.items()})
+
+
+def _rebuild_matchups(pairs):
+    """Recounts the head-to-head records of the (player, opponent) `pairs`."""
+    for player, opponent in pairs:
+        PlayerMatchup.objects\
+            .filter(Q(player=player, opponent=opponent) | Q(player=opponent, opponent=player))\
+            .delete()
+        pairings = SinglesGame.objects\
+            .filter(Q(player1=player, player2=opponent) | Q(player1=opponent, player2=player))\
+            .values('player1', 'player2')\
+            .annotate(
+                player1_wins=Sum(Case(
+                    When(player1_score__gt=F('player2_score'), then=Value(1)),
+                    default=Value(0),
+                    output_field=IntegerField())),
+                player2_wins=Sum(Case(
+                    When(player1_score__lt=F('player2_score'), then=Value(1)),
+                    default=Value(0),
+                    output_field=IntegerField())),
+                games=Count('id'),
+                last_played=Max('date'))\
+            .order_by()
+        matchups = {
+            player: PlayerMatchup(player_id=player, opponent_id=opponent),
+            opponent: PlayerMatchup(player_id=opponent, opponent_id=player),
+        }
+        for pairing in pairings:
+            player1, player2 = pairing['player1'], pairing['player2']
+            draws = pairing['games'] - pairing['player1_wins'] - pairing['player2_wins']
+            for side, wins, losses in ((player1, pairing['player1_wins'], pairing['player2_wins']),
+                                       (player2, pairing['player2_wins'], pairing['player1_wins'])):
+                matchup = matchups[side]
+                matchup.wins += wins
+                matchup.losses += losses
+                matchup.draws += draws
+                if matchup.last_played is None or pairing['last_played'] > matchup.last_played:
+                    matchup.last_played = pairing['last_played']
+        if matchups[player].last_played is not None:
+            PlayerMatchup.objects.bulk_create(matchups.values())
@@ -0,0 +1,124 @@
+"""
+Export of the game history as CSV or JSON Lines.
+
+Rows use the importer's field names, with the participants' names, the
+ratings and the game id alongside, so an export can be read straight back
+in with import_games. Games are read in (date, id) order one batch at a
+time, so memory use stays the same however long the history is.
+"""
+import csv
+import io
+import json
+
+from django.db.models import Q
+
+from .models import DoublesGame, SinglesGame
+
+FORMATS = ('csv', 'jsonl')
+GAME_TYPES = ('singles', 'doubles')
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'jsonl': 'application/x-ndjson; charset=utf-8',
+}
+
+SINGLES_COLUMNS = [
+    ('id', 'id'),
+    ('date', 'date'),
+    ('player1', 'player1'),
+    ('player1_name', 'player1__name'),
+    ('player2', 'player2'),
+    ('player2_name', 'player2__name'),
+    ('player1_score', 'player1_score'),
+    ('player2_score', 'player2_score'),
+    ('player1_start_rating', 'player1_start_rating'),
+    ('player1_end_rating', 'player1_end_rating'),
+    ('player2_start_rating', 'player2_start_rating'),
+    ('player2_end_rating', 'player2_end_rating'),
+]
+DOUBLES_COLUMNS = [
+    ('id', 'id'),
+    ('date', 'date'),
+    ('team1', 'team1'),
+    ('team1player1', 'team1__player1'),
+    ('team1player1_name', 'team1__player1__name'),
+    ('team1player2', 'team1__player2'),
+    ('team1player2_name', 'team1__player2__name'),
+    ('team2', 'team2'),
+    ('team2player1', 'team2__player1'),
+    ('team2player1_name', 'team2__player1__name'),
+    ('team2player2', 'team2__player2'),
+    ('team2player2_name', 'team2__player2__name'),
+    ('team1_score', 'team1_score'),
+    ('team2_score', 'team2_score'),
+    ('team1_start_rating', 'team1_start_rating'),
+    ('team1_end_rating', 'team1_end_rating'),
+    ('team2_start_rating', 'team2_start_rating'),
+    ('team2_end_rating', 'team2_end_rating'),
+]
+
+
+def export_games(game_type, format, since=None, until=None, player=None, chunk_size=1000):
+    """
+    Yields the games of `game_type` as chunks of text in `format`, oldest
+    first. `since` and `until` limit the dates (until is exclusive) and
+    `player` limits the games to those a player took part in.
+    """
+    if game_type == 'singles':
+        model, columns = SinglesGame, SINGLES_COLUMNS
+        player_filter = ('player1', 'player2')
+    elif game_type == 'doubles':
+        model, columns = DoublesGame, DOUBLES_COLUMNS
+        player_filter = ('team1__player1', 'team1__player2',
+                         'team2__player1', 'team2__player2')
+    else:
+        raise ValueError('Unknown game type %r' % game_type)
+    if format not in FORMATS:
+        raise ValueError('Unknown export format %r' % format)
+
+    games = model.objects.all()
+    if since is not None:
+        games = games.filter(date__gte=since)
+    if until is not None:
+        games = games.filter(date__lt=until)
+    if player is not None:
+        condition = Q()
+        for field in player_filter:
+            condition |= Q(**{field: player})
+        games = games.filter(condition)
+    games = games.order_by('date', 'id').values_list(*[field for _, field in columns])
+
+    names = ['game_type'] + [name for name, _ in columns]
+    if format == 'csv':
+        # The header goes out before the first query runs
+        yield _csv_rows([names])
+    for batch in _batches(games, chunk_size):
+        rows = [[game_type, game_id, date.isoformat()] + list(rest)
+                for game_id, date, *rest in batch]
+        if format == 'csv':
+            yield _csv_rows(rows)
+        else:
+            yield ''.join(json.dumps(dict(zip(names, row))) + '\n' for row in rows)
+
+
+def _batches(games, chunk_size):
+    # Keyset pagination on (date, id). SQLite can't read a cursor in
+    # chunks, so .iterator() would still load every row at once.
+    last = None
+    while True:
+        batch = games
+        if last is not None:
+            game_id, date = last
+            batch = batch.filter(date__gte=date).exclude(date=date, id__lte=game_id)
+        batch = list(batch[:chunk_size])
+        if not batch:
+            return
+        yield batch
+        last = batch[-1][:2]
+        if len(batch) < chunk_size:
+            return
+
+
+def _csv_rows(rows):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue()
@@ -0,0 +1,101 @@
+"""
+Rules and locking shared by everything that records games: the game entry
+form, the importer and corrections. Also how game dates are read, for
+imports and exports alike.
+"""
+import datetime
+
+from django.db import connection
+from django.db.models import F
+from django.utils import dateparse, timezone
+
+from .models import Team
+
+
+def validate_scores(score1, score2, side):
+    """
+    Checks a pair of submitted scores against the house rules. Returns the
+    scores as ints along with an error message, which is None when the
+    scores are valid. `side` is what the messages call the competitors.
+    """
+    if score1 == '' or score1 is None:
+        score1 = 0
+    if score2 == '' or score2 is None:
+        score2 = 0
+    try:
+        score1 = int(score1)
+        score2 = int(score2)
+    except Exception:
+        return score1, score2, '%s score must be an integer! Clown.' % side
+
+    # Check the scores to make sure they are in the range of 0-11
+    if score1 < 0 or score1 > 11:
+        return score1, score2, '%s 1 score was outside the range of 0-11! Clown.' % side
+    if score2 < 0 or score2 > 11:
+        return score1, score2, '%s 2 score was outside the range of 0-11! Clown.' % side
+    # House rules. If a tiebreaker (win by 2) happened, the winning score must be 11-9.
+    if score1 == 11 or score2 == 11:
+        if score1 != 9 and score2 != 9:
+            return score1, score2, 'If win-by-two (tiebreaker), the resulting score must be 11-9!'
+    # House rules, cannot win by 1.
+    if score1 == 10 or score2 == 10:
+        if score1 == 9 or score2 == 9:
+            return score1, score2, 'If win-by-two (tiebreaker), the resulting score must be 11-9!'
+
+    # TODO: Allow draws
+    if score1 != 10 and score2 != 10 and score1 != 11 and score2 != 11:
+        if score1 - score2 != 0:
+            return score1, score2, 'Surely somebody won the game?'
+
+    return score1, score2, None
+
+
+def lock_participants(model, ids):
+    """
+    Locks the `model` rows with the given ids until the end of the current
+    transaction and returns them keyed by id. Rows are always locked in id
+    order so two submissions sharing participants can't deadlock.
+    """
+    participants = model.objects.filter(id__in=ids).order_by('id')
+    if connection.features.has_select_for_update:
+        participants = participants.select_for_update()
+    else:
+        # SQLite has no row locks. A no-op write takes the database write
+        # lock before anything is read, which serializes submissions.
+        participants.update(rating=F('rating'))
+    return {participant.id: participant for participant in participants}
+
+
+def get_team(player1_id, player2_id):
+    """
+    Returns the team of two players, creating it if it doesn't exist yet.
+    Teams are stored with the lower player id first, so one lookup finds
+    the team whichever way round the players were given, and the unique
+    constraint on the pair stops concurrent submissions creating it twice.
+    """
+    if player1_id > player2_id:
+        player1_id, player2_id = player2_id, player1_id
+    team, _ = Team.objects.get_or_create(player1_id=player1_id, player2_id=player2_id)
+    return team
+
+
+def parse_date(value):
+    """
+    Reads a game date given as a date or a date and time. Dates without a
+    time zone are in the default one. Returns None if it can't be read.
+    """
+    if not value:
+        return None
+    value = str(value)
+    try:
+        date = dateparse.parse_datetime(value)
+        if date is None:
+            day = dateparse.parse_date(value)
+            if day is None:
+                return None
+            date = datetime.datetime.combine(day, datetime.time())
+    except ValueError:
+        return None
+    if timezone.is_naive(date):
+        date = timezone.make_aware(date)
+    return date
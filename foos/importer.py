@@ -0,0 +1,316 @@
+"""
+Bulk import of finished games from CSV or JSON Lines.
+
+Every record names its `game_type` and `date` and then uses the same field
+names as the new game form: `player1`, `player2`, `player1_score` and
+`player2_score` for singles, `team1player1`, `team1player2`, `team2player1`,
+`team2player2`, `team1_score` and `team2_score` for doubles. Players can be
+given by id or by name.
+
+Games are validated with the same house rules as the game entry form,
+rated in date order on top of the current ratings and inserted in batches.
+If any of them predate games already on record, the whole history is then
+rated again in date order, as replay_ratings does. An import is all or
+nothing.
+"""
+import csv
+import io
+import json
+
+from django.core.management import call_command
+from django.db import transaction
+from django.db.models import Max
+
+from . import rating_history, ratings
+from .bulk import bulk_insert_rows, bulk_update_rows
+from .games import get_team, lock_participants, parse_date, validate_scores
+from .leaderboard_cache import bump_ratings_version
+from .models import DoublesGame, Player, PlayerMatchup, SinglesGame, Team
+
+FORMATS = ('csv', 'jsonl')
+
+PLAYER_COUNTERS = [
+    'singles_wins', 'singles_losses', 'singles_draws', 'singles_games_played',
+    'doubles_wins', 'doubles_losses', 'doubles_draws', 'doubles_games_played',
+]
+TEAM_COUNTERS = ['wins', 'losses', 'draws', 'games_played']
+
+
+class GameImportError(Exception):
+    """Raised with every problem found when an import is rejected."""
+
+    def __init__(self, errors):
+        super(GameImportError, self).__init__('%d invalid games' % len(errors))
+        self.errors = errors
+
+
+def read_games(stream, format):
+    """Yields (line number, record) for every game in a text stream."""
+    if format == 'csv':
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, record
+    elif format == 'jsonl':
+        for line_number, line in enumerate(stream, 1):
+            if line.strip():
+                try:
+                    yield line_number, json.loads(line)
+                except ValueError:
+                    yield line_number, None
+    else:
+        raise ValueError('Unknown import format %r' % format)
+
+
+def import_games(records, batch_size=500):
+    """
+    Validates, rates and saves an iterable of (line number, record) pairs.
+    Raises GameImportError without saving anything if any record is
+    invalid, otherwise returns a summary of what was imported.
+    """
+    players_by_id = {}
+    players_by_name = {}
+    for player_id, name in Player.objects.values_list('id', 'name'):
+        players_by_id[player_id] = player_id
+        # A name shared by several players can't be used to pick one
+        players_by_name[name] = None if name in players_by_name else player_id
+
+    def resolve(value):
+        try:
+            return players_by_id.get(int(value))
+        except (TypeError, ValueError):
+            return players_by_name.get(value)
+
+    games = []
+    errors = []
+    for line_number, record in records:
+        game, error_message = _parse_game(record, resolve)
+        if error_message:
+            errors.append('Line %d: %s' % (line_number, error_message))
+        else:
+            games.append(game)
+    if errors:
+        raise GameImportError(errors)
+
+    # Rate the games in the order they were played
+    games.sort(key=lambda game: game['date'])
+
+    with transaction.atomic():
+        player_ids = set()
+        for game in games:
+            for side in game['sides']:
+                player_ids.update(side if game['game_type'] == 'doubles' else [side])
+        # Locked before anything is read, so no game can be recorded in between
+        players = lock_participants(Player, player_ids)
+        backdated = bool(games) and _is_backdated(games[0]['date'])
+        teams, pairs = _get_teams(games)
+        for team in teams.values():
+            team.player1 = players[team.player1_id]
+            team.player2 = players[team.player2_id]
+        engine = ratings.get_engine()
+        singles = []
+        doubles = []
+        matchups = _Matchups(player_ids)
+
+        for game in games:
+            score1, score2 = game['scores']
+            if game['game_type'] == 'singles':
+                side1, side2 = (players[player_id] for player_id in game['sides'])
+                start1, start2 = side1.rating, side2.rating
+                end1, end2 = ratings.rate_singles(engine, side1, side2, score1, score2)
+            else:
+                side1, side2 = (teams[pairs[pair]] for pair in game['sides'])
+                start1, start2, end1, end2 = ratings.rate_doubles(
+                    engine, side1, side2, score1, score2)
+
+            if game['game_type'] == 'singles':
+                singles.append((side1.id, side2.id, score1, score2,
+                                start1, start2, end1, end2, game['date']))
+                _count_result(side1, 'singles_', score1, score2)
+                _count_result(side2, 'singles_', score2, score1)
+                matchups.record(side1.id, side2.id, score1, score2, game['date'])
+                matchups.record(side2.id, side1.id, score2, score1, game['date'])
+            else:
+                doubles.append((side1.id, side2.id, score1, score2,
+                                start1, start2, end1, end2, game['date']))
+                _count_result(side1, '', score1, score2)
+                _count_result(side2, '', score2, score1)
+                for player_id in game['sides'][0]:
+                    _count_result(players[player_id], 'doubles_', score1, score2)
+                for player_id in game['sides'][1]:
+                    _count_result(players[player_id], 'doubles_', score2, score1)
+
+        last_id = SinglesGame.objects.aggregate(Max('id'))['id__max'] or 0
+        bulk_insert_rows(SinglesGame, _game_fields('player'), singles, batch_size)
+        rating_history.backfill(after_id=last_id)
+        bulk_insert_rows(DoublesGame, _game_fields('team'), doubles, batch_size)
+        _save_counters(Player, players.values(), PLAYER_COUNTERS, batch_size,
+                       ['rating_state'] if engine.keeps_state else [])
+        other_teams = {}
+        if engine.team_skills and doubles:
+            # Every team of the players is rated on where they finished
+            other_teams = ratings.team_ratings(engine, players)
+            for team_id, team in teams.items():
+                team.rating = other_teams.pop(team_id)
+        _save_counters(Team, teams.values(), TEAM_COUNTERS, batch_size)
+        bulk_update_rows(Team, ['rating'], [(rating, team_id) for team_id, rating
+                                            in other_teams.items()], batch_size)
+        matchups.save(batch_size)
+        if backdated:
+            # Games already on record were rated without the imported ones
+            # before them
+            call_command('replay_ratings', stdout=io.StringIO())
+        transaction.on_commit(bump_ratings_version)
+
+    return {
+        'singles': len(singles),
+        'doubles': len(doubles),
+        'backdated': backdated,
+    }
+
+
+def _parse_game(record, resolve):
+    if not isinstance(record, dict):
+        return None, 'Could not read the game.'
+
+    date = parse_date(record.get('date'))
+    if date is None:
+        return None, 'The date is missing or invalid.'
+
+    game_type = record.get('game_type')
+    if game_type == 'singles':
+        side = 'Player'
+        score_fields = ('player1_score', 'player2_score')
+        try:
+            sides = (resolve(record['player1']), resolve(record['player2']))
+        except KeyError:
+            return None, 'Both players are required.'
+        if None in sides:
+            return None, 'Players do not exist! Clown.'
+        if sides[0] == sides[1]:
+            return None, 'You selected the same player! Clown.'
+    elif game_type == 'doubles':
+        side = 'team'
+        score_fields = ('team1_score', 'team2_score')
+        try:
+            team1 = (resolve(record['team1player1']), resolve(record['team1player2']))
+            team2 = (resolve(record['team2player1']), resolve(record['team2player2']))
+        except KeyError:
+            return None, 'All four players are required.'
+        if None in team1:
+            return None, 'Team 1 is invalid.'
+        if None in team2:
+            return None, 'Team 2 is invalid.'
+        if set(team1) == set(team2):
+            return None, 'You selected the same team! Clown.'
+        sides = (team1, team2)
+    else:
+        return None, 'Invalid game_type received! Clown.'
+
+    score1, score2, error_message = validate_scores(
+        record.get(score_fields[0]), record.get(score_fields[1]), side)
+    if error_message:
+        return None, error_message
+
+    return {
+        'game_type': game_type,
+        'date': date,
+        'sides': sides,
+        'scores': (score1, score2),
+    }, None
+
+
+def _get_teams(games):
+    """
+    Returns the locked teams keyed by id, and a map from every player pair
+    in the games to its team id. Missing teams are created.
+    """
+    pairs = set(game['sides'][i] for game in games if game['game_type'] == 'doubles'
+                for i in (0, 1))
+    player_ids = set(player_id for pair in pairs for player_id in pair)
+    existing = {}
+    for team_id, player1_id, player2_id in Team.objects\
+            .filter(player1__in=player_ids, player2__in=player_ids)\
+            .values_list('id', 'player1', 'player2'):
+        existing[(player1_id, player2_id)] = team_id
+
+    team_ids = {}
+    for pair in pairs:
+        key = tuple(sorted(pair))
+        team_id = existing.get(key)
+        if team_id is None:
+            team_id = existing[key] = get_team(*key).id
+        team_ids[pair] = team_id
+
+    return lock_participants(Team, set(team_ids.values())), team_ids
+
+
+def _game_fields(prefix):
+    return [
+        '%s1' % prefix, '%s2' % prefix,
+        '%s1_score' % prefix, '%s2_score' % prefix,
+        '%s1_start_rating' % prefix, '%s2_start_rating' % prefix,
+        '%s1_end_rating' % prefix, '%s2_end_rating' % prefix,
+        'date',
+    ]
+
+
+def _count_result(participant, prefix, score, opponent_score):
+    if score > opponent_score:
+        field = prefix + 'wins'
+    elif score < opponent_score:
+        field = prefix + 'losses'
+    else:
+        field = prefix + 'draws'
+    setattr(participant, field, getattr(participant, field) + 1)
+    field = prefix + 'games_played'
+    setattr(participant, field, getattr(participant, field) + 1)
+
+
+def _save_counters(model, participants, counters, batch_size, extra_fields=()):
+    fields = ['rating'] + counters + list(extra_fields)
+    rows = [[getattr(participant, field) for field in fields] + [participant.id]
+            for participant in participants]
+    bulk_update_rows(model, fields, rows, batch_size)
+
+
+def _is_backdated(earliest):
+    """Whether games already on record were played after `earliest`."""
+    return SinglesGame.objects.filter(date__gt=earliest).exists() or \
+        DoublesGame.objects.filter(date__gt=earliest).exists()
+
+
+class _Matchups(object):
+    """Head-to-head records of the imported players, updated in memory."""
+
+    def __init__(self, player_ids):
+        self.matchups = {
+            (matchup.player_id, matchup.opponent_id): matchup
+            for matchup in PlayerMatchup.objects.filter(player__in=player_ids)
+        }
+        self.touched = set()
+
+    def record(self, player_id, opponent_id, score, opponent_score, date):
+        key = (player_id, opponent_id)
+        matchup = self.matchups.get(key)
+        if matchup is None:
+            matchup = PlayerMatchup(player_id=player_id, opponent_id=opponent_id)
+            self.matchups[key] = matchup
+        self.touched.add(key)
+        if score > opponent_score:
+            matchup.wins += 1
+        elif score < opponent_score:
+            matchup.losses += 1
+        else:
+            matchup.draws += 1
+        if matchup.last_played is None or date > matchup.last_played:
+            matchup.last_played = date
+
+    def save(self, batch_size):
+        touched = [self.matchups[key] for key in self.touched]
+        fields = ['wins', 'losses', 'draws', 'last_played']
+        rows = [[getattr(matchup, field) for field in fields] + [matchup.id]
+                for matchup in touched if matchup.id is not None]
+        bulk_update_rows(PlayerMatchup, fields, rows, batch_size)
+        PlayerMatchup.objects.bulk_create(
+            [matchup for matchup in touched if matchup.id is None],
+            batch_size=batch_size)
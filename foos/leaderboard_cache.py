@@ -0,0 +1,75 @@
+"""
+Versioned caching for the leaderboard.
+
+Everything the front page shows only changes when a game is recorded, so
+cached fragments are keyed on a ratings version that is bumped every time
+a game is committed. Entries for old versions are never read again and
+simply age out.
+
+Rendered game rows are cached for much longer, as a recorded game never
+changes. Their own version is only bumped when history is rewritten, by
+replay_ratings for example, or when a player is renamed.
+
+The cache is the FOOS_CACHE alias from CACHES ('default' unless set).
+Local memory is fine for a single process; with several workers every
+process has to share one cache such as memcached, or the others won't see
+the version change.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+RATINGS_VERSION_KEY = 'foos:ratings_version'
+GAME_ROWS_VERSION_KEY = 'foos:game_rows_version'
+
+# How long a cached fragment may live. Fragments go stale by version, not
+# by age, so this only bounds how long unused ones hang around.
+FRAGMENT_TIMEOUT = 60 * 60 * 24
+GAME_ROW_TIMEOUT = 60 * 60 * 24 * 30
+
+
+def cache_alias():
+    return getattr(settings, 'FOOS_CACHE', 'default')
+
+
+def get_cache():
+    return caches[cache_alias()]
+
+
+def ratings_version():
+    return _version(RATINGS_VERSION_KEY)
+
+
+def bump_ratings_version():
+    """Invalidates every cached leaderboard fragment. Call after commit."""
+    _bump(RATINGS_VERSION_KEY)
+
+
+def game_rows_version():
+    return _version(GAME_ROWS_VERSION_KEY)
+
+
+def bump_game_rows_version():
+    """Invalidates every cached game row. Call after commit."""
+    _bump(GAME_ROWS_VERSION_KEY)
+
+
+def _version(key):
+    cache = get_cache()
+    version = cache.get(key)
+    if version is None:
+        # Start from the clock rather than 1, so a version lost to eviction
+        # or a restart can't come back and serve fragments from before.
+        cache.add(key, int(time.time() * 1000), None)
+        version = cache.get(key)
+    return version
+
+
+def _bump(key):
+    cache = get_cache()
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Nothing was cached under a version we can reach
+        _version(key)
@@ -0,0 +1,275 @@
+"""
+Live leaderboard updates, pushed to browsers as Server-Sent Events.
+
+Every committed game is published to a broker as a compact event with the
+new game, its rendered table row and the changed ratings. The broker is
+chosen with FOOS_LIVE_BROKER:
+
+* 'process' (the default) fans events out within the process. Enough when
+  the site runs in a single process.
+* 'cache' passes events through the FOOS_CACHE cache, so every worker
+  sharing that cache sees every game. One thread per worker polls the
+  cache, and only while someone is listening.
+
+An idle listener is a blocked thread waiting on a queue. It holds no
+database connection and runs no queries.
+"""
+import asyncio
+import itertools
+import json
+import logging
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+
+from .api import game_json
+from .leaderboard_cache import get_cache
+from .models import SinglesGame
+from .templatetags.game_rows import doubles_game_rows, singles_game_rows
+
+logger = logging.getLogger(__name__)
+
+# Comments are sent this often so proxies don't drop quiet connections
+KEEPALIVE_SECONDS = 15
+# Events a listener can fall behind by before it starts missing them
+QUEUE_SIZE = 100
+
+# Sent first, telling browsers how soon to reconnect
+STREAM_START = 'retry: 5000\n\n'
+
+EVENT_COUNTER_KEY = 'foos:live:last_event'
+EVENT_KEY = 'foos:live:event:%d'
+EVENT_TIMEOUT = 60
+POLL_SECONDS = 0.5
+
+
+class Subscription(object):
+
+    def __init__(self, broker):
+        self.broker = broker
+        self.queue = queue.Queue(QUEUE_SIZE)
+
+    def put(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except queue.Full:
+            # Too far behind to catch up; the page is stale anyway
+            pass
+
+    def get(self, timeout):
+        """Returns the next (id, event), or None if none came in time."""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class AsyncSubscription(Subscription):
+    """A subscription read from an asyncio event loop. Create it on the loop."""
+
+    def __init__(self, broker, loop):
+        self.broker = broker
+        self.loop = loop
+        self.queue = asyncio.Queue(QUEUE_SIZE)
+
+    def put(self, message):
+        # Events are published from worker threads
+        self.loop.call_soon_threadsafe(self._put, message)
+
+    def _put(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            pass
+
+    async def get(self, timeout):
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class InProcessBroker(object):
+
+    def __init__(self):
+        self.subscribers = set()
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+
+    def subscribe(self, subscription=None):
+        if subscription is None:
+            subscription = Subscription(self)
+        with self.lock:
+            self.subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscribers.discard(subscription)
+
+    def publish(self, event):
+        self.deliver(next(self.ids), event)
+
+    def deliver(self, event_id, event):
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscription in subscribers:
+            subscription.put((event_id, event))
+
+
+class CacheBroker(InProcessBroker):
+    """Shares events between processes through the cache."""
+
+    def __init__(self):
+        super(CacheBroker, self).__init__()
+        self.listener = None
+
+    def subscribe(self, subscription=None):
+        subscription = super(CacheBroker, self).subscribe(subscription)
+        with self.lock:
+            if self.listener is None:
+                self.listener = threading.Thread(target=self.listen, daemon=True)
+                self.listener.start()
+        return subscription
+
+    def publish(self, event):
+        cache = get_cache()
+        cache.add(EVENT_COUNTER_KEY, 0, None)
+        event_id = cache.incr(EVENT_COUNTER_KEY)
+        cache.set(EVENT_KEY % event_id, event, EVENT_TIMEOUT)
+
+    def listen(self):
+        cache = get_cache()
+        last = cache.get(EVENT_COUNTER_KEY) or 0
+        while True:
+            with self.lock:
+                if not self.subscribers:
+                    self.listener = None
+                    return
+            time.sleep(POLL_SECONDS)
+            current = cache.get(EVENT_COUNTER_KEY) or 0
+            if current < last:
+                # The counter was evicted or reset and publishing started
+                # again from 1
+                last = 0
+            if current == last:
+                continue
+            event_ids = range(last + 1, current + 1)
+            events = cache.get_many([EVENT_KEY % event_id for event_id in event_ids])
+            for event_id in event_ids:
+                event = events.get(EVENT_KEY % event_id)
+                if event is not None:
+                    self.deliver(event_id, event)
+            last = current
+
+
+BROKERS = {
+    'process': InProcessBroker,
+    'cache': CacheBroker,
+}
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            _broker = BROKERS[getattr(settings, 'FOOS_LIVE_BROKER', 'process')]()
+        return _broker
+
+
+def publish_game(game):
+    """
+    Publishes a newly committed game. Never raises, as the game is recorded
+    whether or not anyone hears about it.
+    """
+    try:
+        if isinstance(game, SinglesGame):
+            event = singles_event(game)
+        else:
+            event = doubles_event(game)
+        get_broker().publish(event)
+    except Exception:
+        logger.exception('Could not publish game %s', game.id)
+
+
+def event_stream(subscription, keepalive=KEEPALIVE_SECONDS):
+    """Yields the Server-Sent Events of a subscription until it is closed."""
+    # Nothing here touches the database, so don't hold on to a
+    # connection for as long as the browser stays connected
+    connections.close_all()
+    try:
+        yield STREAM_START
+        while True:
+            yield format_event(subscription.get(keepalive))
+    finally:
+        subscription.close()
+
+
+def format_event(message):
+    """Formats an (id, event) message, or a keepalive comment for None."""
+    if message is None:
+        return ': keepalive\n\n'
+    event_id, event = message
+    return 'id: %d\nevent: game\ndata: %s\n\n' % (event_id, json.dumps(event))
+
+
+def singles_event(game):
+    _make_date_aware(game)
+    game.player1_rating_change = game.player1_end_rating - game.player1_start_rating
+    game.player2_rating_change = game.player2_end_rating - game.player2_start_rating
+    return {
+        'type': 'singles',
+        'game': game_json(
+            game.id, game.date.isoformat(),
+            {'id': game.player1_id, 'name': game.player1.name},
+            {'id': game.player2_id, 'name': game.player2.name},
+            (game.player1_score, game.player2_score,
+             game.player1_start_rating, game.player1_end_rating,
+             game.player2_start_rating, game.player2_end_rating)),
+        'row': singles_game_rows([game]),
+        'ratings': {
+            'players': {
+                game.player1_id: game.player1_end_rating,
+                game.player2_id: game.player2_end_rating,
+            },
+        },
+    }
+
+
+def doubles_event(game):
+    _make_date_aware(game)
+    game.team1_rating_change = game.team1_end_rating - game.team1_start_rating
+    game.team2_rating_change = game.team2_end_rating - game.team2_start_rating
+    return {
+        'type': 'doubles',
+        'game': game_json(
+            game.id, game.date.isoformat(),
+            {'id': game.team1_id, 'name': str(game.team1)},
+            {'id': game.team2_id, 'name': str(game.team2)},
+            (game.team1_score, game.team2_score,
+             game.team1_start_rating, game.team1_end_rating,
+             game.team2_start_rating, game.team2_end_rating)),
+        'row': doubles_game_rows([game]),
+        'ratings': {
+            'teams': {
+                game.team1_id: game.team1_end_rating,
+                game.team2_id: game.team2_end_rating,
+            },
+        },
+    }
+
+
+def _make_date_aware(game):
+    # A game saved with the default date holds the naive time it was saved
+    # with, which the database stores as the default time zone
+    if timezone.is_naive(game.date):
+        game.date = timezone.make_aware(game.date)
@@ -0,0 +1,154 @@
+import json
+import platform
+import statistics
+import time
+import tracemalloc
+
+import django
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, reset_queries
+from django.test import Client
+from django.test.utils import (CaptureQueriesContext, setup_test_environment,
+                               teardown_test_environment)
+from django.urls import reverse
+from django.utils import timezone
+
+from foos.leaderboard_cache import get_cache
+from foos.models import Player
+from foos.ratings import calculate_elo
+from foos.synthetic import seed
+
+ELO_CALLS = 100000
+
+
+class Command(BaseCommand):
+    help = ('Times the main pages and the rating calculation against synthetic '
+            'data sets of several sizes, and writes the results as JSON. Runs '
+            'in a throwaway test database.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', dest='sizes', default='1000,10000,100000',
+            help='Comma separated numbers of games to benchmark with.')
+        parser.add_argument('--players', type=int, dest='players', default=50)
+        parser.add_argument('--teams', type=int, dest='teams', default=100)
+        parser.add_argument(
+            '--repeat', type=int, dest='repeat', default=5,
+            help='Number of timed runs of each case.')
+        parser.add_argument(
+            '--label', dest='label', default='',
+            help='Name of this run in the results, such as a release.')
+        parser.add_argument(
+            '--output', dest='output', default='benchmark-results.json',
+            help='File the results are written to.')
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [int(size) for size in options['sizes'].split(',')]
+        except ValueError:
+            raise CommandError('--sizes must be a comma separated list of numbers.')
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True,
+                                                      serialize=False)
+        try:
+            runs = [self._run(size, options) for size in sizes]
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        with open(options['output'], 'w') as output:
+            json.dump({
+                'label': options['label'],
+                'date': timezone.now().isoformat(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'runs': runs,
+            }, output, indent=2)
+        self.stdout.write('Results written to %s.' % options['output'])
+
+    def _run(self, size, options):
+        call_command('flush', interactive=False, verbosity=0)
+        get_cache().clear()
+        singles = size * 3 // 4
+        started = time.perf_counter()
+        seed(options['players'], options['teams'], singles, size - singles, random_seed=size)
+        seed_seconds = time.perf_counter() - started
+
+        user = User.objects.create_user('benchmark')
+        client = Client()
+        client.force_login(user)
+        busiest = Player.objects.order_by('-singles_games_played').first()
+        players = list(Player.objects.values_list('id', flat=True))
+        posted = []
+
+        def index():
+            get_cache().clear()
+            return client.get(reverse('foos:index'))
+
+        def new_game_post():
+            i = len(posted) % (len(players) - 1)
+            posted.append(i)
+            return client.post(reverse('foos:new_game'), {
+                'game_type': 'singles',
+                'player1': players[i],
+                'player2': players[i + 1],
+                'player1_score': 10,
+                'player2_score': 5,
+            })
+
+        def elo():
+            for i in range(ELO_CALLS):
+                calculate_elo(1000 + i % 400, 1200 - i % 400, 10, i % 9)
+
+        cases = [
+            ('index', index),
+            ('index_cached', lambda: client.get(reverse('foos:index'))),
+            ('player', lambda: client.get(reverse('foos:player', args=[busiest.id]))),
+            ('new_game_get', lambda: client.get(reverse('foos:new_game'))),
+            ('new_game_post', new_game_post),
+            ('elo_%d_calls' % ELO_CALLS, elo),
+        ]
+        results = {}
+        for name, case in cases:
+            results[name] = self._measure(case, options['repeat'])
+            self.stdout.write('%d games, %s: %.1f ms, %d queries' % (
+                size, name, results[name]['wall_ms']['median'], results[name]['queries']))
+
+        return {
+            'games': size,
+            'players': options['players'],
+            'teams': options['teams'],
+            'seed_seconds': round(seed_seconds, 3),
+            'results': results,
+        }
+
+    def _measure(self, case, repeat):
+        # Warm up, and count the queries and memory on a run of their own
+        # so neither slows down the timed runs
+        reset_queries()
+        tracemalloc.start()
+        with CaptureQueriesContext(connection) as queries:
+            response = case()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        if response is not None and response.status_code not in (200, 302):
+            raise CommandError('Got a %d response.' % response.status_code)
+
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            case()
+            timings.append((time.perf_counter() - started) * 1000)
+        return {
+            'queries': len(queries),
+            'peak_memory_kb': peak // 1024,
+            'wall_ms': {
+                'min': round(min(timings), 3),
+                'median': round(statistics.median(timings), 3),
+                'max': round(max(timings), 3),
+            },
+        }
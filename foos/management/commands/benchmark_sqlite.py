@@ -0,0 +1,133 @@
+import multiprocessing
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection, connections
+from django.test import Client, override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from foos.leaderboard_cache import get_cache
+from foos.models import Player
+from foos.synthetic import seed
+
+
+class Command(BaseCommand):
+    help = ('Measures how many pages SQLite serves while games are being '
+            'recorded, first with its defaults and a connection per request, '
+            'then with FOOS_SQLITE_PRAGMAS and persistent connections. Runs in '
+            'a throwaway database file.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--games', type=int, dest='games', default=5000)
+        parser.add_argument('--players', type=int, dest='players', default=50)
+        parser.add_argument('--readers', type=int, dest='readers', default=4)
+        parser.add_argument('--writers', type=int, dest='writers', default=2)
+        parser.add_argument(
+            '--seconds', type=float, dest='seconds', default=10,
+            help='How long each configuration is measured for.')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('The default database is not SQLite.')
+        pragmas = getattr(settings, 'FOOS_SQLITE_PRAGMAS', {})
+        if not pragmas:
+            raise CommandError('FOOS_SQLITE_PRAGMAS is empty, there is nothing to compare. '
+                               'Set it to the profile to try, such as the one in settings.py.')
+
+        directory = tempfile.mkdtemp()
+        setup_test_environment()
+        # A file rather than the usual in-memory test database, so every
+        # process gets a connection of its own
+        connection.settings_dict['TEST']['NAME'] = os.path.join(directory, 'benchmark.sqlite3')
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True,
+                                                      serialize=False)
+        try:
+            seed(options['players'], 0, options['games'], 0, random_seed=1)
+            for username in ['reader%d' % i for i in range(options['readers'])] + \
+                    ['writer%d' % i for i in range(options['writers'])]:
+                User.objects.create_user(username)
+
+            # journal_mode sticks to the file, so switch it back explicitly
+            for name, profile, max_age in (('SQLite defaults', {'journal_mode': 'delete'}, 0),
+                                           ('FOOS_SQLITE_PRAGMAS', pragmas, 60)):
+                connections.close_all()
+                connection.settings_dict['CONN_MAX_AGE'] = max_age
+                get_cache().clear()
+                with override_settings(FOOS_SQLITE_PRAGMAS=profile):
+                    self._run(name, options)
+        finally:
+            connections.close_all()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def _run(self, name, options):
+        players = list(Player.objects.values_list('id', flat=True))
+        deadline = time.time() + options['seconds']
+        jobs = [(_read, 'reader%d' % i, players, deadline) for i in range(options['readers'])]
+        jobs += [(_write, 'writer%d' % i, players, deadline) for i in range(options['writers'])]
+        # Separate processes, so the readers and writers contend for the
+        # database rather than for the interpreter
+        with multiprocessing.get_context('fork').Pool(len(jobs)) as pool:
+            results = pool.map(_work, jobs)
+
+        reads, writes, errors = [], [], []
+        for (job, _, _, _), (timings, job_errors) in zip(jobs, results):
+            (reads if job is _read else writes).extend(timings)
+            errors.extend(job_errors)
+
+        seconds = options['seconds']
+        self.stdout.write(name)
+        if reads:
+            reads.sort()
+            self.stdout.write('  Pages read: %.1f/s, median %.1f ms, 95th percentile %.1f ms' % (
+                len(reads) / seconds, statistics.median(reads), reads[int(len(reads) * 0.95)]))
+        if writes:
+            self.stdout.write('  Games recorded: %.1f/s, median %.1f ms' % (
+                len(writes) / seconds, statistics.median(writes)))
+        self.stdout.write('  Errors: %d%s' % (
+            len(errors), ' (%s)' % ', '.join(sorted(set(errors))) if errors else ''))
+
+
+def _work(job):
+    action, username, players, deadline = job
+    # Forked workers would otherwise all draw the same players
+    random.seed()
+    client = Client()
+    client.force_login(User.objects.get(username=username))
+    timings, errors = [], []
+    try:
+        while time.time() < deadline:
+            started = time.perf_counter()
+            try:
+                action(client, players)
+            except OperationalError as e:
+                errors.append(str(e))
+                continue
+            timings.append((time.perf_counter() - started) * 1000)
+    finally:
+        connection.close()
+    return timings, errors
+
+
+def _read(client, players):
+    client.get(reverse('foos:api_player', args=[random.choice(players)]))
+
+
+def _write(client, players):
+    player1, player2 = random.sample(players, 2)
+    client.post(reverse('foos:new_game'), {
+        'game_type': 'singles',
+        'player1': player1,
+        'player2': player2,
+        'player1_score': 10,
+        'player2_score': random.randint(0, 9),
+    })
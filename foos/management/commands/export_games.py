@@ -0,0 +1,43 @@
+import io
+
+from django.core.management.base import BaseCommand, CommandError, OutputWrapper
+
+from foos.export import FORMATS, GAME_TYPES, export_games
+from foos.games import parse_date
+
+
+class Command(BaseCommand):
+    help = 'Exports the singles or doubles game history as CSV or JSON Lines.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('game_type', choices=GAME_TYPES)
+        parser.add_argument('path', nargs='?', default='-',
+                            help='File to write, or - for standard output.')
+        parser.add_argument('--format', choices=FORMATS, dest='format', default='csv')
+        parser.add_argument('--since', dest='since', help='First date to export.')
+        parser.add_argument('--until', dest='until', help='Export games before this date.')
+        parser.add_argument('--player', type=int, dest='player',
+                            help='Only export games this player id took part in.')
+        parser.add_argument(
+            '--chunk-size', type=int, dest='chunk_size', default=1000,
+            help='Number of games read per query.')
+
+    def handle(self, *args, **options):
+        filters = {'player': options['player']}
+        for name in ('since', 'until'):
+            if options[name]:
+                filters[name] = parse_date(options[name])
+                if filters[name] is None:
+                    raise CommandError('Invalid --%s date.' % name)
+
+        if options['path'] == '-':
+            output = self.stdout
+        else:
+            output = OutputWrapper(io.open(options['path'], 'w', encoding='utf-8', newline=''))
+        try:
+            for chunk in export_games(options['game_type'], options['format'],
+                                      chunk_size=options['chunk_size'], **filters):
+                output.write(chunk, ending='')
+        finally:
+            if output is not self.stdout:
+                output._out.close()
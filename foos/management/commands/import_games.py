@@ -0,0 +1,49 @@
+import io
+import os
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from foos.importer import FORMATS, GameImportError, import_games, read_games
+
+
+class Command(BaseCommand):
+    help = 'Imports finished singles and doubles games from a CSV or JSON Lines file.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to import, or - to read standard input.')
+        parser.add_argument(
+            '--format', choices=FORMATS, dest='format',
+            help='File format. Defaults to the file extension.')
+        parser.add_argument(
+            '--batch-size', type=int, dest='batch_size', default=500,
+            help='Number of games inserted per query.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        format = options['format']
+        if format is None:
+            format = os.path.splitext(path)[1].lstrip('.').lower()
+            if format not in FORMATS:
+                raise CommandError('Cannot tell the format of %s, use --format.' % path)
+
+        if path == '-':
+            stream = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8', newline='')
+        else:
+            stream = io.open(path, encoding='utf-8', newline='')
+        try:
+            summary = import_games(read_games(stream, format), options['batch_size'])
+        except GameImportError as e:
+            for error in e.errors:
+                self.stderr.write(error)
+            raise CommandError('Nothing was imported, %d games are invalid.' % len(e.errors))
+        finally:
+            stream.close()
+
+        self.stdout.write('Imported %d singles and %d doubles games.' % (
+            summary['singles'], summary['doubles']))
+        if summary['backdated']:
+            self.stdout.write(
+                'Some games predate games already on record, so the whole history '
+                'was rated again in date order.')
+
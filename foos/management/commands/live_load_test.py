@@ -0,0 +1,110 @@
+import asyncio
+import statistics
+import time
+from importlib import import_module
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+
+
+class Command(BaseCommand):
+    help = ('Opens many live update connections to a running server, then checks '
+            'how quickly it still answers other requests. Compares deployments, '
+            'such as the WSGI and ASGI entry points, by connection capacity.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('url', help='Address of the server, such as http://127.0.0.1:8000')
+        parser.add_argument(
+            '--username', dest='username', required=True,
+            help='Existing user to log the connections in as. The server must '
+                 'share this database.')
+        parser.add_argument('--connections', type=int, dest='connections', default=500)
+        parser.add_argument('--probes', type=int, dest='probes', default=20)
+        parser.add_argument('--probe-path', dest='probe_path',
+                            default=reverse('foos:api_singles_rankings'))
+        parser.add_argument('--timeout', type=float, dest='timeout', default=5)
+
+    def handle(self, *args, **options):
+        url = urlsplit(options['url'])
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError('No user called %s.' % options['username'])
+
+        engine = import_module(settings.SESSION_ENGINE)
+        session = engine.SessionStore()
+        session[SESSION_KEY] = user._meta.pk.value_to_string(user)
+        session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+        session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+        session.save()
+        cookie = '%s=%s' % (settings.SESSION_COOKIE_NAME, session.session_key)
+
+        loop = asyncio.get_event_loop()
+        established, latencies, failures = loop.run_until_complete(self.run(
+            url.hostname, url.port or 80, cookie, options))
+
+        self.stdout.write('Live connections held: %d of %d' % (established, options['connections']))
+        if latencies:
+            self.stdout.write('Probe requests answered: %d of %d, median %.1f ms, slowest %.1f ms' % (
+                len(latencies), options['probes'], statistics.median(latencies), max(latencies)))
+        else:
+            self.stdout.write('Probe requests answered: 0 of %d' % options['probes'])
+        if failures:
+            self.stdout.write('Probe failures: %s' % ', '.join(sorted(set(failures))))
+
+    async def run(self, host, port, cookie, options):
+        timeout = options['timeout']
+        listeners = await asyncio.gather(*[
+            self.listen(host, port, cookie, timeout) for _ in range(options['connections'])])
+        writers = [writer for writer in listeners if writer is not None]
+
+        latencies = []
+        failures = []
+        for _ in range(options['probes']):
+            started = time.perf_counter()
+            try:
+                status = await asyncio.wait_for(
+                    self.request(host, port, cookie, options['probe_path']), timeout)
+            except (asyncio.TimeoutError, OSError) as e:
+                failures.append(type(e).__name__)
+                continue
+            if status == 200:
+                latencies.append((time.perf_counter() - started) * 1000)
+            else:
+                failures.append('HTTP %d' % status)
+
+        for writer in writers:
+            writer.close()
+        return len(writers), latencies, failures
+
+    async def listen(self, host, port, cookie, timeout):
+        """Opens a live update connection, returning it once it is streaming."""
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+            writer.write(_request(host, reverse('foos:live_updates'), cookie))
+            status = await asyncio.wait_for(reader.readline(), timeout)
+        except (asyncio.TimeoutError, OSError):
+            return None
+        if b' 200 ' not in status:
+            writer.close()
+            return None
+        return writer
+
+    async def request(self, host, port, cookie, path):
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            writer.write(_request(host, path, cookie, close=True))
+            status = await reader.readline()
+            await reader.read()
+            return int(status.split()[1])
+        finally:
+            writer.close()
+
+
+def _request(host, path, cookie, close=False):
+    return ('GET %s HTTP/1.1\r\nHost: %s\r\nCookie: %s\r\n%s\r\n' % (
+        path, host, cookie, 'Connection: close\r\n' if close else '')).encode('latin1')
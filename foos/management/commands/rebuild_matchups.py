@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Case, Count, F, IntegerField, Max, Sum, Value, When
+
+from foos.models import PlayerMatchup, SinglesGame
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the head-to-head PlayerMatchup table from the singles game history.'
+
+    def handle(self, *args, **options):
+        # One grouped query over every (red, blue) pairing, counted from
+        # the red player's point of view.
+        pairings = SinglesGame.objects\
+            .values('player1', 'player2')\
+            .annotate(
+                player1_wins=Sum(Case(
+                    When(player1_score__gt=F('player2_score'), then=Value(1)),
+                    default=Value(0),
+                    output_field=IntegerField())),
+                player2_wins=Sum(Case(
+                    When(player1_score__lt=F('player2_score'), then=Value(1)),
+                    default=Value(0),
+                    output_field=IntegerField())),
+                games=Count('id'),
+                last_played=Max('date'))\
+            .order_by()
+
+        matchups = {}
+        for pairing in pairings:
+            draws = pairing['games'] - pairing['player1_wins'] - pairing['player2_wins']
+            _add_to_matchup(matchups, pairing['player1'], pairing['player2'],
+                            pairing['player1_wins'], pairing['player2_wins'],
+                            draws, pairing['last_played'])
+            _add_to_matchup(matchups, pairing['player2'], pairing['player1'],
+                            pairing['player2_wins'], pairing['player1_wins'],
+                            draws, pairing['last_played'])
+
+        with transaction.atomic():
+            PlayerMatchup.objects.all().delete()
+            PlayerMatchup.objects.bulk_create(matchups.values(), batch_size=500)
+
+        self.stdout.write('Rebuilt %d matchups.' % len(matchups))
+
+
+def _add_to_matchup(matchups, player_id, opponent_id, wins, losses, draws, last_played):
+    key = (player_id, opponent_id)
+    if key not in matchups:
+        matchups[key] = PlayerMatchup(player_id=player_id, opponent_id=opponent_id)
+    matchup = matchups[key]
+    matchup.wins += wins
+    matchup.losses += losses
+    matchup.draws += draws
+    if matchup.last_played is None or last_played > matchup.last_played:
+        matchup.last_played = last_played
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from foos import rating_history
+from foos.models import RatingPoint
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the per-player rating history from the singles game history.'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            RatingPoint.objects.all().delete()
+            count = rating_history.backfill()
+
+        self.stdout.write('Rebuilt %d rating points.' % count)
@@ -0,0 +1,154 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from foos import rating_history, ratings
+from foos.bulk import bulk_update_rows
+from foos.leaderboard_cache import bump_game_rows_version, bump_ratings_version
+from foos.models import DoublesGame, Player, RatingPoint, SinglesGame, Team
+
+
+class Command(BaseCommand):
+    help = ('Recomputes every player and team rating by replaying the game '
+            'history in date order with the configured rating engine, and '
+            'reports what changed.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true', dest='dry_run', default=False,
+            help='Report the differences without writing anything.')
+        parser.add_argument(
+            '--batch-size', type=int, dest='batch_size', default=1000,
+            help='Number of rows written per UPDATE batch.')
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        batch_size = options['batch_size']
+
+        engine = ratings.get_engine()
+        with transaction.atomic():
+            singles = _Replay(engine, SinglesGame, 'player')
+            if engine.team_skills:
+                doubles = _Replay(engine, DoublesGame, 'team', [
+                    'team1__player1', 'team1__player2', 'team2__player1', 'team2__player2'])
+            else:
+                doubles = _Replay(engine, DoublesGame, 'team')
+            for replay in (singles, doubles):
+                changed_games = replay.changed_games()
+                if dry_run:
+                    # Run the replay for its report only
+                    for _ in changed_games:
+                        pass
+                else:
+                    bulk_update_rows(replay.game_model, replay.game_fields,
+                                     changed_games, batch_size)
+            if singles.changed and not dry_run:
+                RatingPoint.objects.all().delete()
+                rating_history.backfill()
+
+            players = list(Player.objects.order_by('id'))
+            player_changes = _rating_changes(
+                players, lambda player: engine.rating(singles.state(player.id)))
+            if engine.team_skills:
+                def team_rating(team):
+                    return engine.team_rating([doubles.state(team.player1_id),
+                                               doubles.state(team.player2_id)])
+            else:
+                def team_rating(team):
+                    return engine.rating(doubles.state(team.id))
+            team_changes = _rating_changes(
+                Team.objects.select_related('player1', 'player2').order_by('id'), team_rating)
+            if not dry_run:
+                if engine.keeps_state:
+                    for player in players:
+                        ratings.set_states(
+                            engine, player, singles=singles.state(player.id),
+                            doubles=doubles.state(player.id) if engine.team_skills else None)
+                    bulk_update_rows(Player, ['rating', 'rating_state'],
+                                     [(player.rating, player.rating_state, player.id)
+                                      for player in players], batch_size)
+                else:
+                    bulk_update_rows(Player, ['rating'],
+                                     [(new, pk) for pk, _, _, new in player_changes],
+                                     batch_size)
+                bulk_update_rows(Team, ['rating'],
+                                 [(new, pk) for pk, _, _, new in team_changes],
+                                 batch_size)
+                transaction.on_commit(bump_ratings_version)
+                transaction.on_commit(bump_game_rows_version)
+
+        self.stdout.write('Replayed %d singles games (%d changed) and %d doubles games (%d changed).' % (
+            singles.games, singles.changed, doubles.games, doubles.changed))
+        self._report('player', player_changes, options['verbosity'])
+        self._report('team', team_changes, options['verbosity'])
+        if dry_run:
+            self.stdout.write('Dry run, nothing was written.')
+
+    def _report(self, kind, changes, verbosity):
+        self.stdout.write('%d %s ratings changed.' % (len(changes), kind))
+        if verbosity > 1:
+            for _, name, old, new in changes:
+                self.stdout.write('  %s: %d -> %d (%+d)' % (name, old, new, new - old))
+
+
+class _Replay(object):
+    """
+    Replays one game table over in-memory rating states, keyed by participant
+    id. With `members`, the columns of each side's players, the players are
+    rated rather than the sides.
+    """
+
+    def __init__(self, engine, game_model, prefix, members=()):
+        self.engine = engine
+        self.game_model = game_model
+        self.game_fields = [
+            '%s1_start_rating' % prefix,
+            '%s2_start_rating' % prefix,
+            '%s1_end_rating' % prefix,
+            '%s2_end_rating' % prefix,
+        ]
+        self.members = list(members)
+        self.columns = ['id', '%s1_id' % prefix, '%s2_id' % prefix,
+                        '%s1_score' % prefix, '%s2_score' % prefix] + \
+            self.game_fields + self.members
+        self.states = {}
+        self.games = 0
+        self.changed = 0
+
+    def state(self, participant_id):
+        return self.states.get(participant_id) or self.engine.initial_state()
+
+    def changed_games(self):
+        """Yields (start1, start2, end1, end2, id) for every game whose stored ratings are wrong."""
+        engine = self.engine
+        states = self.states
+        games = self.game_model.objects\
+            .order_by('date', 'id')\
+            .values_list(*self.columns)\
+            .iterator()
+        for game in games:
+            pk, side1, side2, score1, score2 = game[:5]
+            if self.members:
+                side1, side2 = game[9:11], game[11:13]
+            else:
+                side1, side2 = (side1,), (side2,)
+            start1 = [self.state(participant) for participant in side1]
+            start2 = [self.state(participant) for participant in side2]
+            end1, end2 = engine.rate(start1, start2, score1, score2)
+            states.update(zip(side1, end1))
+            states.update(zip(side2, end2))
+
+            self.games += 1
+            replayed = (engine.team_rating(start1), engine.team_rating(start2),
+                        engine.team_rating(end1), engine.team_rating(end2))
+            if replayed != game[5:9]:
+                self.changed += 1
+                yield replayed + (pk,)
+
+
+def _rating_changes(participants, new_rating):
+    changes = []
+    for obj in participants:
+        rating = new_rating(obj)
+        if rating != obj.rating:
+            changes.append((obj.id, str(obj), obj.rating, rating))
+    return changes
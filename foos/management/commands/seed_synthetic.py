@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from foos.synthetic import seed
+
+
+class Command(BaseCommand):
+    help = ('Adds synthetic players, teams and rated games, for trying '
+            'tabletracker out at scale. Do not run against real data.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--players', type=int, dest='players', default=50)
+        parser.add_argument('--teams', type=int, dest='teams', default=100)
+        parser.add_argument('--singles', type=int, dest='singles', default=10000)
+        parser.add_argument('--doubles', type=int, dest='doubles', default=5000)
+        parser.add_argument(
+            '--days', type=int, dest='days', default=365,
+            help='Games are spread over this many days up to now.')
+        parser.add_argument(
+            '--seed', type=int, dest='seed',
+            help='Random seed, for generating the same data again.')
+        parser.add_argument(
+            '--batch-size', type=int, dest='batch_size', default=500,
+            help='Number of games inserted per query.')
+
+    def handle(self, *args, **options):
+        try:
+            summary = seed(options['players'], options['teams'],
+                           options['singles'], options['doubles'],
+                           options['days'], options['seed'], options['batch_size'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write('Added %d players, %d teams, %d singles and %d doubles games.' % (
+            options['players'], options['teams'], summary['singles'], summary['doubles']))
@@ -0,0 +1,65 @@
+import datetime
+import time
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+
+from foos import ratings
+from foos.models import Player, Team
+
+
+class Command(BaseCommand):
+    help = ('Rates the whole game history with another rating engine, without '
+            'saving anything, and shows the rankings it gives next to the '
+            'current ones.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('engine', choices=sorted(ratings.ENGINES))
+        parser.add_argument(
+            '--option', action='append', dest='options', default=[],
+            metavar='NAME=VALUE', help='An engine parameter, such as tau=0.3. Repeatable.')
+        parser.add_argument(
+            '--period-days', type=float, dest='period_days', default=1,
+            help='Length of a rating period, for engines that rate periods.')
+        parser.add_argument('--limit', type=int, dest='limit', default=20,
+                            help='Number of players and teams shown.')
+
+    def handle(self, *args, **options):
+        engine_options = {}
+        for option in options['options']:
+            name, _, value = option.partition('=')
+            try:
+                engine_options[name] = float(value)
+            except ValueError:
+                raise CommandError('Engine options look like tau=0.3, not %s.' % option)
+        try:
+            engine = ratings.get_engine(options['engine'], **engine_options)
+        except (ImproperlyConfigured, TypeError) as e:
+            raise CommandError(e)
+
+        started = time.perf_counter()
+        history = ratings.rate_history(
+            engine, period=datetime.timedelta(days=options['period_days']))
+        self.stdout.write('Rated %d singles and %d doubles games in %.2fs.' % (
+            len(history.singles[1]), len(history.doubles[1]), time.perf_counter() - started))
+
+        players = Player.objects.filter(singles_games_played__gt=0)
+        self._compare('Players', players, history.players, options['limit'])
+        teams = Team.objects.filter(games_played__gt=0).select_related('player1', 'player2')
+        self._compare('Teams', teams, history.teams, options['limit'])
+
+    def _compare(self, title, participants, shadow, limit):
+        participants = list(participants)
+        current_rank = _ranks(participants, lambda participant: participant.rating)
+        shadow_rank = _ranks(participants, lambda participant: shadow[participant.id])
+        self.stdout.write('\n%-24s %10s  %10s' % (title, 'current', 'shadow'))
+        shown = sorted(participants, key=lambda participant: shadow_rank[participant.id])
+        for participant in shown[:limit]:
+            self.stdout.write('%-24s %4d %5d  %4d %5d' % (
+                str(participant)[:24], current_rank[participant.id], participant.rating,
+                shadow_rank[participant.id], shadow[participant.id]))
+
+
+def _ranks(participants, rating):
+    ordered = sorted(participants, key=lambda participant: (-rating(participant), participant.id))
+    return {participant.id: rank for rank, participant in enumerate(ordered, 1)}
@@ -0,0 +1,107 @@
+import json
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from foos import simulation
+from foos.models import Player, Team
+
+
+class Command(BaseCommand):
+    help = ('Simulates a knockout bracket or a round robin between players or '
+            'teams many times over, and prints everyone\'s chance of reaching '
+            'each round or finishing in each place.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('format', choices=['bracket', 'round-robin'])
+        parser.add_argument(
+            'entrants', nargs='+', type=int,
+            help='Player (or team) ids. In a bracket the first plays the second, '
+                 'the third the fourth and so on, unless --seeded.')
+        parser.add_argument('--teams', action='store_true', dest='teams', default=False,
+                            help='The entrants are teams.')
+        parser.add_argument(
+            '--seeded', action='store_true', dest='seeded', default=False,
+            help='The entrants are given best seed first; place them in the bracket '
+                 'so the top seeds meet last, with byes going to the top seeds.')
+        parser.add_argument('--legs', type=int, dest='legs', default=1,
+                            help='Times everyone plays everyone in a round robin.')
+        parser.add_argument('--trials', type=int, dest='trials', default=100000)
+        parser.add_argument('--processes', type=int, dest='processes',
+                            default=os.cpu_count())
+        parser.add_argument('--seed', type=int, dest='seed', default=None,
+                            help='Random seed, for repeatable results.')
+        parser.add_argument('--output', dest='output',
+                            help='Also write the results to this JSON file.')
+
+    def handle(self, *args, **options):
+        ids = options['entrants']
+        if len(set(ids)) != len(ids):
+            raise CommandError('Every entrant can only be entered once.')
+        if len(ids) < 2:
+            raise CommandError('A tournament needs at least two entrants.')
+        if options['trials'] < 1:
+            raise CommandError('--trials must be at least 1.')
+        if options['legs'] < 1:
+            raise CommandError('--legs must be at least 1.')
+        model = Team if options['teams'] else Player
+        try:
+            entrants = simulation.load_entrants(model, ids)
+        except model.DoesNotExist as e:
+            raise CommandError(e)
+
+        started = time.perf_counter()
+        ratings = [entrant.rating for entrant in entrants]
+        if options['format'] == 'bracket':
+            if options['seeded']:
+                bracket = [None if seed is None else entrants[seed]
+                           for seed in simulation.seeded_order(len(entrants))]
+            else:
+                bracket = entrants
+            bracket_entrants = [entrant for entrant in bracket if entrant is not None]
+            chances = simulation.simulate_bracket(
+                [None if entrant is None else entrant.rating for entrant in bracket],
+                options['trials'], processes=options['processes'], seed=options['seed'])
+            # Back in the order the entrants were given
+            position = {entrant.id: i for i, entrant in enumerate(bracket_entrants)}
+            chances = chances[[position[entrant.id] for entrant in entrants]]
+            columns = simulation.round_names(len(bracket))
+            extra = {}
+        else:
+            chances, wins = simulation.simulate_round_robin(
+                ratings, options['trials'], legs=options['legs'],
+                processes=options['processes'], seed=options['seed'])
+            columns = [_ordinal(place) for place in range(1, len(entrants) + 1)]
+            extra = {'Wins': wins}
+        self.stdout.write('Simulated %d %ss in %.1fs.\n' % (
+            options['trials'], options['format'].replace('-', ' '),
+            time.perf_counter() - started))
+
+        self.stdout.write('%-24s %6s%s%s' % (
+            'Entrant', 'Rating', ''.join(' %7s' % column for column in extra),
+            ''.join(' %13s' % column[:13] for column in columns)))
+        for i, entrant in enumerate(entrants):
+            self.stdout.write('%-24s %6d%s%s' % (
+                str(entrant)[:24], entrant.rating,
+                ''.join(' %7.2f' % values[i] for values in extra.values()),
+                ''.join(' %12.1f%%' % (chance * 100) for chance in chances[i])))
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({
+                    'format': options['format'],
+                    'trials': options['trials'],
+                    'columns': columns,
+                    'entrants': [dict(
+                        {'id': entrant.id, 'name': str(entrant), 'rating': entrant.rating,
+                         'chances': chances[i].tolist()},
+                        **{name.lower(): float(values[i]) for name, values in extra.items()})
+                        for i, entrant in enumerate(entrants)],
+                }, f, indent=2)
+
+
+def _ordinal(place):
+    if place % 100 in (11, 12, 13):
+        return '%dth' % place
+    return '%d%s' % (place, {1: 'st', 2: 'nd', 3: 'rd'}.get(place % 10, 'th'))
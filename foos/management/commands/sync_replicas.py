@@ -0,0 +1,59 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from foos.leaderboard_cache import bump_ratings_version
+from foos.replicas import _replicas, copy_sqlite_database
+
+
+class Command(BaseCommand):
+    help = ('Stands in for replication when developing with SQLite: copies the '
+            'primary database over every FOOS_READ_REPLICAS database whenever '
+            'it changes.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval', type=float, dest='interval', default=1,
+            help='Seconds between checks for changes.')
+        parser.add_argument(
+            '--once', action='store_true', dest='once', default=False,
+            help='Copy once and exit.')
+
+    def handle(self, *args, **options):
+        source = _sqlite_file('default')
+        targets = [_sqlite_file(alias) for alias in _replicas()]
+        if not targets:
+            raise CommandError('No replicas in FOOS_READ_REPLICAS.')
+
+        last = None
+        while True:
+            current = [_modified(path) for path in (source, source + '-wal')]
+            if current != last:
+                for target in targets:
+                    copy_sqlite_database(source, target)
+                # Leaderboard fragments cached while the replicas lagged
+                # hold the old games; newer ones have to be rendered again
+                bump_ratings_version()
+                self.stdout.write('Copied %s to %s' % (source, ', '.join(targets)))
+                last = current
+            if options['once']:
+                return
+            time.sleep(options['interval'])
+
+
+def _modified(path):
+    # In WAL mode commits only reach the main file when it is checkpointed
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _sqlite_file(alias):
+    connection = connections[alias]
+    if connection.vendor != 'sqlite':
+        raise CommandError('%s is not an SQLite database.' % alias)
+    return connection.settings_dict['NAME']
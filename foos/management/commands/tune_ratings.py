@@ -0,0 +1,131 @@
+import datetime
+import inspect
+import itertools
+import json
+import multiprocessing
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from foos import ratings
+
+# The loaded history, inherited by the forked workers rather than copied
+# to each of them
+_games = None
+
+
+class Command(BaseCommand):
+    help = ('Rates the whole game history with every combination of the given '
+            'engine parameters, and ranks the combinations by how well their '
+            'ratings predicted each game before it was played.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('engine', choices=sorted(ratings.ENGINES))
+        parser.add_argument(
+            '--grid', action='append', dest='grid', default=[], metavar='NAME=VALUES',
+            help='Values to try for an engine parameter, as a list (k=16,24,32) or '
+                 'a range with its end included (k=8:64:4). Repeatable.')
+        parser.add_argument(
+            '--period-days', type=float, dest='period_days', default=1,
+            help='Length of a rating period, for engines that rate periods.')
+        parser.add_argument('--processes', type=int, dest='processes',
+                            default=os.cpu_count())
+        parser.add_argument('--top', type=int, dest='top', default=20,
+                            help='Number of combinations shown.')
+        parser.add_argument('--output', dest='output',
+                            help='Also write every score to this JSON file.')
+
+    def handle(self, *args, **options):
+        global _games
+        name = options['engine']
+        grid = [_parse_grid(value) for value in options['grid']]
+        if not grid:
+            raise CommandError('Give at least one --grid parameter.')
+        names = [parameter for parameter, _ in grid]
+        points = [dict(zip(names, values))
+                  for values in itertools.product(*[values for _, values in grid])]
+
+        parameters = inspect.signature(ratings.ENGINES[name]).parameters
+        unknown = sorted(set(names) - set(parameters))
+        if unknown:
+            raise CommandError('The %s engine takes %s, not %s.' % (
+                name, ', '.join(parameters), ', '.join(unknown)))
+
+        # The parameters in use, or the engine's defaults, for comparison
+        if name == getattr(settings, 'FOOS_RATING_ENGINE', 'elo'):
+            current = ratings.get_engine()
+        else:
+            current = ratings.get_engine(name)
+        current = {parameter: getattr(current, parameter) for parameter in names}
+        if current not in points:
+            points.append(current)
+
+        started = time.perf_counter()
+        _games = ratings.load_games(ratings.ENGINES[name].team_skills)
+        self.stdout.write('Loaded %d singles and %d doubles games in %.1fs.' % (
+            len(_games.singles[3]), len(_games.doubles[3]), time.perf_counter() - started))
+
+        started = time.perf_counter()
+        period = datetime.timedelta(days=options['period_days'])
+        jobs = [(name, point, period) for point in points]
+        processes = max(1, min(options['processes'], len(jobs)))
+        with multiprocessing.get_context('fork').Pool(processes) as pool:
+            scores = pool.map(_score, jobs, chunksize=max(1, len(jobs) // (processes * 4)))
+        self.stdout.write('Scored %d parameter combinations in %.1fs, %d at a time.' % (
+            len(jobs), time.perf_counter() - started, processes))
+
+        scores.sort(key=lambda score: (score['log_loss'], score['brier']))
+        self.stdout.write('\n      %-32s %9s %9s %9s %9s' % (
+            'parameters', 'log loss', 'Brier', 'singles', 'doubles'))
+        for rank, score in enumerate(scores, 1):
+            if rank > options['top'] and score['parameters'] != current:
+                continue
+            self.stdout.write('%4d%s %-32s %9.5f %9.5f %9.5f %9.5f' % (
+                rank, '*' if score['parameters'] == current else ' ',
+                ' '.join('%s=%g' % item for item in sorted(score['parameters'].items())),
+                score['log_loss'], score['brier'], score['singles_log_loss'],
+                score['doubles_log_loss']))
+        self.stdout.write('\n* current parameters. Lower is better; singles and doubles '
+                          'are log losses.')
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({'engine': name, 'period_days': options['period_days'],
+                           'scores': scores}, f, indent=2)
+
+
+def _parse_grid(value):
+    name, _, values = value.partition('=')
+    try:
+        if ':' in values:
+            start, stop, step = [float(bound) for bound in values.split(':')]
+            count = int(round((stop - start) / step)) + 1
+            return name, [round(start + step * i, 10) for i in range(count)]
+        return name, [float(value) for value in values.split(',')]
+    except ValueError:
+        raise CommandError('Grid values look like k=16,24,32 or k=8:64:4, not %s.' % value)
+
+
+def _score(job):
+    name, parameters, period = job
+    history = ratings.rate_history(ratings.ENGINES[name](**parameters), period, games=_games)
+    score = {'parameters': parameters}
+    for prefix, (expected, results) in (('singles_', history.singles),
+                                        ('doubles_', history.doubles)):
+        score[prefix + 'log_loss'] = _log_loss(expected, results)
+    expected = ratings.np.concatenate([history.singles[0], history.doubles[0]])
+    results = ratings.np.concatenate([history.singles[1], history.doubles[1]])
+    score['log_loss'] = _log_loss(expected, results)
+    score['brier'] = float(((expected - results) ** 2).mean()) if len(results) else 0.0
+    return score
+
+
+def _log_loss(expected, results):
+    # Draws count as half a win, so they are scored like any other result
+    if not len(results):
+        return 0.0
+    expected = ratings.np.clip(expected, 1e-12, 1 - 1e-12)
+    return float(-(results * ratings.np.log(expected) +
+                   (1 - results) * ratings.np.log(1 - expected)).mean())
@@ -0,0 +1,157 @@
+"""
+Balanced games among the players present.
+
+Singles pair up two players and doubles split four into two teams. A team
+that has played keeps its own rating; any other pair is rated by its
+players, as the configured engine would rate them together. Games are
+ranked by how close the expected score is to even.
+
+Rather than trying every split of every four players, candidates (players,
+or every possible pair of them) are sorted by rating, so the closest
+matches are near each other. The search compares each candidate with the
+one d places up, all candidates at once, for d = 1, 2, ... and stops once
+even the smallest gap d places apart can't beat the games already found.
+"""
+from django.core.exceptions import ImproperlyConfigured
+
+from . import ratings
+from .models import Player, Team
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+GAMES = 10
+MAX_GAMES = 50
+
+
+def find_games(game_type, player_ids, limit=GAMES):
+    """
+    The `limit` most balanced games of `game_type` among `player_ids`,
+    best first. Players that don't exist are left out.
+    """
+    if np is None:
+        raise ImproperlyConfigured('Matchmaking needs NumPy.')
+    engine = ratings.get_engine()
+    players = list(Player.objects.filter(id__in=player_ids).order_by('id'))
+    if game_type == 'singles':
+        return _singles(engine, players, limit)
+    return _doubles(engine, players, limit)
+
+
+def player_ids(values):
+    """Player ids from query parameters, repeated, comma separated or both."""
+    ids = []
+    for value in values:
+        for player_id in value.split(','):
+            try:
+                ids.append(int(player_id))
+            except ValueError:
+                pass
+    return ids
+
+
+def _singles(engine, players, limit):
+    rating = np.array([player.rating for player in players], dtype=float)
+    order = np.argsort(rating, kind='stable')
+    games = []
+    for lower, higher in _closest(rating[order], limit):
+        player1, player2 = players[order[higher]], players[order[lower]]
+        games.append({
+            'player1': _player(player1),
+            'player2': _player(player2),
+            'expected': _expected(engine, player1.rating, player2.rating),
+        })
+    return games
+
+
+def _doubles(engine, players, limit):
+    if len(players) < 4:
+        return []
+    # Every possible pair, rated from its players...
+    if engine.team_skills:
+        rating = np.array([engine.rating(ratings.doubles_state(engine, player))
+                           for player in players], dtype=float)
+    else:
+        rating = np.array([player.rating for player in players], dtype=float)
+    first, second = np.triu_indices(len(players), 1)
+    pair_rating = np.rint((rating[first] + rating[second]) / 2)
+
+    # ...unless it is a team already
+    index = {player.id: i for i, player in enumerate(players)}
+    teams = {}
+    ids = list(index)
+    for team in Team.objects.filter(player1__in=ids, player2__in=ids):
+        i, j = sorted((index[team.player1_id], index[team.player2_id]))
+        pair = i * len(players) - i * (i + 1) // 2 + j - i - 1
+        pair_rating[pair] = team.rating
+        teams[pair] = team
+
+    order = np.argsort(pair_rating, kind='stable')
+    first, second = first[order], second[order]
+
+    def shares_player(lower, higher):
+        return (first[lower] == first[higher]) | (first[lower] == second[higher]) | \
+            (second[lower] == first[higher]) | (second[lower] == second[higher])
+
+    games = []
+    for lower, higher in _closest(pair_rating[order], limit, shares_player):
+        team1 = _team(players, teams.get(order[higher]), first[higher], second[higher],
+                      pair_rating[order[higher]])
+        team2 = _team(players, teams.get(order[lower]), first[lower], second[lower],
+                      pair_rating[order[lower]])
+        games.append({
+            'team1': team1,
+            'team2': team2,
+            'expected': _expected(engine, team1['rating'], team2['rating']),
+        })
+    return games
+
+
+def _closest(values, limit, conflicts=None):
+    """
+    Index pairs (lower, higher) of the `limit` closest values in the sorted
+    array `values`, closest first, leaving out pairs that `conflicts`.
+    """
+    found_gaps = np.empty(0)
+    found_lower = np.empty(0, dtype=int)
+    found_higher = np.empty(0, dtype=int)
+    bound = np.inf
+    for offset in range(1, len(values)):
+        lower = np.arange(len(values) - offset)
+        higher = lower + offset
+        gaps = values[higher] - values[lower]
+        # Values are sorted, so gaps only widen further apart
+        if gaps.min() >= bound:
+            break
+        keep = gaps < bound
+        if conflicts is not None:
+            keep &= ~conflicts(lower, higher)
+        found_gaps = np.concatenate([found_gaps, gaps[keep]])
+        found_lower = np.concatenate([found_lower, lower[keep]])
+        found_higher = np.concatenate([found_higher, higher[keep]])
+        best = np.argsort(found_gaps, kind='stable')[:limit]
+        found_gaps, found_lower, found_higher = \
+            found_gaps[best], found_lower[best], found_higher[best]
+        if len(found_gaps) == limit:
+            bound = found_gaps[-1]
+    return list(zip(found_lower.tolist(), found_higher.tolist()))
+
+
+def _expected(engine, rating, opponent_rating):
+    # The Elo expected score. Every engine shows ratings on the Elo scale.
+    scale = getattr(engine, 'scale', 400)
+    return round(1 / (1 + 10 ** ((opponent_rating - rating) / scale)), 3)
+
+
+def _player(player):
+    return {'id': player.id, 'name': player.name, 'rating': player.rating}
+
+
+def _team(players, team, first, second, rating):
+    return {
+        'id': team.id if team else None,
+        'players': [{'id': players[i].id, 'name': players[i].name} for i in (first, second)],
+        'rating': int(rating),
+    }
@@ -0,0 +1,154 @@
+"""
+Per-view request latency and SQL metrics.
+
+Add 'foos.metrics.MetricsMiddleware' at the top of MIDDLEWARE to record,
+for every view including auth and admin, how long requests take, how many
+queries they run and how long those queries take. Staff can read the
+numbers in Prometheus text format at /metrics/.
+
+Histograms are kept in process, so every worker reports its own and
+Prometheus has to scrape each of them. Requests slower than
+FOOS_SLOW_REQUEST_SECONDS (default 1) log their slowest queries to the
+'foos.metrics' logger.
+"""
+import bisect
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.db import connections
+from django.http import HttpResponse
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+# Number of queries logged for a slow request
+SLOW_QUERIES_LOGGED = 5
+
+
+class Histogram(object):
+    """A Prometheus style histogram with one series per view."""
+
+    def __init__(self, name, description, buckets):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, view, value):
+        with self.lock:
+            series = self.series.get(view)
+            if series is None:
+                series = self.series[view] = [[0] * len(self.buckets), 0, 0]
+            counts = series[0]
+            # Buckets are cumulative when written out, so only the first
+            # one the value fits in is counted here
+            i = bisect.bisect_left(self.buckets, value)
+            if i < len(counts):
+                counts[i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def exposition(self):
+        lines = [
+            '# HELP %s %s' % (self.name, self.description),
+            '# TYPE %s histogram' % self.name,
+        ]
+        with self.lock:
+            series = sorted((view, list(counts), total, count)
+                            for view, (counts, total, count) in self.series.items())
+        for view, counts, total, count in series:
+            label = _escape(view)
+            cumulative = 0
+            for bucket, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append('%s_bucket{view="%s",le="%s"} %d' % (
+                    self.name, label, _format(bucket), cumulative))
+            lines.append('%s_bucket{view="%s",le="+Inf"} %d' % (self.name, label, count))
+            lines.append('%s_sum{view="%s"} %s' % (self.name, label, _format(total)))
+            lines.append('%s_count{view="%s"} %d' % (self.name, label, count))
+        return lines
+
+    def clear(self):
+        with self.lock:
+            self.series.clear()
+
+
+REQUEST_DURATION = Histogram(
+    'tabletracker_request_duration_seconds',
+    'Time taken to answer a request.',
+    LATENCY_BUCKETS)
+QUERY_COUNT = Histogram(
+    'tabletracker_request_queries',
+    'Number of SQL queries run for a request.',
+    QUERY_COUNT_BUCKETS)
+QUERY_DURATION = Histogram(
+    'tabletracker_request_query_duration_seconds',
+    'Total time spent in SQL queries for a request.',
+    LATENCY_BUCKETS)
+HISTOGRAMS = (REQUEST_DURATION, QUERY_COUNT, QUERY_DURATION)
+
+
+class MetricsMiddleware(object):
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        # Debug cursors log every query along with its time. The log is
+        # reset at the start of every request, so it only grows for the
+        # length of one.
+        tracked = []
+        for connection in connections.all():
+            tracked.append((connection, connection.force_debug_cursor,
+                            len(connection.queries_log)))
+            connection.force_debug_cursor = True
+
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            duration = time.perf_counter() - started
+            queries = []
+            for connection, force_debug_cursor, start in tracked:
+                connection.force_debug_cursor = force_debug_cursor
+                queries.extend(list(connection.queries_log)[start:])
+
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else '<unresolved>'
+        query_time = sum(float(query['time']) for query in queries)
+        REQUEST_DURATION.observe(view, duration)
+        QUERY_COUNT.observe(view, len(queries))
+        QUERY_DURATION.observe(view, query_time)
+
+        if duration >= getattr(settings, 'FOOS_SLOW_REQUEST_SECONDS', 1):
+            slowest = sorted(queries, key=lambda query: float(query['time']), reverse=True)
+            logger.warning(
+                'Slow request to %s (%s): %.3fs with %d queries taking %.3fs. Slowest:\n%s',
+                request.path, view, duration, len(queries), query_time,
+                '\n'.join('  %ss %s' % (query['time'], query['sql'])
+                          for query in slowest[:SLOW_QUERIES_LOGGED]))
+
+        return response
+
+
+@staff_member_required
+def metrics(request):
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.exposition())
+    return HttpResponse('\n'.join(lines) + '\n',
+                        content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def _format(value):
+    return repr(float(value))
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
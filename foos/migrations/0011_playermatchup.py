@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 11:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def populate_matchups(apps, schema_editor):
+    SinglesGame = apps.get_model('foos', 'SinglesGame')
+    PlayerMatchup = apps.get_model('foos', 'PlayerMatchup')
+    matchups = {}
+    for game in SinglesGame.objects.order_by('date'):
+        for player_id, opponent_id, score, opponent_score in (
+                (game.player1_id, game.player2_id, game.player1_score, game.player2_score),
+                (game.player2_id, game.player1_id, game.player2_score, game.player1_score)):
+            key = (player_id, opponent_id)
+            if key not in matchups:
+                matchups[key] = PlayerMatchup(player_id=player_id, opponent_id=opponent_id)
+            matchup = matchups[key]
+            if score > opponent_score:
+                matchup.wins += 1
+            elif score < opponent_score:
+                matchup.losses += 1
+            else:
+                matchup.draws += 1
+            matchup.last_played = game.date
+    PlayerMatchup.objects.bulk_create(matchups.values())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foos', '0010_auto_20170209_2050'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlayerMatchup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('wins', models.IntegerField(default=0)),
+                ('losses', models.IntegerField(default=0)),
+                ('draws', models.IntegerField(default=0)),
+                ('last_played', models.DateTimeField(blank=True, null=True)),
+                ('opponent', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='opponent_matchups', to='foos.Player')),
+                ('player', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='matchups', to='foos.Player')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='playermatchup',
+            unique_together=set([('player', 'opponent')]),
+        ),
+        migrations.RunPython(populate_matchups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 11:07
+from __future__ import unicode_literals
+
+import datetime
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foos', '0011_playermatchup'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='doublesgame',
+            name='date',
+            field=models.DateTimeField(blank=True, db_index=True, default=datetime.datetime.now),
+        ),
+        migrations.AlterField(
+            model_name='singlesgame',
+            name='date',
+            field=models.DateTimeField(blank=True, db_index=True, default=datetime.datetime.now),
+        ),
+        migrations.AlterIndexTogether(
+            name='doublesgame',
+            index_together=set([('team1', 'team2'), ('team1', 'date'), ('team2', 'date')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='singlesgame',
+            index_together=set([('player2', 'date'), ('player1', 'date'), ('player1', 'player2')]),
+        ),
+    ]
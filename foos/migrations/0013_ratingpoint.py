@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 11:11
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foos', '0012_game_history_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RatingPoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateTimeField()),
+                ('rating', models.IntegerField()),
+                ('game', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rating_points', to='foos.SinglesGame')),
+                ('player', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rating_points', to='foos.Player')),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='ratingpoint',
+            index_together=set([('player', 'date')]),
+        ),
+        migrations.RunSQL(
+            ['INSERT INTO foos_ratingpoint (player_id, game_id, date, rating) '
+             'SELECT player1_id, id, date, player1_end_rating FROM foos_singlesgame '
+             'UNION ALL '
+             'SELECT player2_id, id, date, player2_end_rating FROM foos_singlesgame'],
+            migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 11:14
+from __future__ import unicode_literals
+
+from django.db import migrations
+from django.db.models import Q
+
+
+def merge_duplicate_teams(apps, schema_editor):
+    """
+    Stores every team with the lower player id first and folds teams of
+    the same two players into the oldest one, along with their games and
+    counters.
+
+    A merged team's games keep the ratings of the two teams it was made
+    from. Run replay_ratings after migrating to rate them as one team.
+    """
+    Team = apps.get_model('foos', 'Team')
+    DoublesGame = apps.get_model('foos', 'DoublesGame')
+    teams_by_pair = {}
+    for team in Team.objects.order_by('id'):
+        pair = tuple(sorted((team.player1_id, team.player2_id)))
+        teams_by_pair.setdefault(pair, []).append(team)
+
+    for (player1_id, player2_id), teams in teams_by_pair.items():
+        keeper, duplicates = teams[0], teams[1:]
+        if not duplicates and keeper.player1_id == player1_id:
+            continue
+        if duplicates:
+            duplicate_ids = [team.id for team in duplicates]
+            DoublesGame.objects.filter(team1__in=duplicate_ids).update(team1=keeper)
+            DoublesGame.objects.filter(team2__in=duplicate_ids).update(team2=keeper)
+            for team in duplicates:
+                keeper.wins += team.wins
+                keeper.losses += team.losses
+                keeper.draws += team.draws
+                keeper.games_played += team.games_played
+            # The merged team carries on from whichever half played last
+            last_game = DoublesGame.objects\
+                .filter(Q(team1=keeper) | Q(team2=keeper))\
+                .order_by('-date', '-id')\
+                .first()
+            if last_game is not None:
+                if last_game.team1_id == keeper.id:
+                    keeper.rating = last_game.team1_end_rating
+                else:
+                    keeper.rating = last_game.team2_end_rating
+            Team.objects.filter(id__in=duplicate_ids).delete()
+        keeper.player1_id = player1_id
+        keeper.player2_id = player2_id
+        keeper.save()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foos', '0013_ratingpoint'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_teams, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='team',
+            unique_together=set([('player1', 'player2')]),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 11:38
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foos', '0014_canonical_teams'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='player',
+            name='rating_state',
+            field=models.TextField(blank=True, default=''),
+        ),
+    ]
@@ -3,6 +3,9 @@ import datetime
 from dateutil import tz
 from django.db import models
 
+# Game times are shown in the office's time zone
+DISPLAY_TZ = tz.gettz('EST')
+
 
 class Player(models.Model):
     name = models.CharField(max_length=100)
@@ -15,6 +18,8 @@ class Player(models.Model):
     doubles_draws = models.IntegerField(default=0)
     doubles_games_played = models.IntegerField(default=0)
     rating = models.IntegerField(default=1000)
+    # JSON kept by rating engines that track more than a number
+    rating_state = models.TextField(blank=True, default='')
 
     def __str__(self):
         return "%s" % (self.name)
@@ -30,7 +35,7 @@ class SinglesGame(models.Model):
     player1_end_rating = models.IntegerField(default=1000)
     player2_end_rating = models.IntegerField(default=1000)
     date = models.DateTimeField(default=datetime.datetime.now,
-                                blank=True)
+                                blank=True, db_index=True)
 
     def get_winner(self):
         if self.player1_score > self.player2_score:
@@ -40,14 +45,21 @@ class SinglesGame(models.Model):
 
     @property
     def get_date_string(self):
-        desired_tz = tz.gettz('EST')
-        modified_time = self.date.astimezone(desired_tz)
+        modified_time = self.date.astimezone(DISPLAY_TZ)
         return modified_time.strftime('%m/%d %I:%M %p')
 
     def __str__(self):
         return "%s vs. %s" % (self.player1,
                               self.player2)
 
+    class Meta:
+        # A player's history is read one slot at a time, newest first
+        index_together = [
+            ('player1', 'date'),
+            ('player2', 'date'),
+            ('player1', 'player2'),
+        ]
+
 
 class Team(models.Model):
     player1 = models.ForeignKey(Player, related_name='team_player1', on_delete=models.CASCADE)
@@ -62,6 +74,11 @@ class Team(models.Model):
         return "%s, %s" % (self.player1.name,
                            self.player2.name)
 
+    class Meta:
+        # Teams are stored with the lower player id as player1, so this
+        # also covers the same two players the other way round
+        unique_together = [('player1', 'player2')]
+
 
 class DoublesGame(models.Model):
     team1 = models.ForeignKey(Team, related_name='doubles_team1', on_delete=models.CASCADE)
@@ -73,13 +90,54 @@ class DoublesGame(models.Model):
     team1_end_rating = models.IntegerField(default=1000)
     team2_end_rating = models.IntegerField(default=1000)
     date = models.DateTimeField(default=datetime.datetime.now,
-                                blank=True)
+                                blank=True, db_index=True)
 
     @property
     def get_date_string(self):
-        desired_tz = tz.gettz('EST')
-        modified_time = self.date.astimezone(desired_tz)
+        modified_time = self.date.astimezone(DISPLAY_TZ)
         return modified_time.strftime('%m/%d %I:%M %p')
 
     def _str__(self):
         return "%s vs. %s" % (self.team1, self.team2)
+
+    class Meta:
+        index_together = [
+            ('team1', 'date'),
+            ('team2', 'date'),
+            ('team1', 'team2'),
+        ]
+
+
+class PlayerMatchup(models.Model):
+    # Head-to-head singles record of player vs. opponent. Every game is
+    # stored twice, once from each player's point of view.
+    player = models.ForeignKey(Player, related_name='matchups', on_delete=models.CASCADE)
+    opponent = models.ForeignKey(Player, related_name='opponent_matchups', on_delete=models.CASCADE)
+    wins = models.IntegerField(default=0)
+    losses = models.IntegerField(default=0)
+    draws = models.IntegerField(default=0)
+    last_played = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ('player', 'opponent')
+
+    def __str__(self):
+        return "%s vs. %s" % (self.player,
+                              self.opponent)
+
+
+class RatingPoint(models.Model):
+    # A player's singles rating after each game they played, so their
+    # rating history can be read without going through both game slots.
+    player = models.ForeignKey(Player, related_name='rating_points', on_delete=models.CASCADE)
+    game = models.ForeignKey(SinglesGame, related_name='rating_points', on_delete=models.CASCADE)
+    date = models.DateTimeField()
+    rating = models.IntegerField()
+
+    class Meta:
+        index_together = [
+            ('player', 'date'),
+        ]
+
+    def __str__(self):
+        return "%s: %d" % (self.player, self.rating)
@@ -0,0 +1,113 @@
+"""
+Per-player singles rating history, stored as one RatingPoint per player per
+game and served downsampled for charting.
+"""
+from django.db import connections, router
+
+from .models import RatingPoint, SinglesGame
+
+# Game ids per statement, well under SQLite's limit on query parameters
+REFRESH_BATCH = 400
+
+
+def record_game(game):
+    """Adds the rating points of a freshly saved singles game."""
+    RatingPoint.objects.bulk_create([
+        RatingPoint(player_id=game.player1_id, game=game, date=game.date,
+                    rating=game.player1_end_rating),
+        RatingPoint(player_id=game.player2_id, game=game, date=game.date,
+                    rating=game.player2_end_rating),
+    ])
+
+
+def backfill(after_id=None):
+    """
+    Adds rating points for every singles game with an id above `after_id`
+    (all games if None), in a single INSERT ... SELECT. Returns the number
+    of points added.
+    """
+    if after_id is None:
+        return _insert_points('', [])
+    return _insert_points(' WHERE id > %s', [after_id])
+
+
+def refresh(game_ids):
+    """
+    Rewrites the rating points of the singles games with `game_ids`, after
+    their ratings or dates were corrected.
+    """
+    game_ids = sorted(game_ids)
+    for start in range(0, len(game_ids), REFRESH_BATCH):
+        batch = game_ids[start:start + REFRESH_BATCH]
+        RatingPoint.objects.filter(game__in=batch).delete()
+        _insert_points(' WHERE id IN (%s)' % ', '.join(['%s'] * len(batch)), batch)
+
+
+def _insert_points(where, params):
+    connection = connections[router.db_for_write(RatingPoint)]
+    qn = connection.ops.quote_name
+    games = qn(SinglesGame._meta.db_table)
+    selects = [
+        'SELECT %s_id, id, date, %s_end_rating FROM %s%s' % (slot, slot, games, where)
+        for slot in ('player1', 'player2')
+    ]
+    sql = 'INSERT INTO %s (player_id, game_id, date, rating) %s' % (
+        qn(RatingPoint._meta.db_table), ' UNION ALL '.join(selects))
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params * 2)
+        return cursor.rowcount
+
+
+def rating_series(player, threshold):
+    """
+    Returns the player's rating history as [timestamp in ms, rating] pairs,
+    downsampled to at most `threshold` points.
+    """
+    points = [
+        [_timestamp(date), rating]
+        for date, rating in RatingPoint.objects
+        .filter(player=player)
+        .order_by('date', 'game')
+        .values_list('date', 'rating')
+    ]
+    return largest_triangle_three_buckets(points, threshold)
+
+
+def largest_triangle_three_buckets(points, threshold):
+    """
+    Downsamples a series of [x, y] points with Largest-Triangle-Three-Buckets.
+    The first and last points are kept and every bucket in between keeps
+    the point making the biggest triangle with its neighbours, which
+    preserves peaks and troughs far better than taking every nth point.
+    """
+    if threshold >= len(points) or threshold < 3:
+        return points
+
+    sampled = [points[0]]
+    bucket_size = (len(points) - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        # Average of the next bucket, the third corner of the triangle
+        next_start = int((i + 1) * bucket_size) + 1
+        next_end = min(int((i + 2) * bucket_size) + 1, len(points))
+        next_bucket = points[next_start:next_end]
+        avg_x = sum(point[0] for point in next_bucket) / len(next_bucket)
+        avg_y = sum(point[1] for point in next_bucket) / len(next_bucket)
+
+        ax, ay = points[a]
+        max_area = -1
+        for j in range(int(i * bucket_size) + 1, next_start):
+            x, y = points[j]
+            area = abs((ax - avg_x) * (y - ay) - (ax - x) * (avg_y - ay))
+            if area > max_area:
+                max_area = area
+                chosen = j
+        sampled.append(points[chosen])
+        a = chosen
+
+    sampled.append(points[-1])
+    return sampled
+
+
+def _timestamp(date):
+    return int(date.timestamp() * 1000)
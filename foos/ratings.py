@@ -0,0 +1,646 @@
+"""
+Rating engines.
+
+Every way of rating players is an engine. FOOS_RATING_ENGINE picks the one
+games are rated with, and FOOS_RATING_ENGINE_OPTIONS passes it parameters:
+
+* 'elo' (the default) - Elo with K-factor tiers. Teams have a rating of
+  their own.
+* 'glicko2' - Glicko-2, which also tracks how certain each rating is.
+* 'gaussian' - a TrueSkill-style model of every player's skill as a normal
+  distribution.
+
+Under glicko2 and gaussian a doubles game rates the four players' doubles
+skills, and a team's rating is derived from its players'. Their extra
+state is kept in Player.rating_state. Switching engines means running
+replay_ratings afterwards.
+
+Besides rating one game at a time, every engine can rate many games at
+once on NumPy arrays, which is how rate_history gets through the full
+history in seconds. Elo and gaussian rate it in rounds of games that share
+no players, which comes out the same as rating game by game. Glicko-2 is
+defined over rating periods, so a history rated by day won't match the
+game-by-game ratings exactly.
+
+Elo alone runs without NumPy.
+"""
+import datetime
+import json
+import math
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import Q
+
+from .models import DoublesGame, Player, SinglesGame, Team
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+GLICKO2_SCALE = 173.7178
+CENTER = 1000
+
+
+class RatingEngine(object):
+    name = None
+    # Whether players have a state beyond their rating to store
+    keeps_state = True
+    # Whether doubles are rated on the players' skills. If not, teams are
+    # rated like players.
+    team_skills = False
+    # Whether whole histories are rated in rating periods of a set length.
+    # If not, they are rated game by game, as games are when recorded.
+    rates_periods = False
+
+    def initial_state(self):
+        raise NotImplementedError
+
+    def state_from_rating(self, rating):
+        """The state of a participant only known by their stored rating."""
+        raise NotImplementedError
+
+    def rating(self, state):
+        """The rating shown for a state."""
+        return int(round(state[0]))
+
+    def ratings(self, states):
+        """The ratings shown for an array of states."""
+        return np.rint(states[:, 0]).astype(int)
+
+    def team_rating(self, states):
+        """The rating shown for a team made of players in these states."""
+        return int(round(sum(self.rating(state) for state in states) / len(states)))
+
+    def rate(self, side1, side2, score1, score2):
+        """
+        Rates one game. Each side is a list of its members' states; returns
+        the members' new states in the same shape.
+        """
+        _require_numpy(self)
+        states = np.array(list(side1) + list(side2), dtype=float)
+        size = len(side1)
+        new = self.rate_period(states, np.arange(size)[None, :],
+                               np.arange(size, len(states))[None, :],
+                               np.array([result(score1, score2)]))
+        new = [tuple(float(value) for value in state) for state in new]
+        return new[:size], new[size:]
+
+    def expected(self, states, side1, side2):
+        """
+        Each side1's chance of beating side2. `states` is an (n, k) array
+        and the sides are (games, members) arrays of indexes into it.
+        """
+        raise NotImplementedError
+
+    def win_probability(self, state, opponent_state):
+        """One participant's chance of beating another in singles."""
+        _require_numpy(self)
+        states = np.array([state, opponent_state], dtype=float)
+        return float(self.expected(states, np.array([[0]]), np.array([[1]]))[0])
+
+    def rate_period(self, states, side1, side2, results):
+        """
+        Rates all games of one rating period at once, from the states at its
+        start. `results` are 1 for a side1 win, 0.5 for a draw and 0 for a
+        loss. Returns the new states of everyone in `states`. Engines that
+        don't rate periods are only given games that share no players.
+        """
+        raise NotImplementedError
+
+
+class Elo(RatingEngine):
+    name = 'elo'
+    keeps_state = False
+
+    def __init__(self, k=32, scale=400):
+        self.k = k
+        # Rating difference at which the stronger side is ten times as
+        # likely to win
+        self.scale = scale
+
+    def initial_state(self):
+        return (Player._meta.get_field('rating').default,)
+
+    def state_from_rating(self, rating):
+        return (rating,)
+
+    def rate(self, side1, side2, score1, score2):
+        # Teams are rated like players, so a side is always one state
+        rating1, rating2 = side1[0][0], side2[0][0]
+        return ([(calculate_elo(rating1, rating2, score1, score2, self.k, self.scale),)],
+                [(calculate_elo(rating2, rating1, score2, score1, self.k, self.scale),)])
+
+    def expected(self, states, side1, side2):
+        rating = states[:, 0]
+        return self.expected_scores(rating[side1[:, 0]], rating[side2[:, 0]])
+
+    def win_probability(self, state, opponent_state):
+        return 1 / (1 + math.pow(10, (opponent_state[0] - state[0]) / self.scale))
+
+    def expected_scores(self, rating, opponent_rating):
+        """The expected scores of calculate_elo, on arrays of any shape."""
+        return 1 / (1 + 10 ** ((opponent_rating - rating) / self.scale))
+
+    def new_ratings(self, rating, opponent_rating, results, expected=None):
+        """calculate_elo on arrays of any shape, optionally with the expected scores."""
+        if expected is None:
+            expected = self.expected_scores(rating, opponent_rating)
+        return np.rint(rating + self._k(rating) * (results - expected))
+
+    def rate_period(self, states, side1, side2, results):
+        rating = states[:, 0]
+        expected = self.expected(states, side1, side2)
+        change = np.zeros(len(rating))
+        for members, score in ((side1[:, 0], results - expected),
+                               (side2[:, 0], expected - results)):
+            np.add.at(change, members, self._k(rating[members]) * score)
+        return np.rint(rating + change)[:, None]
+
+    def _k(self, rating):
+        # The same tiers as calculate_elo
+        return self.k * np.where(rating > 2400, 0.5,
+                                 np.where((rating > 2100) & (rating < 2400), 0.75, 1))
+
+
+class Glicko2(RatingEngine):
+    """
+    Glicko-2, on the usual scale but centred on 1000. A state is (mu, phi,
+    sigma) on the Glicko-2 scale. In doubles each player is rated against
+    the other team as one composite opponent.
+    """
+    name = 'glicko2'
+    team_skills = True
+    rates_periods = True
+
+    def __init__(self, tau=0.5, deviation=350, volatility=0.06):
+        self.tau = tau
+        self.deviation = deviation
+        self.volatility = volatility
+
+    def initial_state(self):
+        return self.state_from_rating(CENTER)
+
+    def state_from_rating(self, rating):
+        return ((rating - CENTER) / GLICKO2_SCALE, self.deviation / GLICKO2_SCALE,
+                self.volatility)
+
+    def rating(self, state):
+        return int(round(state[0] * GLICKO2_SCALE + CENTER))
+
+    def ratings(self, states):
+        return np.rint(states[:, 0] * GLICKO2_SCALE + CENTER).astype(int)
+
+    def expected(self, states, side1, side2):
+        mu1, phi1 = _composite(states, side1)
+        mu2, phi2 = _composite(states, side2)
+        return 1 / (1 + np.exp(-_g(np.sqrt(phi1 ** 2 + phi2 ** 2)) * (mu1 - mu2)))
+
+    def rate_period(self, states, side1, side2, results):
+        mu, phi, sigma = states[:, 0], states[:, 1], states[:, 2]
+        players, opponent_mu, opponent_phi, scores = [], [], [], []
+        for side, opponents, score in ((side1, side2, results), (side2, side1, 1 - results)):
+            composite_mu, composite_phi = _composite(states, opponents)
+            for members in side.T:
+                players.append(members)
+                opponent_mu.append(composite_mu)
+                opponent_phi.append(composite_phi)
+                scores.append(score)
+        players = np.concatenate(players)
+        g = _g(np.concatenate(opponent_phi))
+        expected = 1 / (1 + np.exp(-g * (mu[players] - np.concatenate(opponent_mu))))
+
+        information = np.zeros(len(mu))
+        np.add.at(information, players, g ** 2 * expected * (1 - expected))
+        improvement = np.zeros(len(mu))
+        np.add.at(improvement, players, g * (np.concatenate(scores) - expected))
+
+        # Anyone who didn't play only grows less certain
+        new_phi = np.sqrt(phi ** 2 + sigma ** 2)
+        new_mu = mu.copy()
+        new_sigma = sigma.copy()
+        played = information > 0
+        v = 1 / information[played]
+        new_sigma[played] = self._volatility(
+            phi[played], sigma[played], v, v * improvement[played])
+        phi_star = np.sqrt(phi[played] ** 2 + new_sigma[played] ** 2)
+        new_phi[played] = 1 / np.sqrt(1 / phi_star ** 2 + 1 / v)
+        new_mu[played] = mu[played] + new_phi[played] ** 2 * improvement[played]
+        return np.column_stack([new_mu, new_phi, new_sigma])
+
+    def _volatility(self, phi, sigma, v, delta, tolerance=1e-6):
+        # The Illinois algorithm of step 5 in Glickman's paper, run for
+        # every player at once
+        tau = self.tau
+        a = np.log(sigma ** 2)
+
+        def f(x):
+            ex = np.exp(x)
+            return (ex * (delta ** 2 - phi ** 2 - v - ex) / (2 * (phi ** 2 + v + ex) ** 2) -
+                    (x - a) / tau ** 2)
+
+        gap = delta ** 2 - phi ** 2 - v
+        upper = np.log(np.where(gap > 0, gap, 1))
+        low = gap <= 0
+        upper[low] = a[low] - tau
+        while True:
+            below = low & (f(upper) < 0)
+            if not below.any():
+                break
+            upper[below] -= tau
+
+        lower = a.copy()
+        f_lower, f_upper = f(lower), f(upper)
+        for _ in range(100):
+            active = np.abs(upper - lower) > tolerance
+            if not active.any():
+                break
+            # Players already done may divide by zero; their values are dropped
+            with np.errstate(divide='ignore', invalid='ignore'):
+                middle = lower + (lower - upper) * f_lower / (f_upper - f_lower)
+                f_middle = f(middle)
+            swap = active & (f_middle * f_upper <= 0)
+            keep = active & ~swap
+            lower = np.where(swap, upper, lower)
+            f_lower = np.where(swap, f_upper, np.where(keep, f_lower / 2, f_lower))
+            upper = np.where(active, middle, upper)
+            f_upper = np.where(active, f_middle, f_upper)
+        return np.exp(lower / 2)
+
+
+class Gaussian(RatingEngine):
+    """
+    A TrueSkill-style model. A state is the (mean, standard deviation) of a
+    player's skill in rating points; a team's skill is the sum of its
+    players'. Ratings show the mean.
+    """
+    name = 'gaussian'
+    team_skills = True
+
+    def __init__(self, sigma=250, beta=125, tau=2.5, draw_margin=10):
+        self.sigma = sigma
+        self.beta = beta
+        self.tau = tau
+        self.draw_margin = draw_margin
+
+    def initial_state(self):
+        return (float(CENTER), float(self.sigma))
+
+    def state_from_rating(self, rating):
+        return (float(rating), float(self.sigma))
+
+    def _teams(self, mean, variance, side1, side2):
+        players = side1.shape[1] + side2.shape[1]
+        c = np.sqrt(variance[side1].sum(1) + variance[side2].sum(1) + players * self.beta ** 2)
+        return (mean[side1].sum(1) - mean[side2].sum(1)) / c, c
+
+    def expected(self, states, side1, side2):
+        t, _ = self._teams(states[:, 0], states[:, 1] ** 2, side1, side2)
+        return _cdf(t)
+
+    def rate_period(self, states, side1, side2, results):
+        mean = states[:, 0].copy()
+        variance = states[:, 1] ** 2
+        for side in (side1, side2):
+            for members in side.T:
+                variance[members] += self.tau ** 2
+
+        t, c = self._teams(mean, variance, side1, side2)
+        margin = self.draw_margin / c
+        # v moves the means and w shrinks the variances, from side1's view
+        sign = np.where(results < 0.5, -1.0, 1.0)
+        win_t = sign * t - margin
+        v = _pdf(win_t) / np.maximum(_cdf(win_t), 1e-300)
+        w = v * (v + win_t)
+        v = sign * v
+        draws = results == 0.5
+        if draws.any():
+            t_draw, margin_draw = t[draws], margin[draws]
+            low, high = -margin_draw - t_draw, margin_draw - t_draw
+            mass = np.maximum(_cdf(high) - _cdf(low), 1e-300)
+            v[draws] = (_pdf(low) - _pdf(high)) / mass
+            w[draws] = v[draws] ** 2 + (high * _pdf(high) - low * _pdf(low)) / mass
+
+        # Nobody plays twice, so every player is updated once
+        new_variance = variance.copy()
+        for side, direction in ((side1, 1), (side2, -1)):
+            for members in side.T:
+                mean[members] += direction * variance[members] / c * v
+                new_variance[members] *= np.maximum(1 - variance[members] / c ** 2 * w, 1e-4)
+        return np.column_stack([mean, np.sqrt(new_variance)])
+
+
+ENGINES = {
+    'elo': Elo,
+    'glicko2': Glicko2,
+    'gaussian': Gaussian,
+}
+
+
+def get_engine(name=None, **options):
+    """Returns the engine called `name`, or the configured one."""
+    if name is None:
+        name = getattr(settings, 'FOOS_RATING_ENGINE', 'elo')
+        options = dict(getattr(settings, 'FOOS_RATING_ENGINE_OPTIONS', {}), **options)
+    try:
+        engine = ENGINES[name](**options)
+    except KeyError:
+        raise ImproperlyConfigured('Unknown rating engine %r' % name)
+    _require_numpy(engine)
+    return engine
+
+
+def calculate_elo(player_rating, opponent_rating, player_score, opponent_score, k=32,
+                  scale=400):
+    # sa = actual score
+    # ea = expected score
+    sa = result(player_score, opponent_score)
+    ea = 1 / (1 + math.pow(10, ((opponent_rating - player_rating) / scale)))
+
+    # k = "k-factor"
+    if player_rating > 2100 and player_rating < 2400:
+        k = k * 0.75
+    if player_rating > 2400:
+        k = k * 0.5
+
+    new_rating = player_rating + k * (sa - ea)
+    return round(new_rating)
+
+
+def result(score, opponent_score):
+    if score > opponent_score:
+        return 1
+    if score < opponent_score:
+        return 0
+    return 0.5
+
+
+# Stored state
+
+def singles_state(engine, player):
+    return _stored_state(engine, player, 'singles') or engine.state_from_rating(player.rating)
+
+
+def doubles_state(engine, player):
+    return _stored_state(engine, player, 'doubles') or engine.initial_state()
+
+
+def set_states(engine, player, singles=None, doubles=None):
+    """Stores new states on a player in memory, and its new singles rating."""
+    if singles is not None:
+        player.rating = engine.rating(singles)
+    if not engine.keeps_state:
+        return
+    player.rating_state = json.dumps({
+        'engine': engine.name,
+        'singles': singles or singles_state(engine, player),
+        'doubles': doubles or doubles_state(engine, player),
+    })
+
+
+def _stored_state(engine, player, kind):
+    if not player.rating_state:
+        return None
+    stored = json.loads(player.rating_state)
+    if stored.get('engine') != engine.name:
+        return None
+    return tuple(stored[kind])
+
+
+def rate_singles(engine, player1, player2, score1, score2):
+    """Rates a singles game and updates both players in memory."""
+    (new1,), (new2,) = engine.rate([singles_state(engine, player1)],
+                                   [singles_state(engine, player2)], score1, score2)
+    set_states(engine, player1, singles=new1)
+    set_states(engine, player2, singles=new2)
+    return player1.rating, player2.rating
+
+
+def rate_doubles(engine, team1, team2, score1, score2):
+    """
+    Rates a doubles game and updates the teams in memory, along with their
+    players if the engine rates players' skills. Returns the teams' ratings
+    before and after as (start1, start2, end1, end2).
+    """
+    if not engine.team_skills:
+        start1, start2 = team1.rating, team2.rating
+        (new1,), (new2,) = engine.rate([engine.state_from_rating(start1)],
+                                       [engine.state_from_rating(start2)], score1, score2)
+        team1.rating = engine.rating(new1)
+        team2.rating = engine.rating(new2)
+        return start1, start2, team1.rating, team2.rating
+
+    members = [[team.player1, team.player2] for team in (team1, team2)]
+    sides = [[doubles_state(engine, player) for player in side] for side in members]
+    starts = [engine.team_rating(side) for side in sides]
+    for side, states in zip(members, engine.rate(sides[0], sides[1], score1, score2)):
+        for player, state in zip(side, states):
+            set_states(engine, player, doubles=state)
+    for team in (team1, team2):
+        team.rating = engine.team_rating([doubles_state(engine, team.player1),
+                                          doubles_state(engine, team.player2)])
+    return starts[0], starts[1], team1.rating, team2.rating
+
+
+def team_ratings(engine, players):
+    """
+    Ratings of every team with one of `players` (keyed by id), derived from
+    its players' doubles skills. Only for engines that rate players' skills.
+    Partners not in `players` are read from the database.
+    """
+    teams = list(Team.objects
+                 .filter(Q(player1__in=list(players)) | Q(player2__in=list(players)))
+                 .values_list('id', 'player1', 'player2'))
+    partners = set(player_id for team in teams for player_id in team[1:]) - set(players)
+    members = dict(players)
+    members.update((player.id, player) for player in Player.objects.filter(id__in=partners))
+    return {
+        team_id: engine.team_rating([doubles_state(engine, members[player1_id]),
+                                     doubles_state(engine, members[player2_id])])
+        for team_id, player1_id, player2_id in teams
+    }
+
+
+# Whole histories
+
+class GameArrays(object):
+    """
+    A game history as arrays of indexes into the players (and teams), ready
+    to be rated by any engine with the same team_skills. Each of singles and
+    doubles is (dates, side1, side2, results, rounds).
+    """
+
+    def __init__(self, player_ids, team_rows, singles, doubles, team_skills):
+        self.player_ids = player_ids
+        self.team_rows = team_rows
+        self.singles = singles
+        self.doubles = doubles
+        self.team_skills = team_skills
+
+    @property
+    def doubles_participants(self):
+        return len(self.player_ids) if self.team_skills else len(self.team_rows)
+
+
+def load_games(team_skills, until=None):
+    """Loads every game before `until` (all games if None) into GameArrays."""
+    _require_numpy()
+    player_ids = list(Player.objects.order_by('id').values_list('id', flat=True))
+    team_rows = list(Team.objects.order_by('id').values_list('id', 'player1', 'player2'))
+    player_index = {player_id: i for i, player_id in enumerate(player_ids)}
+    team_index = {row[0]: i for i, row in enumerate(team_rows)}
+
+    singles = SinglesGame.objects.all()
+    doubles = DoublesGame.objects.all()
+    if until is not None:
+        singles = singles.filter(date__lt=until)
+        doubles = doubles.filter(date__lt=until)
+
+    games = singles.order_by('date', 'id').values_list(
+        'date', 'player1', 'player2', 'player1_score', 'player2_score')
+    singles = _game_arrays(
+        games, lambda game: ([player_index[game[1]]], [player_index[game[2]]]))
+
+    if team_skills:
+        games = doubles.order_by('date', 'id').values_list(
+            'date', 'team1__player1', 'team1__player2', 'team2__player1', 'team2__player2',
+            'team1_score', 'team2_score')
+        doubles = _game_arrays(
+            games, lambda game: ([player_index[game[1]], player_index[game[2]]],
+                                 [player_index[game[3]], player_index[game[4]]]))
+    else:
+        games = doubles.order_by('date', 'id').values_list(
+            'date', 'team1', 'team2', 'team1_score', 'team2_score')
+        doubles = _game_arrays(
+            games, lambda game: ([team_index[game[1]]], [team_index[game[2]]]))
+    return GameArrays(player_ids, team_rows, singles, doubles, team_skills)
+
+
+class History(object):
+    """Ratings from rating a whole history, with the prediction made before each game."""
+
+    def __init__(self, players, teams, singles, doubles):
+        self.players = players
+        self.teams = teams
+        # (expected, result) arrays, in game order
+        self.singles = singles
+        self.doubles = doubles
+
+
+def rate_history(engine, period=datetime.timedelta(days=1), until=None, games=None):
+    """
+    Rates every game before `until` (all games if None) with `engine`,
+    starting from scratch, one rating `period` at a time if the engine
+    rates periods. Nothing is saved. Already loaded `games` are rated
+    instead, if given.
+    """
+    _require_numpy()
+    if games is None:
+        games = load_games(engine.team_skills, until)
+
+    states, singles_expected = _rate_games(
+        engine, _initial_states(engine, len(games.player_ids)), games.singles, period)
+    players = dict(zip(games.player_ids, engine.ratings(states).tolist()))
+
+    states, doubles_expected = _rate_games(
+        engine, _initial_states(engine, games.doubles_participants), games.doubles, period)
+    if engine.team_skills:
+        ratings = engine.ratings(states)
+        player_index = {player_id: i for i, player_id in enumerate(games.player_ids)}
+        teams = {team_id: int(round((ratings[player_index[player1_id]] +
+                                     ratings[player_index[player2_id]]) / 2))
+                 for team_id, player1_id, player2_id in games.team_rows}
+    else:
+        teams = dict(zip([row[0] for row in games.team_rows],
+                         engine.ratings(states).tolist()))
+
+    return History(players, teams, (singles_expected, games.singles[3]),
+                   (doubles_expected, games.doubles[3]))
+
+
+def _game_arrays(games, sides):
+    dates, side1, side2, results = [], [], [], []
+    for game in games:
+        dates.append(game[0].timestamp())
+        members1, members2 = sides(game)
+        side1.append(members1)
+        side2.append(members2)
+        results.append(result(game[-2], game[-1]))
+    members = len(side1[0]) if side1 else 1
+    side1 = np.array(side1, dtype=np.int32).reshape(-1, members)
+    side2 = np.array(side2, dtype=np.int32).reshape(-1, members)
+    return (np.array(dates), side1, side2, np.array(results, dtype=float),
+            _rounds(side1, side2))
+
+
+def _rounds(side1, side2):
+    # Puts every game in the round after its participants' last games, so
+    # nobody plays twice in a round and a round can be rated at once with
+    # the same outcome as rating its games one by one
+    last = {}
+    rounds = np.empty(len(side1), dtype=np.int32)
+    for i, members in enumerate(np.hstack([side1, side2]).tolist()):
+        rounds[i] = max(last.get(member, -1) for member in members) + 1
+        for member in members:
+            last[member] = rounds[i]
+    return rounds
+
+
+def _initial_states(engine, count):
+    return np.tile(np.array(engine.initial_state(), dtype=float), (count, 1))
+
+
+def _rate_games(engine, states, games, period):
+    dates, side1, side2, results, rounds = games
+    expected = np.empty(len(results))
+    if not len(results):
+        return states, expected
+    if engine.rates_periods:
+        order = None
+        batches = ((dates - dates[0]) // period.total_seconds()).astype(int)
+    else:
+        # Sorted by round once, so each round is a slice
+        order = np.argsort(rounds, kind='stable')
+        side1, side2, results, batches = side1[order], side2[order], results[order], rounds[order]
+    bounds = np.concatenate([[0], np.flatnonzero(np.diff(batches)) + 1, [len(results)]])
+    for start, end in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+        expected[start:end] = engine.expected(states, side1[start:end], side2[start:end])
+        states = engine.rate_period(states, side1[start:end], side2[start:end],
+                                    results[start:end])
+    if order is not None:
+        expected[order] = expected.copy()
+    return states, expected
+
+
+# Helpers
+
+def _require_numpy(engine=None):
+    # Elo rates single games without it
+    if np is None and (engine is None or engine.name != 'elo'):
+        raise ImproperlyConfigured('%s needs NumPy.' % (
+            'The %s rating engine' % engine.name if engine else 'Rating whole histories'))
+
+
+def _g(phi):
+    return 1 / np.sqrt(1 + 3 * phi ** 2 / math.pi ** 2)
+
+
+def _composite(states, side):
+    # A team faced as one opponent: its average rating and deviation
+    return states[side, 0].mean(1), np.sqrt((states[side, 1] ** 2).mean(1))
+
+
+def _pdf(x):
+    return np.exp(-x ** 2 / 2) / math.sqrt(2 * math.pi)
+
+
+def _cdf(x):
+    return 0.5 * _erfc(-x / math.sqrt(2))
+
+
+def _erfc(x):
+    # NumPy has no erf of its own. The standard library's, called element
+    # by element, is exact and quicker on the small batches games are
+    # rated in than any polynomial approximation.
+    return np.frompyfunc(math.erfc, 1, 1)(x).astype(float)
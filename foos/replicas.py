@@ -0,0 +1,116 @@
+"""
+Read replicas for the leaderboard.
+
+Page views far outnumber recorded games, so reads of foos data can be
+spread over the read-only copies listed in FOOS_READ_REPLICAS (aliases in
+DATABASES), while every write goes to the primary, `default`.
+
+Replicas lag behind the primary, so reads only go to them from GET and
+HEAD requests. A request that records something reads from the primary
+for the rest of its run, and the browser is then pinned to the primary
+for FOOS_PRIMARY_STICKY_SECONDS with a cookie, so whoever entered a game
+sees it on the next page. Everything outside a request, such as
+management commands, reads from the primary too.
+
+Both ReplicaRouter and ReplicaMiddleware have to be installed. With no
+replicas configured they send everything to the primary.
+"""
+import os
+import random
+import sqlite3
+import threading
+
+from django.conf import settings
+
+PIN_COOKIE = 'foos_primary'
+
+_state = threading.local()
+
+
+def _replicas():
+    return getattr(settings, 'FOOS_READ_REPLICAS', [])
+
+
+class ReplicaRouter(object):
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label != 'foos' or not getattr(_state, 'use_replicas', False):
+            return None
+        replicas = _replicas()
+        if not replicas:
+            return None
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        if model._meta.app_label != 'foos':
+            return None
+        # Read our own writes from here on
+        _state.use_replicas = False
+        _state.wrote = True
+        # Not None, or an object read from a replica would be saved back to it
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = set(['default'] + list(_replicas()))
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+
+class ReplicaMiddleware(object):
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        use_replicas = (request.method in ('GET', 'HEAD') and
+                        PIN_COOKIE not in request.COOKIES)
+        _state.use_replicas = use_replicas
+        _state.wrote = False
+        try:
+            response = self.get_response(request)
+        finally:
+            wrote = _state.wrote
+            _state.use_replicas = False
+            _state.wrote = False
+
+        if wrote and _replicas():
+            response.set_cookie(PIN_COOKIE, '1', httponly=True,
+                                max_age=getattr(settings, 'FOOS_PRIMARY_STICKY_SECONDS', 15))
+        elif use_replicas and response.streaming:
+            # Streamed content is read after the request has returned, and
+            # possibly from another thread
+            response.streaming_content = _on_replicas(response.streaming_content)
+        return response
+
+
+def _on_replicas(content):
+    content = iter(content)
+    while True:
+        _state.use_replicas = True
+        try:
+            chunk = next(content, None)
+        finally:
+            _state.use_replicas = False
+        if chunk is None:
+            return
+        yield chunk
+
+
+def copy_sqlite_database(source, target):
+    """
+    Replaces the SQLite database `target` with a consistent copy of
+    `source`, including anything still in its write-ahead log. Neither
+    readers nor writers of `source` wait. Connections already open to
+    `target` keep reading the old copy.
+    """
+    temporary = target + '.copy'
+    if os.path.exists(temporary):
+        os.remove(temporary)
+    connection = sqlite3.connect(source, isolation_level=None)
+    try:
+        # Needs SQLite 3.27
+        connection.execute('VACUUM INTO ?', (temporary,))
+    finally:
+        connection.close()
+    os.replace(temporary, target)
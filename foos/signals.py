@@ -0,0 +1,37 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .leaderboard_cache import bump_game_rows_version, bump_ratings_version
+from .models import Player
+
+
+@receiver(post_save, sender=Player)
+@receiver(post_delete, sender=Player)
+def player_changed(sender, instance, created=False, **kwargs):
+    # A new player isn't shown anywhere yet. A renamed or deleted one is
+    # in cached rankings and game rows.
+    if not created:
+        transaction.on_commit(bump_ratings_version)
+        transaction.on_commit(bump_game_rows_version)
+
+
+@receiver(connection_created)
+def tune_sqlite(sender, connection, **kwargs):
+    """Applies FOOS_SQLITE_PRAGMAS to every new SQLite connection."""
+    pragmas = getattr(settings, 'FOOS_SQLITE_PRAGMAS', {})
+    if connection.vendor != 'sqlite' or not pragmas:
+        return
+    if connection.alias in getattr(settings, 'FOOS_READ_REPLICAS', []):
+        # sync_replicas swaps replica files wholesale, which would strand
+        # a write-ahead log next to the new file
+        pragmas = {name: value for name, value in pragmas.items()
+                   if name != 'journal_mode'}
+    cursor = connection.connection.cursor()
+    try:
+        for name, value in pragmas.items():
+            cursor.execute('PRAGMA %s = %s' % (name, value))
+    finally:
+        cursor.close()
@@ -0,0 +1,189 @@
+"""
+Monte Carlo simulation of tournaments, for publishing everyone's odds.
+
+Entrants are players or teams, starting from their current ratings. Each
+match goes to the favourite with the Elo expected score as its chance,
+and both entrants' ratings then change as calculate_elo would change
+them, so an entrant on a run is more of a favourite in the next round.
+
+Trials are simulated side by side: ratings are a (trials, entrants) array
+and a round is a handful of array operations whatever the number of
+trials. Large runs are split into batches of BATCH trials, which can be
+spread over several processes.
+"""
+import multiprocessing
+
+from django.core.exceptions import ImproperlyConfigured
+
+from . import ratings
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+BATCH = 100000
+
+
+def elo_engine():
+    """The Elo engine games are rated with, or a default one under other engines."""
+    engine = ratings.get_engine()
+    return engine if engine.name == 'elo' else ratings.Elo()
+
+
+def load_entrants(model, ids):
+    """The Player or Team objects with `ids`, in the same order."""
+    entrants = model.objects.in_bulk(ids)
+    missing = [entrant_id for entrant_id in ids if entrant_id not in entrants]
+    if missing:
+        raise model.DoesNotExist('No %s with id %s' % (
+            model._meta.verbose_name, ', '.join(map(str, missing))))
+    return [entrants[entrant_id] for entrant_id in ids]
+
+
+def seeded_order(entrants):
+    """
+    Bracket positions for `entrants` entrants given best seed first: the
+    top seed meets the lowest, and the top two can only meet in the final.
+    Missing seeds are byes (None), which go to the top seeds.
+    """
+    order = [0]
+    while len(order) < entrants:
+        size = len(order) * 2
+        order = [seed for top in order for seed in (top, size - 1 - top)]
+    return [seed if seed < entrants else None for seed in order]
+
+
+def round_names(entrants):
+    """Names of the rounds of a bracket of `entrants`, and of winning it."""
+    rounds = _rounds(entrants)
+    names = []
+    for remaining in (2 ** (rounds - i) for i in range(rounds)):
+        names.append({2: 'Final', 4: 'Semifinals', 8: 'Quarterfinals'}.get(
+            remaining, 'Round of %d' % remaining))
+    return names + ['Winner']
+
+
+def simulate_bracket(bracket, trials, engine=None, processes=1, seed=None):
+    """
+    Simulates a single elimination bracket of entrants' ratings `trials`
+    times. The first entrant plays the second, the third the fourth and
+    so on, and winners meet in the same order; None is a bye, and short
+    brackets are filled up with byes at the end. Returns an (entrants,
+    rounds + 1) array of each entrant's chance of reaching each round, the
+    last column being their chance of winning.
+    """
+    entrants = [rating for rating in bracket if rating is not None]
+    size = 2 ** _rounds(len(bracket))
+    # Byes are one entrant past the last
+    order, index = [], 0
+    for rating in list(bracket) + [None] * (size - len(bracket)):
+        if rating is None:
+            order.append(len(entrants))
+        else:
+            order.append(index)
+            index += 1
+    reach, = _run(_bracket_batch, (engine or elo_engine(), entrants, order),
+                  trials, processes, seed)
+    return reach[:, :len(entrants)].T / trials
+
+
+def simulate_round_robin(entrants, trials, legs=1, engine=None, processes=1, seed=None):
+    """
+    Simulates a season of entrants' ratings `trials` times, everyone
+    playing everyone else `legs` times a round at a time. Returns an
+    (entrants, entrants) array of each entrant's chance of finishing in
+    each place, ties on wins being split at random, and their expected
+    number of wins.
+    """
+    places, wins = _run(_round_robin_batch, (engine or elo_engine(), list(entrants), legs),
+                        trials, processes, seed)
+    return places / trials, wins / trials
+
+
+def _run(batch, arguments, trials, processes, seed):
+    if np is None:
+        raise ImproperlyConfigured('Simulating tournaments needs NumPy.')
+    if trials < 1:
+        raise ValueError('Simulating needs at least one trial, not %d.' % trials)
+    sizes = [BATCH] * (trials // BATCH) + ([trials % BATCH] if trials % BATCH else [])
+    jobs = [(arguments, size, batch_seed) for size, batch_seed
+            in zip(sizes, np.random.SeedSequence(seed).spawn(len(sizes)))]
+    if processes > 1 and len(jobs) > 1:
+        with multiprocessing.get_context('fork').Pool(min(processes, len(jobs))) as pool:
+            results = pool.map(batch, jobs)
+    else:
+        results = [batch(job) for job in jobs]
+    return [sum(totals) for totals in zip(*results)]
+
+
+def _bracket_batch(job):
+    (engine, entrants, order), trials, seed = job
+    rng = np.random.default_rng(seed)
+    bye = len(entrants)
+    rating = np.tile(np.array(entrants + [0], dtype=float), (trials, 1))
+    slots = np.tile(np.array(order), (trials, 1))
+    rows = np.arange(trials)[:, None]
+    rounds = _rounds(len(order))
+    reach = np.zeros((rounds + 1, bye + 1))
+    for round_ in range(rounds):
+        reach[round_] = np.bincount(slots.ravel(), minlength=bye + 1)
+        first, second = slots[:, 0::2], slots[:, 1::2]
+        first_rating, second_rating = rating[rows, first], rating[rows, second]
+        expected = engine.expected_scores(first_rating, second_rating)
+        chance = np.where(second == bye, 1.0, np.where(first == bye, 0.0, expected))
+        first_won = rng.random(chance.shape) < chance
+        # Nobody plays twice in a round, so ratings can be set directly
+        played = (first != bye) & (second != bye)
+        result = first_won.astype(float)
+        rating[rows, first] = np.where(played, engine.new_ratings(
+            first_rating, second_rating, result, expected), first_rating)
+        rating[rows, second] = np.where(played, engine.new_ratings(
+            second_rating, first_rating, 1 - result, 1 - expected), second_rating)
+        slots = np.where(first_won, first, second)
+    reach[rounds] = np.bincount(slots.ravel(), minlength=bye + 1)
+    return reach,
+
+
+def _round_robin_batch(job):
+    (engine, entrants, legs), trials, seed = job
+    rng = np.random.default_rng(seed)
+    count = len(entrants)
+    # An entrant's trials side by side, so a round reads whole rows
+    rating = np.repeat(np.array(entrants, dtype=float)[:, None], trials, axis=1)
+    wins = np.zeros((count, trials))
+    for first, second in _schedule(count) * legs:
+        first_rating, second_rating = rating[first], rating[second]
+        expected = engine.expected_scores(first_rating, second_rating)
+        result = (rng.random(expected.shape) < expected).astype(float)
+        rating[first] = engine.new_ratings(first_rating, second_rating, result, expected)
+        rating[second] = engine.new_ratings(second_rating, first_rating, 1 - result,
+                                            1 - expected)
+        wins[first] += result
+        wins[second] += 1 - result
+
+    # Less than a win apart, so the noise only breaks ties
+    standings = np.argsort(-(wins + rng.random(wins.shape) / 2), axis=0)
+    places = np.empty_like(standings)
+    places[standings, np.arange(trials)] = np.arange(count)[:, None]
+    places = np.bincount((np.arange(count)[:, None] * count + places).ravel(),
+                         minlength=count * count).reshape(count, count)
+    return places, wins.sum(1)
+
+
+def _schedule(count):
+    # The circle method: one entrant stays put and the rest rotate around
+    # it, so everyone meets everyone once and nobody plays twice a round
+    circle = list(range(count)) + ([None] if count % 2 else [])
+    rounds = []
+    for _ in range(len(circle) - 1):
+        pairs = [(circle[i], circle[-1 - i]) for i in range(len(circle) // 2)]
+        pairs = [pair for pair in pairs if None not in pair]
+        rounds.append((np.array([pair[0] for pair in pairs]),
+                       np.array([pair[1] for pair in pairs])))
+        circle = [circle[0], circle[-1]] + circle[1:-1]
+    return rounds
+
+
+def _rounds(entrants):
+    return max(1, (entrants - 1).bit_length())
@@ -0,0 +1,110 @@
+"""
+Synthetic players, teams and games for measuring tabletracker at scale.
+
+Every player gets a hidden skill, and who wins a game and by how much
+follow from the skill gap, so ratings spread out the way they do in a real
+office. Games go through the importer, which rates them in date order and
+keeps counters, head-to-head records and rating history consistent.
+"""
+import datetime
+import itertools
+import math
+import random
+
+from django.utils import timezone
+
+from .importer import import_games
+from .models import Player, Team
+
+
+def seed(players, teams, singles, doubles, days=365, random_seed=None, batch_size=500):
+    """
+    Adds `players` players, `teams` teams drawn from them, and `singles`
+    and `doubles` games played over the last `days` days. Returns the
+    importer's summary.
+    """
+    if singles and players < 2:
+        raise ValueError('Singles games need at least 2 players')
+    rng = random.Random(random_seed)
+    first = Player.objects.count()
+    Player.objects.bulk_create([Player(name='Synthetic %d' % (first + i + 1))
+                                for i in range(players)])
+    # Only the new players, in case the database already has some
+    player_ids = list(Player.objects.order_by('-id').values_list('id', flat=True)[:players])
+    skills = {player_id: rng.gauss(1000, 150) for player_id in player_ids}
+
+    pairs = list(itertools.combinations(sorted(player_ids), 2))
+    if teams > len(pairs):
+        raise ValueError('%d players can only make %d teams' % (players, len(pairs)))
+    pairs = rng.sample(pairs, teams)
+    if doubles and not any(not set(team1) & set(team2)
+                           for team1, team2 in itertools.combinations(pairs, 2)):
+        raise ValueError('Doubles games need two teams without a player in common')
+    Team.objects.bulk_create([Team(player1_id=player1_id, player2_id=player2_id)
+                              for player1_id, player2_id in pairs])
+
+    records = generate_games(skills, pairs, singles, doubles, days, rng)
+    return import_games(enumerate(records, 1), batch_size)
+
+
+def generate_games(skills, pairs, singles, doubles, days, rng):
+    """
+    Yields game records in the importer's format. `skills` maps player ids
+    to their hidden skill and `pairs` are the teams doubles are played by.
+    """
+    end = timezone.now()
+    span = datetime.timedelta(days=days).total_seconds()
+    player_ids = list(skills)
+    game_types = ['singles'] * singles + ['doubles'] * doubles
+    rng.shuffle(game_types)
+
+    for game_type in game_types:
+        date = end - datetime.timedelta(seconds=rng.random() * span)
+        if game_type == 'singles':
+            side1, side2 = rng.sample(player_ids, 2)
+            score1, score2 = _scores(skills[side1], skills[side2], rng)
+            yield {
+                'game_type': 'singles',
+                'date': date.isoformat(),
+                'player1': side1,
+                'player2': side2,
+                'player1_score': score1,
+                'player2_score': score2,
+            }
+        else:
+            # Teams can't share a player
+            while True:
+                side1, side2 = rng.sample(pairs, 2)
+                if not set(side1) & set(side2):
+                    break
+            score1, score2 = _scores(sum(skills[i] for i in side1) / 2,
+                                     sum(skills[i] for i in side2) / 2, rng)
+            yield {
+                'game_type': 'doubles',
+                'date': date.isoformat(),
+                'team1player1': side1[0],
+                'team1player2': side1[1],
+                'team2player1': side2[0],
+                'team2player2': side2[1],
+                'team1_score': score1,
+                'team2_score': score2,
+            }
+
+
+def _scores(skill1, skill2, rng):
+    """A plausible final score between sides of the given skills."""
+    if rng.random() < 0.01:
+        # The odd game abandoned level
+        score = rng.randint(0, 9)
+        return score, score
+
+    expected = 1 / (1 + math.pow(10, (skill2 - skill1) / 400))
+    side1_won = rng.random() < expected
+    closeness = 1 - abs(expected - 0.5) * 2
+    if rng.random() < 0.15 * closeness:
+        winner, loser = 11, 9
+    else:
+        # Evenly matched sides lose by less
+        loser = int(round(rng.gauss(2 + 5 * closeness, 2)))
+        winner, loser = 10, max(0, min(loser, 8))
+    return (winner, loser) if side1_won else (loser, winner)
@@ -0,0 +1,50 @@
+"""
+Rendered game table rows, cached by game id.
+
+A recorded game never changes, so each row is rendered once and then
+assembled from the cache with a single get_many. Rows on a player's page
+are cached separately, as they are drawn from that player's side.
+"""
+from django import template
+from django.template.loader import get_template
+from django.utils.safestring import mark_safe
+
+from foos.leaderboard_cache import GAME_ROW_TIMEOUT, game_rows_version, get_cache
+
+register = template.Library()
+
+
+@register.simple_tag
+def singles_game_rows(games, perspective=None):
+    return _game_rows('singles', 'foos/singles_game_row.html', games, perspective)
+
+
+@register.simple_tag
+def doubles_game_rows(games):
+    return _game_rows('doubles', 'foos/doubles_game_row.html', games, None)
+
+
+def _game_rows(kind, template_name, games, perspective):
+    games = list(games)
+    if not games:
+        return ''
+    cache = get_cache()
+    prefix = 'foos:game_row:%s:%s:%s:' % (
+        game_rows_version(), kind, perspective.id if perspective else '')
+    keys = [prefix + str(game.id) for game in games]
+    rows = cache.get_many(keys)
+
+    missing = {}
+    row_template = None
+    for key, game in zip(keys, games):
+        if key not in rows:
+            if row_template is None:
+                row_template = get_template(template_name)
+            rows[key] = missing[key] = row_template.render({
+                'game': game,
+                'perspective': perspective,
+            })
+    if missing:
+        cache.set_many(missing, GAME_ROW_TIMEOUT)
+
+    return mark_safe(''.join(rows[key] for key in keys))
@@ -1,3 +1,1243 @@
-from django.test import TestCase
+import asyncio
+import csv
+import datetime
+import io
+import itertools
+import json
+import random
+import tempfile
+import threading
+from importlib import import_module
+from unittest import mock
 
-# Create your tests here.
+from django.apps import apps as django_apps
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.core.wsgi import get_wsgi_application
+from django.db import connection, router
+from django.db.models import Q
+from django.conf import settings
+from django.http import HttpResponse
+from django.test import (Client, RequestFactory, SimpleTestCase, TestCase,
+                         TransactionTestCase, override_settings)
+from django.urls import reverse
+from django.utils import timezone
+
+from . import (corrections, importer, live, matchmaking, metrics, rating_history, ratings,
+               replicas, signals, simulation, views)
+from .asgi import ASGIHandler
+from .leaderboard_cache import bump_game_rows_version, bump_ratings_version, get_cache
+from .models import DoublesGame, Player, PlayerMatchup, RatingPoint, SinglesGame, Team
+
+
+class GameSubmissionTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('tablet', password='foosball')
+        self.client.force_login(self.user)
+        self.red = Player.objects.create(name='Red')
+        self.blue = Player.objects.create(name='Blue')
+
+    def test_singles_updates_ratings_and_counters(self):
+        self.client.post(reverse('foos:new_game'), {
+            'game_type': 'singles',
+            'player1': self.red.id,
+            'player2': self.blue.id,
+            'player1_score': 10,
+            'player2_score': 4,
+        })
+
+        red = Player.objects.get(id=self.red.id)
+        blue = Player.objects.get(id=self.blue.id)
+        self.assertEqual((red.rating, blue.rating), (1016, 984))
+        self.assertEqual((red.singles_wins, red.singles_losses), (1, 0))
+        self.assertEqual((blue.singles_wins, blue.singles_losses), (0, 1))
+        self.assertEqual(red.singles_games_played, 1)
+        self.assertEqual(blue.singles_games_played, 1)
+
+    def test_singles_records_matchups(self):
+        def post_game(red_score, blue_score):
+            self.client.post(reverse('foos:new_game'), {
+                'game_type': 'singles',
+                'player1': self.red.id,
+                'player2': self.blue.id,
+                'player1_score': red_score,
+                'player2_score': blue_score,
+            })
+
+        post_game(10, 4)
+        game = SinglesGame.objects.get()
+        red = PlayerMatchup.objects.get(player=self.red, opponent=self.blue)
+        blue = PlayerMatchup.objects.get(player=self.blue, opponent=self.red)
+        self.assertEqual((red.wins, red.losses, red.draws, red.last_played),
+                         (1, 0, 0, game.date))
+        self.assertEqual((blue.wins, blue.losses, blue.draws, blue.last_played),
+                         (0, 1, 0, game.date))
+
+        # A later game recorded some other way, by an import say
+        later = game.date + datetime.timedelta(days=1)
+        PlayerMatchup.objects.update(last_played=later)
+        post_game(8, 10)
+        red = PlayerMatchup.objects.get(player=self.red, opponent=self.blue)
+        blue = PlayerMatchup.objects.get(player=self.blue, opponent=self.red)
+        self.assertEqual((red.wins, red.losses, red.last_played), (1, 1, later))
+        self.assertEqual((blue.wins, blue.losses, blue.last_played), (1, 1, later))
+
+    def test_doubles_updates_teams_and_players(self):
+        red2 = Player.objects.create(name='Red 2')
+        blue2 = Player.objects.create(name='Blue 2')
+        self.client.post(reverse('foos:new_game'), {
+            'game_type': 'doubles',
+            'team1player1': self.red.id,
+            'team1player2': red2.id,
+            'team2player1': self.blue.id,
+            'team2player2': blue2.id,
+            'team1_score': 11,
+            'team2_score': 9,
+        })
+
+        game = DoublesGame.objects.get()
+        self.assertEqual((game.team1.rating, game.team2.rating), (1016, 984))
+        self.assertEqual((game.team1.wins, game.team2.losses), (1, 1))
+        for player in Player.objects.all():
+            self.assertEqual(player.doubles_games_played, 1)
+        self.assertEqual(Player.objects.filter(doubles_wins=1).count(), 2)
+        self.assertEqual(Player.objects.filter(doubles_losses=1).count(), 2)
+
+    def test_migration_merges_teams_of_the_same_players(self):
+        merge_duplicate_teams = import_module(
+            'foos.migrations.0014_canonical_teams').merge_duplicate_teams
+        red2 = Player.objects.create(name='Red 2')
+        blue2 = Player.objects.create(name='Blue 2')
+        # Red and Red 2 entered both ways round, from before teams were canonical
+        first = Team.objects.create(player1=red2, player2=self.red, wins=1, games_played=1,
+                                    rating=1016)
+        second = Team.objects.create(player1=self.red, player2=red2, losses=2, games_played=2,
+                                     rating=970)
+        opponents = Team.objects.create(player1=self.blue, player2=blue2, wins=2, losses=1,
+                                        games_played=3)
+        now = timezone.now()
+        for i, (team1, team2) in enumerate([(first, opponents), (opponents, second),
+                                            (second, opponents)]):
+            DoublesGame.objects.create(team1=team1, team2=team2, team1_end_rating=1000 + i,
+                                       team2_end_rating=990 - i,
+                                       date=now - datetime.timedelta(days=3 - i))
+
+        merge_duplicate_teams(django_apps, None)
+
+        team = Team.objects.get(id=first.id)
+        self.assertEqual(Team.objects.filter(Q(player1=self.red) | Q(player2=self.red)).count(), 1)
+        self.assertEqual((team.player1_id, team.player2_id), (self.red.id, red2.id))
+        self.assertEqual((team.wins, team.losses, team.games_played), (1, 2, 3))
+        # The merged team carries on from the last game either half played
+        self.assertEqual(team.rating, 1002)
+        self.assertEqual(DoublesGame.objects.filter(Q(team1=team) | Q(team2=team)).count(), 3)
+        self.assertEqual(Team.objects.get(id=opponents.id).games_played, 3)
+
+    def test_doubles_team_found_either_way_round(self):
+        red2 = Player.objects.create(name='Red 2')
+        blue2 = Player.objects.create(name='Blue 2')
+        for team1player1, team1player2 in ((self.red, red2), (red2, self.red)):
+            self.client.post(reverse('foos:new_game'), {
+                'game_type': 'doubles',
+                'team1player1': team1player1.id,
+                'team1player2': team1player2.id,
+                'team2player1': self.blue.id,
+                'team2player2': blue2.id,
+                'team1_score': 10,
+                'team2_score': 5,
+            })
+
+        self.assertEqual(Team.objects.count(), 2)
+        team = Team.objects.get(player1=self.red)
+        self.assertEqual((team.player2, team.wins), (red2, 2))
+
+
+class SyntheticDataTests(TestCase):
+
+    def test_seeded_games_are_rated_in_order(self):
+        call_command('seed_synthetic', players=6, teams=5, singles=60, doubles=20,
+                     seed=1, stdout=io.StringIO())
+        self.assertEqual(SinglesGame.objects.count(), 60)
+        self.assertEqual(DoublesGame.objects.count(), 20)
+
+        for player in Player.objects.all():
+            rating = 1000
+            for game in views._player_singles_games(player).reverse():
+                if game.player1_id == player.id:
+                    self.assertEqual(game.player1_start_rating, rating)
+                    rating = game.player1_end_rating
+                else:
+                    self.assertEqual(game.player2_start_rating, rating)
+                    rating = game.player2_end_rating
+            self.assertEqual(player.rating, rating)
+
+
+class RatingEngineTests(TestCase):
+
+    def setUp(self):
+        if ratings.np is None:
+            self.skipTest('numpy is not installed')
+
+    def test_elo_rating_period_matches_single_games(self):
+        np = ratings.np
+        engine = ratings.Elo()
+        for rating1, rating2, score1, score2 in ((1000, 1000, 10, 4), (2200, 1900, 3, 10),
+                                                 (2500, 2450, 5, 5)):
+            states = engine.rate_period(
+                np.array([[rating1], [rating2]], dtype=float), np.array([[0]]),
+                np.array([[1]]), np.array([ratings.result(score1, score2)]))
+            self.assertEqual(engine.ratings(states).tolist(), [
+                ratings.calculate_elo(rating1, rating2, score1, score2),
+                ratings.calculate_elo(rating2, rating1, score2, score1)])
+
+    def test_glicko2_matches_published_example(self):
+        # Glickman's worked example, shifted to centre on 1000
+        np = ratings.np
+        engine = ratings.Glicko2(tau=0.5)
+        scale = ratings.GLICKO2_SCALE
+        states = np.array([((rating - 500 - ratings.CENTER) / scale, deviation / scale, 0.06)
+                           for rating, deviation in
+                           ((1500, 200), (1400, 30), (1550, 100), (1700, 300))])
+        states = engine.rate_period(states, np.array([[0], [0], [0]]),
+                                    np.array([[1], [2], [3]]), np.array([1.0, 0.0, 0.0]))
+        self.assertAlmostEqual(states[0, 0] * scale + ratings.CENTER + 500, 1464.05, places=1)
+        self.assertAlmostEqual(states[0, 1] * scale, 151.52, places=1)
+        self.assertAlmostEqual(states[0, 2], 0.05999, places=4)
+
+    @override_settings(FOOS_RATING_ENGINE='gaussian')
+    def test_replay_agrees_with_recorded_games(self):
+        user = User.objects.create_user('tablet')
+        self.client.force_login(user)
+        players = [Player.objects.create(name='Player %d' % i) for i in range(4)]
+        for score in range(6):
+            self.client.post(reverse('foos:new_game'), {
+                'game_type': 'singles',
+                'player1': players[score % 2].id,
+                'player2': players[2 + score % 2].id,
+                'player1_score': 10,
+                'player2_score': score,
+            })
+            self.client.post(reverse('foos:new_game'), {
+                'game_type': 'doubles',
+                'team1player1': players[0].id,
+                'team1player2': players[score % 2 + 1].id,
+                'team2player1': players[3].id,
+                'team2player2': players[2 - score % 2].id,
+                'team1_score': score,
+                'team2_score': 10,
+            })
+        self.assertTrue(Player.objects.exclude(rating_state='').exists())
+
+        out = io.StringIO()
+        call_command('replay_ratings', dry_run=True, stdout=out)
+        self.assertEqual(out.getvalue().count('(0 changed)'), 2)
+        self.assertIn('0 player ratings changed', out.getvalue())
+
+    def test_history_in_rounds_matches_recorded_ratings(self):
+        call_command('seed_synthetic', players=6, teams=5, singles=60, doubles=20,
+                     seed=1, stdout=io.StringIO())
+        history = ratings.rate_history(ratings.Elo())
+        self.assertEqual(history.players, dict(Player.objects.values_list('id', 'rating')))
+        self.assertEqual(history.teams, dict(Team.objects.values_list('id', 'rating')))
+
+    def test_tune_ratings_ranks_parameters(self):
+        call_command('seed_synthetic', players=6, teams=5, singles=60, doubles=20,
+                     seed=1, stdout=io.StringIO())
+        out = io.StringIO()
+        call_command('tune_ratings', 'elo', grid=['k=16,48', 'scale=400'], processes=2,
+                     stdout=out)
+        rows = [line.split() for line in out.getvalue().splitlines()
+                if line.strip()[:1].isdigit()]
+        self.assertEqual([row[1:3] for row in rows if row[0].endswith('*')],
+                         [['k=32', 'scale=400']])
+        losses = [float(row[-4]) for row in rows]
+        self.assertEqual(len(losses), 3)
+        self.assertEqual(losses, sorted(losses))
+
+
+class MatchmakingTests(TestCase):
+
+    def setUp(self):
+        if matchmaking.np is None:
+            self.skipTest('numpy is not installed')
+        self.user = User.objects.create_user('tablet')
+        self.client.force_login(self.user)
+
+    def _players(self, *ratings):
+        return [Player.objects.create(name='Player %d' % i, rating=rating).id
+                for i, rating in enumerate(ratings)]
+
+    def _names(self, team):
+        return sorted(player['name'] for player in team['players'])
+
+    def test_doubles_prefers_existing_team_ratings(self):
+        ids = self._players(1200, 1000, 1000, 800)
+        best = matchmaking.find_games('doubles', ids)[0]
+        self.assertEqual(best['expected'], 0.5)
+        self.assertEqual(sorted([self._names(best['team1']), self._names(best['team2'])]),
+                         [['Player 0', 'Player 3'], ['Player 1', 'Player 2']])
+
+        # Together, 0 and 3 have a record of their own
+        Team.objects.create(player1_id=ids[3], player2_id=ids[0], rating=1100)
+        games = matchmaking.find_games('doubles', ids)
+        self.assertEqual(len(games), 3)
+        self.assertEqual(self._names(games[0]['team1']), ['Player 0', 'Player 3'])
+        self.assertIsNotNone(games[0]['team1']['id'])
+        self.assertEqual(games[0]['team1']['rating'] - games[0]['team2']['rating'], 100)
+
+    def test_pruned_search_matches_every_split(self):
+        rng = random.Random(3)
+        ids = self._players(*[rng.randint(700, 1400) for _ in range(22)])
+        ratings_by_id = dict(Player.objects.values_list('id', 'rating'))
+
+        def rating(pair):
+            return round(sum(ratings_by_id[player_id] for player_id in pair) / 2)
+
+        gaps = []
+        for four in itertools.combinations(ids, 4):
+            for team1 in itertools.combinations(four, 2):
+                if four[0] in team1:
+                    team2 = [player_id for player_id in four if player_id not in team1]
+                    gaps.append(abs(rating(team1) - rating(team2)))
+        games = matchmaking.find_games('doubles', ids, 20)
+        self.assertEqual([game['team1']['rating'] - game['team2']['rating'] for game in games],
+                         sorted(gaps)[:20])
+
+        singles = matchmaking.find_games('singles', ids, 20)
+        self.assertEqual(
+            [game['player1']['rating'] - game['player2']['rating'] for game in singles],
+            sorted(abs(ratings_by_id[a] - ratings_by_id[b])
+                   for a, b in itertools.combinations(ids, 2))[:20])
+
+    def test_api(self):
+        ids = self._players(1000, 1010, 1300)
+        url = reverse('foos:api_matchmaking')
+        response = self.client.get(url, {'game_type': 'singles',
+                                         'players': ','.join(map(str, ids)), 'limit': 1})
+        game, = response.json()['games']
+        self.assertEqual((game['player1']['rating'], game['player2']['rating']), (1010, 1000))
+
+        other = self.client.get(url, {'game_type': 'singles', 'players': ids[:2]})
+        self.assertNotEqual(response['ETag'], other['ETag'])
+        self.assertEqual(self.client.get(url, {'game_type': 'triples'}).status_code, 400)
+
+    def test_page(self):
+        ids = self._players(1000, 1010)
+        response = self.client.get(reverse('foos:matchmaking'),
+                                   {'game_type': 'singles', 'players': ids})
+        self.assertContains(response, 'Player 1 (1010)')
+        response = self.client.get(reverse('foos:matchmaking'), {'players': ids})
+        self.assertContains(response, 'Pick at least 4 players for doubles.')
+
+
+class SimulationTests(TestCase):
+
+    def setUp(self):
+        if simulation.np is None:
+            self.skipTest('numpy is not installed')
+
+    def test_seeded_bracket(self):
+        self.assertEqual(simulation.seeded_order(5), [0, None, 3, 4, 1, None, 2, None])
+        self.assertEqual(simulation.round_names(5), ['Quarterfinals', 'Semifinals', 'Final',
+                                                     'Winner'])
+
+    def test_bracket_follows_elo_expectation(self):
+        chances = simulation.simulate_bracket([1200, 1000, None], 50000, seed=1)
+        self.assertEqual(chances.shape, (2, 3))
+        # The bye only takes the first entrant a round further
+        self.assertEqual(chances[:, 0].tolist(), [1, 1])
+        self.assertAlmostEqual(chances[0, 2], ratings.Elo().expected_scores(1200, 1000),
+                               places=2)
+        self.assertAlmostEqual(chances[:, 2].sum(), 1)
+
+    def test_round_robin(self):
+        places, wins = simulation.simulate_round_robin([1400, 1000, 1000], 20000, legs=2,
+                                                       seed=1)
+        self.assertEqual(places.sum(0).tolist(), [1, 1, 1])
+        self.assertEqual(places.sum(1).tolist(), [1, 1, 1])
+        self.assertAlmostEqual(wins.sum(), 6)
+        self.assertGreater(places[0, 0], 0.7)
+        self.assertAlmostEqual(places[1, 0], places[2, 0], places=1)
+
+    def test_command(self):
+        ids = [Player.objects.create(name='Player %d' % i, rating=1000 + 50 * i).id
+               for i in range(3)]
+        out = io.StringIO()
+        call_command('simulate_tournament', 'bracket', *ids, seeded=True, trials=1000,
+                     seed=1, processes=1, stdout=out)
+        self.assertIn('Semifinals', out.getvalue())
+        self.assertIn('Winner', out.getvalue())
+
+        for options in ({'trials': 0}, {'trials': -5}, {'legs': 0}):
+            with self.assertRaises(CommandError):
+                call_command('simulate_tournament', 'round-robin', *ids, stdout=out,
+                             **options)
+
+
+class CorrectionTests(TestCase):
+
+    def setUp(self):
+        call_command('seed_synthetic', players=6, teams=5, singles=60, doubles=20,
+                     seed=1, stdout=io.StringIO())
+
+    def assert_consistent(self):
+        out = io.StringIO()
+        call_command('replay_ratings', dry_run=True, stdout=out)
+        self.assertEqual(out.getvalue().count('(0 changed)'), 2)
+        self.assertIn('0 player ratings changed', out.getvalue())
+        self.assertIn('0 team ratings changed', out.getvalue())
+        for player in Player.objects.all():
+            games = SinglesGame.objects.filter(Q(player1=player) | Q(player2=player))
+            self.assertEqual(player.singles_games_played, games.count())
+            points = player.rating_points.order_by('date', 'game')
+            self.assertEqual(list(points.values_list('game', 'date')),
+                             list(games.order_by('date', 'id').values_list('id', 'date')))
+
+    def test_void_backdate_and_rescore(self):
+        games = list(SinglesGame.objects.order_by('date', 'id'))
+        corrections.void_game(games[20])
+        self.assert_consistent()
+
+        games[40].date = games[10].date - datetime.timedelta(seconds=1)
+        corrections.save_game(games[40])
+        self.assert_consistent()
+
+        game = DoublesGame.objects.order_by('date', 'id')[5]
+        game.team1_score, game.team2_score = game.team2_score, game.team1_score
+        corrections.save_game(game)
+        self.assert_consistent()
+
+        matchups = set(PlayerMatchup.objects.values_list(
+            'player', 'opponent', 'wins', 'losses', 'draws', 'last_played'))
+        call_command('rebuild_matchups', stdout=io.StringIO())
+        self.assertEqual(matchups, set(PlayerMatchup.objects.values_list(
+            'player', 'opponent', 'wins', 'losses', 'draws', 'last_played')))
+
+    def test_latest_game_replays_little(self):
+        game = SinglesGame.objects.order_by('-date', '-id')[1]
+        game.player1_score, game.player2_score = game.player2_score, game.player1_score
+        # Locks, the game, counters, the matchup, the two players' previous
+        # games and the few games since, rating points and the writes
+        with self.assertNumQueries(21) as queries:
+            corrections.save_game(game)
+        self.assert_consistent()
+        # Only the players whose ratings changed were locked or written
+        for query in queries.captured_queries:
+            if query['sql'].startswith('UPDATE "foos_player"'):
+                self.assertIn('WHERE', query['sql'])
+
+    def test_admin_delete_voids(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'foosball')
+        self.client.login(username='admin', password='foosball')
+        game = SinglesGame.objects.order_by('date', 'id')[0]
+        self.client.post(reverse('admin:foos_singlesgame_delete', args=[game.id]),
+                         {'post': 'yes'})
+        self.assertFalse(SinglesGame.objects.filter(id=game.id).exists())
+        self.assert_consistent()
+
+
+class ImportTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('tablet', password='foosball')
+        self.client.force_login(self.user)
+        self.players = [Player.objects.create(name='Player %d' % i) for i in range(4)]
+
+    def import_csv(self, text):
+        return importer.import_games(importer.read_games(io.StringIO(text), 'csv'))
+
+    def assert_consistent(self):
+        out = io.StringIO()
+        call_command('replay_ratings', dry_run=True, stdout=out)
+        self.assertEqual(out.getvalue().count('(0 changed)'), 2)
+        self.assertIn('0 player ratings changed', out.getvalue())
+
+    def test_invalid_game_rejects_batch(self):
+        with self.assertRaises(importer.GameImportError) as raised:
+            self.import_csv(
+                'game_type,date,player1,player2,player1_score,player2_score\n'
+                'singles,2017-03-01,Player 0,Player 1,10,5\n'
+                'singles,2017-03-02,Player 0,Nobody,10,5\n'
+                'singles,2017-03-03,Player 0,Player 1,5,3\n')
+        self.assertEqual(raised.exception.errors, [
+            'Line 3: Players do not exist! Clown.',
+            'Line 4: Surely somebody won the game?',
+        ])
+        self.assertFalse(SinglesGame.objects.exists())
+
+    def test_players_by_name_or_id(self):
+        Player.objects.create(name='Player 3')
+        lines = importer.read_games(io.StringIO(
+            '{"game_type": "singles", "date": "2017-03-01", "player1": "Player 0", '
+            '"player2": %d, "player1_score": 10, "player2_score": 5}\n'
+            '\n'
+            '{"game_type": "singles", "date": "2017-03-02", "player1": "Player 3", '
+            '"player2": "Player 1", "player1_score": 10, "player2_score": 5}\n'
+            % self.players[1].id), 'jsonl')
+        with self.assertRaises(importer.GameImportError) as raised:
+            importer.import_games(lines)
+        # Two players are called Player 3
+        self.assertEqual(raised.exception.errors, ['Line 3: Players do not exist! Clown.'])
+
+        summary = self.import_csv(
+            'game_type,date,player1,player2,player1_score,player2_score\n'
+            'singles,2017-03-01,Player 0,%d,10,5\n' % self.players[1].id)
+        self.assertEqual(summary, {'singles': 1, 'doubles': 0, 'backdated': False})
+        game = SinglesGame.objects.get()
+        self.assertEqual((game.player1, game.player2), tuple(self.players[:2]))
+
+    def test_counters_and_matchups(self):
+        self.import_csv(
+            'game_type,date,player1,player2,player1_score,player2_score,'
+            'team1player1,team1player2,team2player1,team2player2,team1_score,team2_score\n'
+            'singles,2017-03-02,Player 0,Player 1,10,5,,,,,,\n'
+            'singles,2017-03-01,Player 1,Player 0,10,5,,,,,,\n'
+            'singles,2017-03-03,Player 0,Player 2,3,3,,,,,,\n'
+            'doubles,2017-03-03,,,,,Player 0,Player 1,Player 2,Player 3,10,8\n'
+            'doubles,2017-03-04,,,,,Player 1,Player 0,Player 3,Player 2,4,10\n')
+        player = Player.objects.get(id=self.players[0].id)
+        self.assertEqual((player.singles_wins, player.singles_losses, player.singles_draws,
+                          player.singles_games_played), (1, 1, 1, 3))
+        self.assertEqual((player.doubles_wins, player.doubles_losses,
+                          player.doubles_games_played), (1, 1, 2))
+        team = Team.objects.get(player1=self.players[0], player2=self.players[1])
+        self.assertEqual((team.wins, team.losses, team.games_played), (1, 1, 2))
+        self.assertEqual(Team.objects.count(), 2)
+
+        matchup = PlayerMatchup.objects.get(player=self.players[0], opponent=self.players[1])
+        self.assertEqual((matchup.wins, matchup.losses, matchup.draws), (1, 1, 0))
+        self.assertEqual(matchup.last_played.date(), datetime.date(2017, 3, 2))
+        matchups = set(PlayerMatchup.objects.values_list(
+            'player', 'opponent', 'wins', 'losses', 'draws', 'last_played'))
+        call_command('rebuild_matchups', stdout=io.StringIO())
+        self.assertEqual(matchups, set(PlayerMatchup.objects.values_list(
+            'player', 'opponent', 'wins', 'losses', 'draws', 'last_played')))
+        self.assert_consistent()
+
+    def test_backdated_games_replay_history(self):
+        self.import_csv(
+            'game_type,date,player1,player2,player1_score,player2_score\n'
+            'singles,2017-03-02,Player 0,Player 1,10,5\n'
+            'singles,2017-03-03,Player 1,Player 2,10,5\n')
+        with tempfile.NamedTemporaryFile('w', suffix='.csv') as games:
+            games.write('game_type,date,player1,player2,player1_score,player2_score\n'
+                        'singles,2017-03-01,Player 2,Player 1,10,5\n')
+            games.flush()
+            out = io.StringIO()
+            call_command('import_games', games.name, stdout=out)
+        self.assertIn('Imported 1 singles and 0 doubles games.', out.getvalue())
+        self.assertIn('rated again', out.getvalue())
+        self.assert_consistent()
+
+    def test_csv_upload(self):
+        upload = SimpleUploadedFile('games.csv', (
+            'game_type,date,team1player1,team1player2,team2player1,team2player2,'
+            'team1_score,team2_score\n'
+            'doubles,2017-03-01,Player 0,Player 1,Player 2,Player 3,10,8\n').encode('utf-8'))
+        response = self.client.post(reverse('foos:import_games'), {'games': upload})
+        self.assertEqual(response.json(), {'singles': 0, 'doubles': 1, 'backdated': False})
+        self.assertEqual(DoublesGame.objects.get().team1_score, 10)
+
+        upload = SimpleUploadedFile('games.txt', b'')
+        response = self.client.post(reverse('foos:import_games'), {'games': upload})
+        self.assertEqual(response.status_code, 400)
+
+
+class ExportTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('tablet', password='foosball', is_staff=True)
+        self.client.force_login(self.user)
+        self.players = [Player.objects.create(name='Player %d' % i) for i in range(3)]
+        now = timezone.now()
+        for i in range(5):
+            SinglesGame.objects.create(player1=self.players[i % 3],
+                                       player2=self.players[(i + 1) % 3],
+                                       player1_score=10, player2_score=i,
+                                       date=now - datetime.timedelta(days=i))
+
+    def test_export_reads_in_batches(self):
+        stdout = io.StringIO()
+        call_command('export_games', 'singles', format='jsonl', chunk_size=2, stdout=stdout)
+        games = [json.loads(line) for line in stdout.getvalue().splitlines()]
+        self.assertEqual([game['player2_score'] for game in games], [4, 3, 2, 1, 0])
+        self.assertEqual(games[0]['player1_name'], 'Player 1')
+
+    def test_csv_endpoint_filters_by_player(self):
+        response = self.client.get(reverse('foos:export_games', args=['singles', 'csv']),
+                                   {'player': self.players[0].id})
+        rows = list(csv.DictReader(io.StringIO(
+            b''.join(response.streaming_content).decode('utf-8'))))
+        self.assertEqual(len(rows), 3)
+        for row in rows:
+            self.assertIn(str(self.players[0].id), (row['player1'], row['player2']))
+
+    def test_export_is_staff_only(self):
+        self.user.is_staff = False
+        self.user.save()
+        response = self.client.get(reverse('foos:export_games', args=['doubles', 'jsonl']))
+        self.assertEqual(response.status_code, 302)
+
+
+class PlayerHistoryTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('tablet', password='foosball')
+        self.client.force_login(self.user)
+        self.red = Player.objects.create(name='Red')
+        self.blue = Player.objects.create(name='Blue')
+        now = timezone.now()
+        # Two games share a timestamp to exercise the id tiebreak
+        dates = [now, now, now - datetime.timedelta(days=1),
+                 now - datetime.timedelta(days=2), now - datetime.timedelta(days=3)]
+        self.games = [SinglesGame.objects.create(
+            player1=self.red if i % 2 else self.blue,
+            player2=self.blue if i % 2 else self.red,
+            player1_score=10,
+            player2_score=i,
+            player1_start_rating=1000,
+            player1_end_rating=1000 + i,
+            date=date) for i, date in enumerate(dates)]
+
+    @override_settings(FOOS_HISTORY_PAGE_SIZE=2)
+    def test_pages_cover_history_in_order(self):
+        response = self.client.get(reverse('foos:player', args=[self.red.id]))
+        seen = [game.id for game in response.context['singles_games']]
+        cursor = response.context['next_cursor']
+        while cursor:
+            response = self.client.get(reverse('foos:player_games', args=[self.red.id]),
+                                       {'cursor': cursor})
+            seen.extend(game.id for game in response.context['singles_games'])
+            cursor = response.context['next_cursor']
+
+        expected = sorted(self.games, key=lambda game: (game.date, game.id), reverse=True)
+        self.assertEqual(seen, [game.id for game in expected])
+
+    def test_rating_changes_are_annotated(self):
+        games, _ = views._singles_history_page(self.red)
+        for game in games:
+            self.assertEqual(game.player1_rating_change,
+                             game.player1_end_rating - game.player1_start_rating)
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('foos:player_games', args=[self.red.id]),
+                                   {'cursor': 'nope'})
+        self.assertEqual(response.status_code, 404)
+
+
+class RatingHistoryTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('tablet', password='foosball')
+        self.client.force_login(self.user)
+        self.red = Player.objects.create(name='Red')
+        self.blue = Player.objects.create(name='Blue')
+
+    def play(self, games):
+        for i in range(games):
+            self.client.post(reverse('foos:new_game'), {
+                'game_type': 'singles',
+                'player1': self.red.id,
+                'player2': self.blue.id,
+                'player1_score': 10,
+                'player2_score': i % 9,
+            })
+
+    def test_downsampling_keeps_ends(self):
+        points = [[x, (x * 7) % 13] for x in range(100)]
+        sampled = rating_history.largest_triangle_three_buckets(points, 10)
+        self.assertEqual(len(sampled), 10)
+        self.assertEqual((sampled[0], sampled[-1]), (points[0], points[-1]))
+        self.assertEqual(sampled, sorted(sampled))
+        self.assertEqual(rating_history.largest_triangle_three_buckets(points, 100), points)
+
+    def test_submitted_game_adds_points(self):
+        self.play(1)
+        game = SinglesGame.objects.get()
+        self.assertEqual(
+            set(RatingPoint.objects.values_list('player', 'game', 'rating')),
+            {(self.red.id, game.id, game.player1_end_rating),
+             (self.blue.id, game.id, game.player2_end_rating)})
+
+    def test_endpoint_points(self):
+        self.play(12)
+        url = reverse('foos:player_ratings', args=[self.red.id])
+        response = self.client.get(url, {'points': 5})
+        points = response.json()['points']
+        self.assertEqual(len(points), 5)
+        self.assertEqual(points[-1][1], Player.objects.get(id=self.red.id).rating)
+        self.assertEqual(len(self.client.get(url).json()['points']), 12)
+        # Too few points to draw a line are raised to three
+        self.assertEqual(len(self.client.get(url, {'points': 1}).json()['points']), 3)
+        self.assertEqual(self.client.get(url, {'points': 'lots'}).status_code, 400)
+
+    def test_rebuild_from_history(self):
+        self.play(6)
+        points = set(RatingPoint.objects.values_list('player', 'game', 'date', 'rating'))
+        self.assertEqual(len(points), 12)
+        call_command('rebuild_rating_points', stdout=io.StringIO())
+        self.assertEqual(points, set(RatingPoint.objects.values_list(
+            'player', 'game', 'date', 'rating')))
+
+        RatingPoint.objects.filter(game__in=SinglesGame.objects.order_by('-id')[:2]).delete()
+        self.assertEqual(rating_history.backfill(
+            after_id=SinglesGame.objects.order_by('-id')[2].id), 4)
+        self.assertEqual(points, set(RatingPoint.objects.values_list(
+            'player', 'game', 'date', 'rating')))
+
+
+class QueryBudgetTests(TestCase):
+    """Each page costs a fixed number of queries however much it shows."""
+
+    # Session and user lookups made for every logged in request
+    auth_queries = 2
+
+    def setUp(self):
+        get_cache().clear()
+        self.user = User.objects.create_user('tablet', password='foosball')
+        self.client.force_login(self.user)
+        self.players = [Player.objects.create(name='Player %d' % i, singles_games_played=4)
+                        for i in range(6)]
+        self.teams = [Team.objects.create(player1=self.players[i], player2=self.players[i + 1])
+                      for i in range(0, 6, 2)]
+        for i in range(12):
+            SinglesGame.objects.create(player1=self.players[i % 6],
+                                       player2=self.players[(i + 1) % 6],
+                                       player1_score=10, player2_score=i % 9)
+            DoublesGame.objects.create(team1=self.teams[i % 3],
+                                       team2=self.teams[(i + 1) % 3],
+                                       team1_score=10, team2_score=i % 9)
+
+    def test_index(self):
+        # Recent singles, singles ranking, recent doubles, doubles ranking
+        with self.assertNumQueries(self.auth_queries + 4):
+            response = self.client.get(reverse('foos:index'))
+        self.assertContains(response, 'Player 4, Player 5')
+
+    def test_player(self):
+        # Player, history page, head-to-head records, other players
+        with self.assertNumQueries(self.auth_queries + 4):
+            response = self.client.get(reverse('foos:player', args=[self.players[0].id]))
+        for game in response.context['singles_games']:
+            self.assertIn(self.players[0], (game.player1, game.player2))
+
+    def test_new_game_form(self):
+        with self.assertNumQueries(self.auth_queries + 1):
+            self.client.get(reverse('foos:new_game'))
+
+    def test_new_singles_game(self):
+        # The submission's savepoint, locking and reading both players
+        # (SQLite needs a separate write to lock), inserting the game,
+        # updating both players, updating or creating both head-to-head
+        # records, then adding both rating points
+        lock_queries = 1 if connection.features.has_select_for_update else 2
+        with self.assertNumQueries(self.auth_queries + 2 + lock_queries + 7):
+            self.client.post(reverse('foos:new_game'), {
+                'game_type': 'singles',
+                'player1': self.players[0].id,
+                'player2': self.players[3].id,
+                'player1_score': 10,
+                'player2_score': 3,
+            })
+
+    def test_new_doubles_game(self):
+        # The submission's savepoint, locking all four players, looking
+        # up both teams and locking them, inserting the game, then
+        # updating the teams and the players
+        lock_queries = 1 if connection.features.has_select_for_update else 2
+        with self.assertNumQueries(self.auth_queries + 2 + 2 * lock_queries + 2 + 3):
+            self.client.post(reverse('foos:new_game'), {
+                'game_type': 'doubles',
+                'team1player1': self.players[1].id,
+                'team1player2': self.players[0].id,
+                'team2player1': self.players[2].id,
+                'team2player2': self.players[3].id,
+                'team1_score': 10,
+                'team2_score': 3,
+            })
+
+
+class LeaderboardCacheTests(TestCase):
+
+    def setUp(self):
+        get_cache().clear()
+        self.user = User.objects.create_user('tablet', password='foosball')
+        self.client.force_login(self.user)
+        self.red = Player.objects.create(name='Red', singles_games_played=4)
+        self.blue = Player.objects.create(name='Blue', singles_games_played=4)
+
+    def test_index_is_served_from_cache_between_games(self):
+        self.client.get(reverse('foos:index'))
+        # Only the session and user lookups are left
+        with self.assertNumQueries(2):
+            self.client.get(reverse('foos:index'))
+
+    @override_settings(CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                    'LOCATION': 'default'},
+        'leaderboard': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                        'LOCATION': 'leaderboard'},
+    }, FOOS_CACHE='leaderboard')
+    def test_fragments_use_foos_cache(self):
+        self.client.get(reverse('foos:index'))
+        caches['default'].clear()
+        with self.assertNumQueries(2):
+            self.client.get(reverse('foos:index'))
+
+    def test_new_game_invalidates_cache(self):
+        self.client.get(reverse('foos:index'))
+        self.client.post(reverse('foos:new_game'), {
+            'game_type': 'singles',
+            'player1': self.red.id,
+            'player2': self.blue.id,
+            'player1_score': 10,
+            'player2_score': 2,
+        })
+        # Tests run inside a transaction, so the on_commit hook never fires
+        bump_ratings_version()
+
+        response = self.client.get(reverse('foos:index'))
+        self.assertContains(response, '1016 (16)')
+
+
+class GameRowCacheTests(TestCase):
+
+    def setUp(self):
+        get_cache().clear()
+        self.user = User.objects.create_user('tablet', password='foosball')
+        self.client.force_login(self.user)
+        self.red = Player.objects.create(name='Red')
+        self.blue = Player.objects.create(name='Blue')
+        self.game = SinglesGame.objects.create(player1=self.red, player2=self.blue,
+                                               player1_score=10, player2_score=7,
+                                               player1_end_rating=1012)
+
+    def test_rows_are_rendered_once(self):
+        url = reverse('foos:player', args=[self.red.id])
+        self.assertContains(self.client.get(url), '1012 (12)')
+        SinglesGame.objects.filter(id=self.game.id).update(player1_end_rating=1014)
+        self.assertContains(self.client.get(url), '1012 (12)')
+
+        bump_game_rows_version()
+        self.assertContains(self.client.get(url), '1014 (14)')
+
+    def test_player_page_rows_are_drawn_from_their_side(self):
+        response = self.client.get(reverse('foos:player', args=[self.red.id]))
+        self.assertContains(response, '<strong>Red</strong>')
+        self.assertContains(response, '<a href="%s">Blue</a>' % reverse(
+            'foos:player', args=[self.blue.id]))
+
+        response = self.client.get(reverse('foos:index'))
+        self.assertNotContains(response, '<strong>Red</strong>')
+
+
+class LiveUpdateTests(SimpleTestCase):
+
+    def setUp(self):
+        get_cache().clear()
+
+    def test_in_process_broker_fans_out(self):
+        broker = live.InProcessBroker()
+        first, second = broker.subscribe(), broker.subscribe()
+        broker.publish({'type': 'singles'})
+        self.assertEqual(first.get(1), (1, {'type': 'singles'}))
+        self.assertEqual(second.get(1), (1, {'type': 'singles'}))
+
+        second.close()
+        broker.publish({'type': 'doubles'})
+        self.assertEqual(first.get(1), (2, {'type': 'doubles'}))
+        self.assertIsNone(second.get(0))
+
+    def test_cache_broker_reaches_other_workers(self):
+        worker1, worker2 = live.CacheBroker(), live.CacheBroker()
+        subscription = worker2.subscribe()
+        try:
+            worker1.publish({'type': 'singles'})
+            self.assertEqual(subscription.get(5), (1, {'type': 'singles'}))
+        finally:
+            subscription.close()
+
+    def test_cache_broker_survives_lost_counter(self):
+        worker1, worker2 = live.CacheBroker(), live.CacheBroker()
+        subscription = worker2.subscribe()
+        try:
+            worker1.publish({'type': 'singles'})
+            worker1.publish({'type': 'doubles'})
+            self.assertEqual(subscription.get(5), (1, {'type': 'singles'}))
+            self.assertEqual(subscription.get(5), (2, {'type': 'doubles'}))
+            get_cache().delete(live.EVENT_COUNTER_KEY)
+            worker1.publish({'type': 'singles'})
+            self.assertEqual(subscription.get(5), (1, {'type': 'singles'}))
+        finally:
+            subscription.close()
+
+    def test_event_stream(self):
+        broker = live.InProcessBroker()
+        stream = live.event_stream(broker.subscribe(), keepalive=0)
+        self.assertEqual(next(stream), 'retry: 5000\n\n')
+        self.assertEqual(next(stream), ': keepalive\n\n')
+        broker.publish({'type': 'singles'})
+        self.assertEqual(next(stream), 'id: 1\nevent: game\ndata: {"type": "singles"}\n\n')
+        stream.close()
+        self.assertEqual(broker.subscribers, set())
+
+    def test_async_subscription(self):
+        broker = live.InProcessBroker()
+
+        async def listen():
+            subscription = broker.subscribe(
+                live.AsyncSubscription(broker, asyncio.get_event_loop()))
+            self.assertIsNone(await subscription.get(0))
+            # Games are published from request threads
+            publisher = threading.Thread(target=broker.publish, args=({'type': 'singles'},))
+            publisher.start()
+            message = await subscription.get(5)
+            publisher.join()
+            subscription.close()
+            return message
+
+        loop = asyncio.new_event_loop()
+        try:
+            self.assertEqual(loop.run_until_complete(listen()), (1, {'type': 'singles'}))
+        finally:
+            loop.close()
+        self.assertEqual(broker.subscribers, set())
+
+
+class AsgiTests(TransactionTestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.handler = ASGIHandler(get_wsgi_application())
+
+    def tearDown(self):
+        self.handler.executor.shutdown()
+        self.loop.close()
+
+    def scope(self, path, method='GET', headers=()):
+        return {'type': 'http', 'method': method, 'path': path, 'query_string': b'',
+                'headers': [(b'host', b'testserver')] + list(headers)}
+
+    def request(self, scope, body=(b'',), handler=None):
+        messages = [{'type': 'http.request', 'body': chunk, 'more_body': i < len(body) - 1}
+                    for i, chunk in enumerate(body)]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        self.loop.run_until_complete((handler or self.handler)(scope, receive, send))
+        return sent
+
+    def session_cookies(self):
+        user = User.objects.create_user('tablet', password='foosball')
+        self.client.force_login(user)
+        session = self.client.cookies[settings.SESSION_COOKIE_NAME].value
+        # Browsers may split cookies over several headers
+        return [(b'cookie', b'theme=dark'),
+                (b'cookie', ('%s=%s' % (settings.SESSION_COOKIE_NAME, session)).encode())]
+
+    def test_page_through_thread_pool(self):
+        sent = self.request(self.scope('/', headers=self.session_cookies()))
+        self.assertEqual(sent[0]['type'], 'http.response.start')
+        self.assertEqual(sent[0]['status'], 200)
+        self.assertIn(b'<html', b''.join(message.get('body', b'') for message in sent[1:]))
+        self.assertEqual(sent[-1], {'type': 'http.response.body', 'body': b''})
+
+        sent = self.request(self.scope('/'))
+        self.assertEqual(sent[0]['status'], 302)
+
+    def test_post_body(self):
+        def echo(environ, start_response):
+            start_response('200 OK', [('Content-Type', 'text/plain')])
+            return [environ['REQUEST_METHOD'].encode(), b' ', environ['wsgi.input'].read()]
+
+        sent = self.request(self.scope('/echo/', method='POST'),
+                            body=[b'player1=1&', b'player2=2'],
+                            handler=ASGIHandler(echo))
+        self.assertEqual(b''.join(message.get('body', b'') for message in sent[1:]),
+                         b'POST player1=1&player2=2')
+
+    def test_live_updates_need_login(self):
+        sent = self.request(self.scope('/live/'))
+        self.assertEqual(sent[0]['status'], 403)
+        self.assertEqual(len(sent), 2)
+
+    def test_live_updates_stream_until_disconnect(self):
+        scope = self.scope('/live/', headers=self.session_cookies())
+        broker = live.get_broker()
+        disconnect = asyncio.Event(loop=self.loop)
+        sent = []
+
+        async def receive():
+            await disconnect.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            sent.append(message)
+            if message.get('body') == live.STREAM_START.encode('utf-8'):
+                # Published from a request thread once the stream is open
+                self.loop.run_in_executor(None, broker.publish, {'type': 'singles'})
+            elif b'event: game' in message.get('body', b''):
+                disconnect.set()
+
+        self.loop.run_until_complete(asyncio.wait_for(self.handler(scope, receive, send), 5))
+        self.assertEqual(sent[0]['status'], 200)
+        self.assertIn(b'data: {"type": "singles"}', sent[-1]['body'])
+        self.assertEqual(broker.subscribers, set())
+
+
+class SqliteTuningTests(TestCase):
+
+    def setUp(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('SQLite only')
+
+    def _busy_timeout(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA busy_timeout')
+            return cursor.fetchone()[0]
+
+    def test_pragmas_set_on_new_connections(self):
+        original = self._busy_timeout()
+        self.addCleanup(connection.cursor().execute, 'PRAGMA busy_timeout = %d' % original)
+        with override_settings(FOOS_SQLITE_PRAGMAS={'busy_timeout': 1234}):
+            signals.tune_sqlite(sender=None, connection=connection)
+        self.assertEqual(self._busy_timeout(), 1234)
+
+
+@override_settings(FOOS_READ_REPLICAS=['replica'])
+class ReplicaRoutingTests(SimpleTestCase):
+
+    def _route(self, request, write=False):
+        routed = []
+
+        def view(request):
+            if write:
+                router.db_for_write(Player)
+            routed.append(router.db_for_read(Player))
+            return HttpResponse()
+
+        response = replicas.ReplicaMiddleware(view)(request)
+        return routed[0], response
+
+    def test_only_safe_requests_read_from_replicas(self):
+        factory = RequestFactory()
+        self.assertEqual(self._route(factory.get('/'))[0], 'replica')
+        self.assertEqual(self._route(factory.post('/'))[0], 'default')
+        self.assertEqual(router.db_for_read(Player), 'default')
+
+    def test_writes_pin_the_browser_to_the_primary(self):
+        factory = RequestFactory()
+        database, response = self._route(factory.post('/'), write=True)
+        self.assertEqual(database, 'default')
+        self.assertIn(replicas.PIN_COOKIE, response.cookies)
+
+        request = factory.get('/')
+        request.COOKIES[replicas.PIN_COOKIE] = '1'
+        self.assertEqual(self._route(request)[0], 'default')
+
+
+class ConcurrentSubmissionTests(TransactionTestCase):
+    threads = 4
+    games_per_thread = 10
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('needs a test database that separate connections can share')
+        self.user = User.objects.create_user('tablet', password='foosball')
+        self.players = [Player.objects.create(name='Player %d' % i) for i in range(3)]
+
+    def _submit_games(self, offset, errors):
+        client = Client()
+        client.force_login(self.user)
+        try:
+            for i in range(self.games_per_thread):
+                # Rotate through the pairings so every thread contends
+                # for every player.
+                player1 = self.players[(offset + i) % 3]
+                player2 = self.players[(offset + i + 1) % 3]
+                response = client.post(reverse('foos:new_game'), {
+                    'game_type': 'singles',
+                    'player1': player1.id,
+                    'player2': player2.id,
+                    'player1_score': 10,
+                    'player2_score': i % 9,
+                })
+                if response.status_code != 302:
+                    errors.append(response.status_code)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            connection.close()
+
+    def test_no_lost_updates(self):
+        errors = []
+        workers = [threading.Thread(target=self._submit_games, args=(offset, errors))
+                   for offset in range(self.threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(errors, [])
+
+        total = self.threads * self.games_per_thread
+        self.assertEqual(SinglesGame.objects.count(), total)
+        for player in Player.objects.all():
+            games = SinglesGame.objects\
+                .filter(Q(player1=player) | Q(player2=player))\
+                .order_by('id')
+            self.assertEqual(player.singles_games_played, games.count())
+            self.assertEqual(player.singles_wins + player.singles_losses + player.singles_draws,
+                             games.count())
+
+            # Every game must start from the rating the previous one ended on
+            rating = 1000
+            for game in games:
+                if game.player1_id == player.id:
+                    self.assertEqual(game.player1_start_rating, rating)
+                    rating = game.player1_end_rating
+                else:
+                    self.assertEqual(game.player2_start_rating, rating)
+                    rating = game.player2_end_rating
+            self.assertEqual(player.rating, rating)
+
+
+class QueryPlanTests(TestCase):
+    """The game history queries must be answered from indexes."""
+
+    def setUp(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('query plans are checked on SQLite only')
+        self.red = Player.objects.create(name='Red')
+        self.blue = Player.objects.create(name='Blue')
+        self.team = Team.objects.create(player1=self.red, player2=self.blue)
+
+    def assertUsesIndexes(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            plan = [row[-1] for row in cursor.fetchall()]
+        for step in plan:
+            if step.startswith('SCAN') and 'USING' not in step:
+                self.fail('Full table scan in query plan: %s' % '; '.join(plan))
+            if step.startswith('USE TEMP B-TREE FOR ORDER BY'):
+                self.fail('Sort without an index in query plan: %s' % '; '.join(plan))
+
+    def test_recent_games(self):
+        self.assertUsesIndexes(SinglesGame.objects.order_by('-date')[:10])
+        self.assertUsesIndexes(DoublesGame.objects.order_by('-date')[:10])
+
+    def test_player_history(self):
+        self.assertUsesIndexes(views._player_singles_games(self.red))
+
+    def test_player_history_page(self):
+        before = (timezone.now(), 100)
+        self.assertUsesIndexes(views._player_singles_games(self.red, before)[:50])
+
+    def test_team_history(self):
+        self.assertUsesIndexes(DoublesGame.objects.filter(team1=self.team).order_by('-date'))
+        self.assertUsesIndexes(DoublesGame.objects.filter(team2=self.team).order_by('-date'))
+
+    def test_head_to_head(self):
+        self.assertUsesIndexes(SinglesGame.objects.filter(player1=self.red, player2=self.blue))
+        self.assertUsesIndexes(DoublesGame.objects.filter(team1=self.team, team2=self.team))
+
+
+class ApiTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('tablet', password='foosball')
+        self.client.force_login(self.user)
+        self.red = Player.objects.create(name='Red', singles_games_played=4, rating=1020)
+        self.blue = Player.objects.create(name='Blue', singles_games_played=4, rating=980)
+        SinglesGame.objects.create(player1=self.red, player2=self.blue,
+                                   player1_score=10, player2_score=5)
+
+    def test_singles_rankings(self):
+        response = self.client.get(reverse('foos:api_singles_rankings'))
+        rankings = response.json()['rankings']
+        self.assertEqual([(player['rank'], player['name']) for player in rankings],
+                         [(1, 'Red'), (2, 'Blue')])
+
+        response = self.client.get(reverse('foos:api_player', args=[self.blue.id]))
+        self.assertEqual(response.json()['singles_rank'], 2)
+
+    def test_unchanged_poll_is_not_modified(self):
+        url = reverse('foos:api_singles_rankings')
+        etag = self.client.get(url)['ETag']
+        # Session, user and the latest game ids; no ranking query
+        with self.assertNumQueries(4):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+    def test_new_game_changes_etag(self):
+        url = reverse('foos:api_recent_games')
+        etag = self.client.get(url)['ETag']
+        self.client.post(reverse('foos:new_game'), {
+            'game_type': 'singles',
+            'player1': self.red.id,
+            'player2': self.blue.id,
+            'player1_score': 10,
+            'player2_score': 2,
+        })
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['singles']), 2)
+
+    def test_corrected_game_changes_etag(self):
+        url = reverse('foos:api_recent_games')
+        etag = self.client.get(url)['ETag']
+        game = SinglesGame.objects.get()
+        game.player2_score = 10
+        game.player1_score = 3
+        # Tests run inside a transaction, so run the hooks as a commit would
+        with mock.patch('django.db.transaction.on_commit') as on_commit:
+            corrections.save_game(game)
+        hooks = [call[0][0] for call in on_commit.call_args_list]
+        self.assertIn(bump_game_rows_version, hooks)
+        for hook in hooks:
+            hook()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+
+@override_settings(MIDDLEWARE=['foos.metrics.MetricsMiddleware'] + settings.MIDDLEWARE)
+class MetricsTests(TestCase):
+
+    def setUp(self):
+        for histogram in metrics.HISTOGRAMS:
+            histogram.clear()
+        self.user = User.objects.create_user('tablet', password='foosball')
+        self.client.force_login(self.user)
+
+    def test_views_are_measured(self):
+        self.client.get(reverse('foos:new_game'))
+        # Session, user and players
+        self.assertEqual(metrics.QUERY_COUNT.series['foos:new_game'][2], 1)
+        self.assertEqual(metrics.QUERY_COUNT.series['foos:new_game'][1], 3)
+
+        self.user.is_staff = True
+        self.user.save()
+        response = self.client.get(reverse('foos:metrics'))
+        self.assertContains(
+            response, 'tabletracker_request_queries_bucket{view="foos:new_game",le="5.0"} 1')
+        self.assertContains(
+            response, 'tabletracker_request_duration_seconds_count{view="foos:new_game"} 1')
+
+    def test_metrics_are_staff_only(self):
+        response = self.client.get(reverse('foos:metrics'))
+        self.assertEqual(response.status_code, 302)
+
+    @override_settings(FOOS_SLOW_REQUEST_SECONDS=0)
+    def test_slow_requests_log_their_queries(self):
+        with self.assertLogs('foos.metrics', 'WARNING') as logs:
+            self.client.get(reverse('foos:new_game'))
+        self.assertIn('FROM "foos_player"', logs.output[0])
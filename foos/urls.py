@@ -1,10 +1,23 @@
 from django.conf.urls import url
 
-from . import views
+from . import api, metrics, views
 
 app_name = 'foos'
 urlpatterns = [
     url(r'^$', views.index, name='index'),
+    url(r'^live/$', views.live_updates, name='live_updates'),
     url(r'^game/new/$', views.new_game, name='new_game'),
+    url(r'^game/import/$', views.import_games, name='import_games'),
+    url(r'^game/matchmaking/$', views.matchmaking, name='matchmaking'),
+    url(r'^game/export/(?P<game_type>singles|doubles)\.(?P<format>csv|jsonl)$',
+        views.export_games, name='export_games'),
     url(r'^player/(?P<player_id>[0-9]+)/$', views.player, name='player'),
+    url(r'^player/(?P<player_id>[0-9]+)/games/$', views.player_games, name='player_games'),
+    url(r'^player/(?P<player_id>[0-9]+)/ratings/$', views.player_ratings, name='player_ratings'),
+    url(r'^api/singles/rankings/$', api.singles_rankings, name='api_singles_rankings'),
+    url(r'^api/doubles/rankings/$', api.doubles_rankings, name='api_doubles_rankings'),
+    url(r'^api/games/recent/$', api.recent_games, name='api_recent_games'),
+    url(r'^api/players/(?P<player_id>[0-9]+)/$', api.player_summary, name='api_player'),
+    url(r'^api/matchmaking/$', api.matchmaking, name='api_matchmaking'),
+    url(r'^metrics/$', metrics.metrics, name='metrics'),
 ]
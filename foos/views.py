@@ -1,43 +1,59 @@
-import math
+import datetime
+import io
 
+from django.conf import settings
 from django.contrib.auth import authenticate, login, logout
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
-from django.db.models import Q
+from django.db import transaction
+from django.db.models import Case, DateTimeField, F, IntegerField, Q, TextField, Value, When
+from django.http import Http404, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render, redirect, get_object_or_404
-from .models import SinglesGame, Player, DoublesGame, Team
+from django.utils import timezone
+from django.views.decorators.http import require_POST
+from . import export, importer, live, rating_history, ratings
+from .games import get_team, lock_participants, parse_date, validate_scores
+from .matchmaking import find_games, player_ids
+from .leaderboard_cache import (FRAGMENT_TIMEOUT, bump_ratings_version, cache_alias,
+                                ratings_version)
+from .models import SinglesGame, Player, DoublesGame, Team, PlayerMatchup
+
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=timezone.utc)
 
 
 @login_required
 def index(request):
-    recent_singles_games = SinglesGame.objects.order_by('-date')[:10]
+    # Nothing here is evaluated until the template renders it, so
+    # fragments served from the cache cost no queries at all.
+    recent_singles_games = SinglesGame.objects\
+        .select_related('player1', 'player2')\
+        .annotate(
+            player1_rating_change=F('player1_end_rating') - F('player1_start_rating'),
+            player2_rating_change=F('player2_end_rating') - F('player2_start_rating'))\
+        .order_by('-date')[:10]
     singles_ranking = Player.objects\
         .filter(singles_games_played__gte=4)\
         .order_by('-rating')
 
-    processed_singles_games = []
-    for game in recent_singles_games:
-        setattr(game, 'player1_rating_change',
-                game.player1_end_rating - game.player1_start_rating)
-        setattr(game, 'player2_rating_change',
-                game.player2_end_rating - game.player2_start_rating)
-        processed_singles_games.append(game)
-
-    recent_doubles_games = DoublesGame.objects.order_by('-date')[:10]
-    doubles_ranking = Team.objects.order_by('-rating')
-
-    processed_doubles_games = []
-    for game in recent_doubles_games:
-        setattr(game, 'team1_rating_change',
-                game.team1_end_rating - game.team1_start_rating)
-        setattr(game, 'team2_rating_change',
-                game.team2_end_rating - game.team2_start_rating)
-        processed_doubles_games.append(game)
+    recent_doubles_games = DoublesGame.objects\
+        .select_related('team1__player1', 'team1__player2',
+                        'team2__player1', 'team2__player2')\
+        .annotate(
+            team1_rating_change=F('team1_end_rating') - F('team1_start_rating'),
+            team2_rating_change=F('team2_end_rating') - F('team2_start_rating'))\
+        .order_by('-date')[:10]
+    doubles_ranking = Team.objects\
+        .select_related('player1', 'player2')\
+        .order_by('-rating')
 
     return render(request, 'foos/index.html', {
-        'recent_singles_games' : processed_singles_games,
+        'recent_singles_games' : recent_singles_games,
         'singles_ranking' : singles_ranking,
-        'recent_doubles_games' : processed_doubles_games,
+        'recent_doubles_games' : recent_doubles_games,
         'doubles_ranking' : doubles_ranking,
+        'ratings_version' : ratings_version(),
+        'cache_timeout' : FRAGMENT_TIMEOUT,
+        'foos_cache' : cache_alias(),
         'user' : request.user,
     }, content_type='application/xhtml+xml')
 
@@ -88,64 +104,194 @@ def new_game(request):
         return redirect('foos:index')
 
 
+@login_required
+def matchmaking(request):
+    players = Player.objects.all().order_by('name')
+    present = player_ids(request.GET.getlist('players'))
+    game_type = request.GET.get('game_type', 'doubles')
+    context = {
+        'players' : players,
+        'present' : present,
+        'game_type' : game_type,
+    }
+    if game_type not in ('singles', 'doubles'):
+        context['error_message'] = 'Invalid game_type received! Clown.'
+    elif present:
+        needed = 2 if game_type == 'singles' else 4
+        if len(present) < needed:
+            context['error_message'] = 'Pick at least %d players for %s.' % (needed, game_type)
+        else:
+            context['games'] = find_games(game_type, present)
+    return render(request, 'foos/matchmaking.html', context)
+
+
 @login_required
 def player(request, player_id):
     player = get_object_or_404(Player, pk=player_id)
-    # Pull a list of all games played by the player
-    singles_games = SinglesGame.objects\
-        .filter(Q(player1=player) | Q(player2=player))\
-        .order_by('-date')
-    processed_singles_games = []
-    for game in singles_games:
-        setattr(game, 'player1_rating_change',
-                game.player1_end_rating - game.player1_start_rating)
-        setattr(game, 'player2_rating_change',
-                game.player2_end_rating - game.player2_start_rating)
-        processed_singles_games.append(game)
+    # Only the most recent games, the rest are loaded on demand
+    singles_games, next_cursor = _singles_history_page(player)
     # Build a list of wins/losses vs. every other player
-    prob_player_list = _calculate_player_win_probs(player_id)
+    prob_player_list = _calculate_player_win_probs(player)
     # Build probability of winning vs every other player
     return render(request, 'foos/player.html', {
         'player' : player,
-        'singles_games' : processed_singles_games,
+        'singles_games' : singles_games,
+        'next_cursor' : next_cursor,
         'player_probabilities' : prob_player_list
     })
 
 
-def _calculate_player_win_probs(player_id):
-    player = Player.objects.get(id=player_id)
-    other_players = Player.objects.exclude(id=player_id)
+@login_required
+def player_games(request, player_id):
+    player = get_object_or_404(Player, pk=player_id)
+    try:
+        before = _decode_cursor(request.GET['cursor'])
+    except (KeyError, ValueError):
+        raise Http404('Invalid cursor')
+    singles_games, next_cursor = _singles_history_page(player, before)
+    return render(request, 'foos/singles_game_rows.html', {
+        'player' : player,
+        'singles_games' : singles_games,
+        'next_cursor' : next_cursor,
+    })
+
+
+@login_required
+def player_ratings(request, player_id):
+    player = get_object_or_404(Player, pk=player_id)
+    try:
+        points = int(request.GET.get('points', 500))
+    except ValueError:
+        return JsonResponse({'error': 'points must be a whole number'}, status=400)
+    points = max(3, min(points, 5000))
+    return JsonResponse({
+        'id' : player.id,
+        'name' : player.name,
+        'points' : rating_history.rating_series(player, points),
+    })
+
+
+@login_required
+def live_updates(request):
+    subscription = live.get_broker().subscribe()
+    response = StreamingHttpResponse(live.event_stream(subscription),
+                                     content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Don't let nginx hold events back in its buffer
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@login_required
+@require_POST
+def import_games(request):
+    upload = request.FILES.get('games')
+    format = request.GET.get('format')
+    if format is None and upload is not None:
+        format = upload.name.rsplit('.', 1)[-1].lower()
+    if format not in importer.FORMATS:
+        return JsonResponse({
+            'errors': ['Unknown format, use one of: %s.' % ', '.join(importer.FORMATS)],
+        }, status=400)
+
+    if upload is not None:
+        stream = io.TextIOWrapper(upload.file, encoding='utf-8', newline='')
+    else:
+        stream = io.StringIO(request.body.decode('utf-8'), newline='')
+    try:
+        summary = importer.import_games(importer.read_games(stream, format))
+    except importer.GameImportError as e:
+        return JsonResponse({'errors': e.errors}, status=400)
+
+    return JsonResponse(summary)
+
+
+@staff_member_required
+def export_games(request, game_type, format):
+    filters = {}
+    for name in ('since', 'until'):
+        if request.GET.get(name):
+            filters[name] = parse_date(request.GET[name])
+            if filters[name] is None:
+                return JsonResponse({'errors': ['Invalid %s date.' % name]}, status=400)
+    if request.GET.get('player'):
+        try:
+            filters['player'] = int(request.GET['player'])
+        except ValueError:
+            return JsonResponse({'errors': ['Invalid player.']}, status=400)
+
+    response = StreamingHttpResponse(export.export_games(game_type, format, **filters),
+                                     content_type=export.CONTENT_TYPES[format])
+    response['Content-Disposition'] = 'attachment; filename="%s.%s"' % (game_type, format)
+    return response
+
+
+def _player_singles_games(player, before=None):
+    # One query per player slot, so each side can walk its (player, date)
+    # index; an OR across both slots would scan the whole table.
+    slots = []
+    for slot in ('player1', 'player2'):
+        games = SinglesGame.objects\
+            .select_related('player1', 'player2')\
+            .filter(**{slot: player})
+        if before is not None:
+            date, pk = before
+            games = games.filter(date__lte=date).exclude(date=date, id__gte=pk)
+        slots.append(games.annotate(
+            player1_rating_change=F('player1_end_rating') - F('player1_start_rating'),
+            player2_rating_change=F('player2_end_rating') - F('player2_start_rating'),
+        ))
+    return slots[0].union(slots[1], all=True).order_by('-date', '-id')
+
+
+def _singles_history_page(player, before=None):
+    """
+    Returns a page of the player's singles games, newest first, along with
+    the cursor of the next page (None on the last page). Pages are keyed
+    on (date, id) rather than an offset, so every page costs the same
+    however far back it is.
+    """
+    page_size = getattr(settings, 'FOOS_HISTORY_PAGE_SIZE', 50)
+    games = list(_player_singles_games(player, before)[:page_size + 1])
+    if len(games) <= page_size:
+        return games, None
+    games = games[:page_size]
+    return games, _encode_cursor(games[-1])
+
+
+def _encode_cursor(game):
+    microseconds = (game.date - _EPOCH) // datetime.timedelta(microseconds=1)
+    return '%d-%d' % (microseconds, game.id)
+
+
+def _decode_cursor(cursor):
+    microseconds, pk = cursor.split('-')
+    return _EPOCH + datetime.timedelta(microseconds=int(microseconds)), int(pk)
+
+
+def _calculate_player_win_probs(player):
+    # Head-to-head records are kept up to date on game submission
+    records = {matchup.opponent_id: matchup
+               for matchup in PlayerMatchup.objects.filter(player=player)}
+
+    engine = ratings.get_engine()
+    state = ratings.singles_state(engine, player)
+    other_players = Player.objects.exclude(id=player.id)
     results = []
     for other in other_players:
-        # Calculate the wins and losses vs. each player
-        wins = 0
-        losses = 0
-        singles1 = SinglesGame.objects.filter(player1=player, player2=other)
-        for game in singles1:
-            if game.player1_score > game.player2_score:
-                wins += 1
-            elif game.player2_score > game.player1_score:
-                losses += 1
-        singles2 = SinglesGame.objects.filter(player1=other, player2=player)
-        for game in singles2:
-            if game.player1_score > game.player2_score:
-                losses += 1
-            elif game.player2_score > game.player1_score:
-                wins += 1
+        record = records.get(other.id)
 
         # Now calculate the probability of victory based on the rating
         # compared to the other player
-        rating_difference = player.rating - other.rating
-        base_prob = 1 / (1 + math.pow(10, (rating_difference / 400)))
-        probability = 1 - base_prob
+        probability = engine.win_probability(state, ratings.singles_state(engine, other))
         probability = round(probability * 100, 1)
         player_obj = {
             'name' : other.name,
             'probability' : probability,
             'rating' : other.rating,
             'id' : other.id,
-            'wins' : wins,
-            'losses' : losses,
+            'wins' : record.wins if record else 0,
+            'losses' : record.losses if record else 0,
         }
         results.append( player_obj )
 
@@ -174,17 +320,6 @@ def _validate_and_submit_singles_post(request):
         return_data['error'] = True
         return return_data
 
-    if player1_score == '' or player1_score is None:
-        player1_score = 0
-    if player2_score == '' or player2_score is None:
-        player2_score = 0
-    try:
-        player1_score = int(player1_score)
-        player2_score = int(player2_score)
-    except Exception:
-        return_data['error_message'] = 'Player score must be an integer! Clown.'
-        return_data['error'] = True
-        return return_data
     try:
         player1_id = int(player1_id)
         player2_id = int(player2_id)
@@ -193,78 +328,85 @@ def _validate_and_submit_singles_post(request):
         return_data['error'] = True
         return return_data
 
-    player1 = Player.objects.get(id=player1_id)
-    player2 = Player.objects.get(id=player2_id)
-
-    if not player1 and not player2:
-        return_data['error_message'] = "Players do not exist! Clown."
+    player1_score, player2_score, error_message = validate_scores(
+        player1_score, player2_score, 'Player')
+    if error_message:
+        return_data['error_message'] = error_message
         return_data['error'] = True
         return return_data
 
-    # Check the scores to make sure they are in the range of 0-11
-    if player1_score < 0 or player1_score > 11:
-        return_data['error_message'] = 'Player 1 score was outside the range of 0-11! Clown.'
-        return_data['error'] = True
-        return return_data
-     # Check the scores to make sure they are in the range of 0-11
-    if player2_score < 0 or player2_score > 11:
-        return_data['error_message'] = 'Player 2 score was outside the range of 0-11! Clown.'
-        return_data['error'] = True
-        return return_data
-    # House rules. If a tiebreaker (win by 2) happened, the winning score must be 11-9.
-    if player1_score == 11 or player2_score == 11:
-        if player1_score != 9 and player2_score != 9:
-            return_data['error_message'] = 'If win-by-two (tiebreaker), the resulting score must be 11-9!'
-            return_data['error'] = True
-            return return_data
-    # House rules, cannot win by 1.
-    if player1_score == 10 or player2_score == 10:
-        if player1_score == 9 or player2_score == 9:
-            return_data['error_message'] = 'If win-by-two (tiebreaker), the resulting score must be 11-9!'
-            return_data['error'] = True
-            return return_data
-
-    if player1_score != 10 and player2_score != 10 and player1_score != 11 and player2_score != 11:
-        if player1_score - player2_score != 0:
-            return_data['error_message'] = 'Surely somebody won the game?'
+    # Everything from reading the ratings to writing the results happens
+    # under a lock on both players, so concurrent submissions can't lose
+    # each other's updates.
+    with transaction.atomic():
+        players = lock_participants(Player, [player1_id, player2_id])
+        if len(players) != 2:
+            return_data['error_message'] = "Players do not exist! Clown."
             return_data['error'] = True
             return return_data
+        player1 = players[player1_id]
+        player2 = players[player2_id]
+
+        engine = ratings.get_engine()
+        p1_start_rating, p2_start_rating = player1.rating, player2.rating
+        p1_end_rating, p2_end_rating = ratings.rate_singles(
+            engine, player1, player2, player1_score, player2_score)
+
+        s = SinglesGame(
+            player1=player1,
+            player2=player2,
+            player1_score=player1_score,
+            player2_score=player2_score,
+            player1_start_rating=p1_start_rating,
+            player2_start_rating=p2_start_rating,
+            player1_end_rating=p1_end_rating,
+            player2_end_rating=p2_end_rating,
+        )
+        s.save()
+
+        if player1_score > player2_score:
+            player1_result, player2_result = 'singles_wins', 'singles_losses'
+        elif player2_score > player1_score:
+            player1_result, player2_result = 'singles_losses', 'singles_wins'
+        else:
+            player1_result, player2_result = 'singles_draws', 'singles_draws'
+
+        _update_participants(Player, {
+            player1.id: p1_end_rating,
+            player2.id: p2_end_rating,
+        }, {
+            player1.id: [player1_result, 'singles_games_played'],
+            player2.id: [player2_result, 'singles_games_played'],
+        }, _rating_states(engine, players))
+
+        _record_matchup(player1, player2, player1_score, player2_score, s.date)
+        _record_matchup(player2, player1, player2_score, player1_score, s.date)
+        rating_history.record_game(s)
+        transaction.on_commit(bump_ratings_version)
+        transaction.on_commit(lambda: live.publish_game(s))
 
-    p1_end_rating = _calculate_elo(player1.rating, player2.rating, player1_score, player2_score)
-    p2_end_rating = _calculate_elo(player2.rating, player1.rating, player2_score, player1_score)
-
-    s = SinglesGame(
-        player1=player1,
-        player2=player2,
-        player1_score=player1_score,
-        player2_score=player2_score,
-        player1_start_rating=player1.rating,
-        player2_start_rating=player2.rating,
-        player1_end_rating=p1_end_rating,
-        player2_end_rating=p2_end_rating,
-    )
-    s.save()
-
-    if player1_score > player2_score:
-        player1.singles_wins += 1
-        player2.singles_losses += 1
-    elif player2_score > player1_score:
-        player2.singles_wins += 1
-        player1.singles_losses += 1
-    else:
-        player1.singles_draws += 1
-        player2.singles_draws += 1
+    return return_data
 
-    player1.singles_games_played += 1
-    player2.singles_games_played += 1
 
-    # Update ratings
-    player1.rating = p1_end_rating
-    player2.rating = p2_end_rating
-    player1.save()
-    player2.save()
+def _record_matchup(player, opponent, player_score, opponent_score, date):
+    if player_score > opponent_score:
+        result = 'wins'
+    elif player_score < opponent_score:
+        result = 'losses'
+    else:
+        result = 'draws'
 
-    return return_data
+    # An import or a correction may already have recorded a later game
+    last_played = Case(
+        When(Q(last_played__isnull=True) | Q(last_played__lt=date), then=Value(date)),
+        default=F('last_played'),
+        output_field=DateTimeField())
+    updated = PlayerMatchup.objects\
+        .filter(player=player, opponent=opponent)\
+        .update(last_played=last_played, **{result: F(result) + 1})
+    if not updated:
+        PlayerMatchup.objects.create(player=player, opponent=opponent,
+                                     last_played=date, **{result: 1})
 
 
 def _validate_and_submit_doubles_post(request):
@@ -286,13 +428,13 @@ def _validate_and_submit_doubles_post(request):
         return_data['error'] = True
         return return_data
 
-    team1 = _validate_and_get_team(team1player1, team1player2)
+    team1 = _validate_team(team1player1, team1player2)
     if not team1:
         return_data['error_message'] = 'Team 1 is invalid.'
         return_data['error'] = True
         return return_data
 
-    team2 = _validate_and_get_team(team2player1, team2player2)
+    team2 = _validate_team(team2player1, team2player2)
     if not team2:
         return_data['error_message'] = 'Team 2 is invalid.'
         return_data['error'] = True
@@ -304,150 +446,124 @@ def _validate_and_submit_doubles_post(request):
         return_data['error'] = True
         return return_data
 
-    if team1_score == '' or team1_score is None:
-        team1_score = 0
-    if team2_score == '' or team2_score is None:
-        team2_score = 0
-    try:
-        team1_score = int(team1_score)
-        team2_score = int(team2_score)
-    except Exception:
-        return_data['error_message'] = 'team score must be an integer! Clown.'
+    team1_score, team2_score, error_message = validate_scores(
+        team1_score, team2_score, 'team')
+    if error_message:
+        return_data['error_message'] = error_message
         return_data['error'] = True
         return return_data
 
-    # Check the scores to make sure they are in the range of 0-11
-    if team1_score < 0 or team1_score > 11:
-        return_data['error_message'] = 'team 1 score was outside the range of 0-11! Clown.'
-        return_data['error'] = True
-        return return_data
-     # Check the scores to make sure they are in the range of 0-11
-    if team2_score < 0 or team2_score > 11:
-        return_data['error_message'] = 'team 2 score was outside the range of 0-11! Clown.'
-        return_data['error'] = True
-        return return_data
-    # House rules. If a tiebreaker (win by 2) happened, the winning score must be 11-9.
-    if team1_score == 11 or team2_score == 11:
-        if team1_score != 9 and team2_score != 9:
-            return_data['error_message'] = 'If win-by-two (tiebreaker), the resulting score must be 11-9!'
-            return_data['error'] = True
-            return return_data
-    # House rules, cannot win by 1.
-    if team1_score == 10 or team2_score == 10:
-        if team1_score == 9 or team2_score == 9:
-            return_data['error_message'] = 'If win-by-two (tiebreaker), the resulting score must be 11-9!'
-            return_data['error'] = True
-            return return_data
-
-    # TODO: Allow draws
-    if team1_score != 10 and team2_score != 10 and team1_score != 11 and team2_score != 11:
-        if team1_score - team2_score != 0:
-            return_data['error_message'] = 'Surely somebody won the game?'
+    with transaction.atomic():
+        players = lock_participants(Player, team1 + team2)
+        if len(players) != len(set(team1 + team2)):
+            return_data['error_message'] = "Players do not exist! Clown."
             return_data['error'] = True
             return return_data
+        team1 = get_team(*team1)
+        team2 = get_team(*team2)
+        teams = lock_participants(Team, [team1.id, team2.id])
+        team1 = teams[team1.id]
+        team2 = teams[team2.id]
+        # The game published on commit shows the players' names
+        for team in (team1, team2):
+            team.player1 = players[team.player1_id]
+            team.player2 = players[team.player2_id]
+
+        engine = ratings.get_engine()
+        t1_start_rating, t2_start_rating, t1_end_rating, t2_end_rating = ratings.rate_doubles(
+            engine, team1, team2, team1_score, team2_score)
+
+        s = DoublesGame(
+            team1=team1,
+            team2=team2,
+            team1_score=team1_score,
+            team2_score=team2_score,
+            team1_start_rating=t1_start_rating,
+            team2_start_rating=t2_start_rating,
+            team1_end_rating=t1_end_rating,
+            team2_end_rating=t2_end_rating,
+        )
+        s.save()
+
+        if team1_score > team2_score:
+            team1_result, team2_result = 'wins', 'losses'
+        elif team2_score > team1_score:
+            team1_result, team2_result = 'losses', 'wins'
+        else:
+            team1_result, team2_result = 'draws', 'draws'
 
-    t1_end_rating = _calculate_elo(team1.rating, team2.rating, team1_score, team2_score)
-    t2_end_rating = _calculate_elo(team2.rating, team1.rating, team2_score, team1_score)
-
-    s = DoublesGame(
-        team1=team1,
-        team2=team2,
-        team1_score=team1_score,
-        team2_score=team2_score,
-        team1_start_rating=team1.rating,
-        team2_start_rating=team2.rating,
-        team1_end_rating=t1_end_rating,
-        team2_end_rating=t2_end_rating,
-    )
-    s.save()
-
-    if team1_score > team2_score:
-        team1.wins += 1
-        team2.losses += 1
-        team1.player1.doubles_wins += 1
-        team1.player2.doubles_wins += 1
-        team2.player1.doubles_losses += 1
-        team2.player2.doubles_losses += 1
-    elif team2_score > team1_score:
-        team2.wins += 1
-        team1.losses += 1
-        team2.player1.doubles_wins += 1
-        team2.player2.doubles_wins += 1
-        team1.player1.doubles_losses += 1
-        team1.player2.doubles_losses += 1
-    else:
-        team1.draws += 1
-        team2.draws += 1
-        team1.player1.doubles_draws += 1
-        team1.player2.doubles_draws += 1
-        team2.player1.doubles_draws += 1
-        team2.player2.doubles_draws += 1
-
-    team1.player1.doubles_games_played += 1
-    team1.player2.doubles_games_played += 1
-    team2.player1.doubles_games_played += 1
-    team2.player2.doubles_games_played += 1
-    team1.games_played += 1
-    team2.games_played += 1
-
-    team1.player1.save()
-    team1.player2.save()
-    team2.player1.save()
-    team2.player2.save()
-
-    # Update ratings
-    team1.rating = t1_end_rating
-    team2.rating = t2_end_rating
-    team1.save()
-    team2.save()
+        team_ratings = {
+            team1.id: t1_end_rating,
+            team2.id: t2_end_rating,
+        }
+        if engine.team_skills:
+            # Every other team of these players has a new rating too
+            team_ratings = ratings.team_ratings(engine, players)
+        _update_participants(Team, team_ratings, {
+            team1.id: [team1_result, 'games_played'],
+            team2.id: [team2_result, 'games_played'],
+        })
+        _update_participants(Player, {}, {
+            team1.player1_id: ['doubles_' + team1_result, 'doubles_games_played'],
+            team1.player2_id: ['doubles_' + team1_result, 'doubles_games_played'],
+            team2.player1_id: ['doubles_' + team2_result, 'doubles_games_played'],
+            team2.player2_id: ['doubles_' + team2_result, 'doubles_games_played'],
+        }, _rating_states(engine, players))
+        transaction.on_commit(bump_ratings_version)
+        transaction.on_commit(lambda: live.publish_game(s))
 
     return return_data
 
 
-def _validate_and_get_team(player1_id, player2_id):
+def _update_participants(model, ratings, counters, states=None):
+    """
+    Writes new ratings and bumps result counters for several `model` rows
+    in a single UPDATE. `ratings` maps ids to their new rating and
+    `counters` maps ids to the names of the counters to increment.
+    `states` maps player ids to their new rating_state.
+    """
+    changes = {}
+    if ratings:
+        changes['rating'] = Case(
+            *[When(id=pk, then=Value(rating)) for pk, rating in ratings.items()],
+            default=F('rating'),
+            output_field=IntegerField())
+    if states:
+        changes['rating_state'] = Case(
+            *[When(id=pk, then=Value(state)) for pk, state in states.items()],
+            default=F('rating_state'),
+            output_field=TextField())
+
+    increments = {}
+    for pk, fields in counters.items():
+        for field in fields:
+            by_id = increments.setdefault(field, {})
+            by_id[pk] = by_id.get(pk, 0) + 1
+    for field, by_id in increments.items():
+        changes[field] = F(field) + Case(
+            *[When(id=pk, then=Value(count)) for pk, count in by_id.items()],
+            default=Value(0),
+            output_field=IntegerField())
+
+    model.objects\
+        .filter(id__in=set(ratings) | set(counters) | set(states or ()))\
+        .update(**changes)
+
+
+def _rating_states(engine, players):
+    """The rating_state of `players` (keyed by id) to save, if the engine keeps any."""
+    if not engine.keeps_state:
+        return {}
+    return {player_id: player.rating_state for player_id, player in players.items()}
+
+
+def _validate_team(player1_id, player2_id):
+    """
+    Returns the ids of a submitted team as a canonical (lower, higher)
+    pair, or None if they aren't ids at all.
+    """
     try:
-        int(player1_id)
-        int(player2_id)
+        return tuple(sorted((int(player1_id), int(player2_id))))
     except Exception:
         return None
 
-    player1 = Player.objects.get(id=player1_id)
-    player2 = Player.objects.get(id=player2_id)
-    if not player1 and not player2:
-        return None
-
-    team = Team.objects.filter(player1=player1, player2=player2).first()
-    if team:
-        return team
-    team = Team.objects.filter(player1=player2, player2=player1).first()
-    if team:
-        return team
-
-    # The team does not exist, so we insert it
-    t = Team(player1=player1, player2=player2)
-    t.save()
-
-    return t
-
-
-def _calculate_elo(player_rating, opponent_rating, player_score, opponent_score):
-    # sa = actual score
-    # ea = expected score
-
-    if player_score < opponent_score:
-        sa = 0
-    if player_score > opponent_score:
-        sa = 1
-    if player_score == opponent_score:
-        sa = 0.5
-    ea = 1 / (1 + math.pow(10, ((opponent_rating - player_rating) / 400)))
-
-    # k = "k-factor"
-    k = 32
-    if player_rating > 2100 and player_rating < 2400:
-        k = 24
-    if player_rating > 2400:
-        k = 16
-
-    new_rating = player_rating + k * (sa - ea)
-    return round(new_rating)
@@ -0,0 +1,23 @@
+"""
+ASGI config for tabletracker project.
+
+It exposes the ASGI callable as a module-level variable named
+``application``. Serve it with any ASGI server, for example:
+
+    uvicorn tabletracker.asgi:application
+
+See foos/asgi.py for what runs on the event loop and what doesn't.
+"""
+
+import os
+
+from django.core.wsgi import get_wsgi_application
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "tabletracker.settings")
+
+wsgi_application = get_wsgi_application()
+
+# Imported once the apps are loaded
+from foos.asgi import ASGIHandler  # noqa: E402
+
+application = ASGIHandler(wsgi_application)
@@ -41,6 +41,8 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
 ]
 
+# Add 'foos.metrics.MetricsMiddleware' first to record per-view latency
+# and query metrics, served to staff at /metrics/.
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -49,6 +51,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'foos.replicas.ReplicaMiddleware',
 ]
 
 ROOT_URLCONF = 'tabletracker.urls'
@@ -79,6 +82,55 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db', 'db.sqlite3'),
+        'CONN_MAX_AGE': 60,
+        # A file, so tests can share the test database between connections
+        'TEST': {
+            'NAME': os.path.join(BASE_DIR, 'test_db.sqlite3'),
+        },
+    }
+}
+
+# PRAGMA statements set on every new SQLite connection, none by default.
+# The profile below is opt-in: the write-ahead log lets pages be read while
+# a game is being written, and writers queue for the lock for up to
+# busy_timeout milliseconds instead of failing with "database is locked".
+# Measure it against SQLite's defaults with benchmark_sqlite first.
+FOOS_SQLITE_PRAGMAS = {}
+# FOOS_SQLITE_PRAGMAS = {
+#     'journal_mode': 'wal',
+#     'busy_timeout': 5000,
+#     'synchronous': 'normal',
+#     'mmap_size': 256 * 1024 * 1024,
+#     # Negative sizes are in KiB
+#     'cache_size': -64 * 1024,
+# }
+
+# Reads of foos data from GET requests can be spread over read-only copies
+# of the database. Add them to DATABASES, with 'TEST': {'MIRROR': 'default'},
+# and list their aliases here. Locally, sync_replicas keeps SQLite copies
+# up to date; leave CONN_MAX_AGE unset on those so every request opens the
+# latest copy.
+DATABASE_ROUTERS = ['foos.replicas.ReplicaRouter']
+FOOS_READ_REPLICAS = []
+
+# How games are rated: 'elo', 'glicko2' or 'gaussian'. The last two need
+# numpy. After switching, run replay_ratings to rate the history again.
+FOOS_RATING_ENGINE = 'elo'
+FOOS_RATING_ENGINE_OPTIONS = {}
+
+
+# Cache
+# https://docs.djangoproject.com/en/1.10/topics/cache/
+# Local memory only works for a single process. Point this at a shared
+# cache (memcached, say) when running several workers. Rendered game rows
+# are cached one entry per game, so allow for plenty of entries.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
     }
 }
 
@@ -147,5 +199,10 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db', 'db.sqlite3'),
+        'CONN_MAX_AGE': 60,
+        # A file, so tests can share the test database between connections
+        'TEST': {
+            'NAME': os.path.join(BASE_DIR, 'test_db.sqlite3'),
+        },
     }
 }